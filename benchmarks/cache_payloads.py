@@ -0,0 +1,68 @@
+"""Benchmark of the cached payloads, pickled ORM objects (what flask-caching stored) against msgpack records
+
+runs without database or redis, the models are transient objects like the ones the store service cached
+$ python -m benchmarks.cache_payloads
+"""
+import pickle
+import timeit
+from datetime import datetime
+
+import config  # noqa: F401 the models are imported by the app package first
+from src.models.store_hours import StoreHours
+from src.models.store_locations import StoreLocations
+from src.models.stores import Store
+from src.utils.records import pack, unpack
+
+STORES = 200
+LOCATIONS = 3
+NUMBER = 200
+
+
+def make_store(index):
+    store = Store('store-{:06d}'.format(index), index, 'Store {}'.format(index), 'USD', None, 'description of the store {}'.format(index))
+    store.id = index
+    store.created_at = store.updated_at = datetime(2021, 6, 1, 12, 0, index % 60)
+    return store
+
+
+def make_locations(store):
+    locations = []
+    for index in range(LOCATIONS):
+        location = StoreLocations(store.id, '{} Main street'.format(index), 'Tel Aviv', 'ISR', 32, 34, False)
+        location.id = store.id * LOCATIONS + index
+        locations.append(location)
+    return locations
+
+
+def make_hours(store):
+    hours = []
+    for day in range(7):
+        hour = StoreHours(store.id, day, None, 9, 18, False, day == 6)
+        hour.id = store.id * 7 + day
+        hours.append(hour)
+    return hours
+
+
+def run():
+    stores = [make_store(index) for index in range(1, STORES + 1)]
+    payloads = [
+        ('get_stores', stores),
+        ('get_locations', make_locations(stores[0])),
+        ('get_hours', make_hours(stores[0])),
+    ]
+    for name, value in payloads:
+        pickled = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        packed = pack(value)
+        assert [row.id for row in unpack(packed)] == [model.id for model in value]
+        print('{:14s} pickle  {:8d} bytes {:8.1f} us load {:8.1f} us dump'.format(
+            name, len(pickled),
+            min(timeit.repeat(lambda: pickle.loads(pickled), number=NUMBER, repeat=5)) / NUMBER * 1e6,
+            min(timeit.repeat(lambda: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), number=NUMBER, repeat=5)) / NUMBER * 1e6))
+        print('{:14s} msgpack {:8d} bytes {:8.1f} us load {:8.1f} us dump'.format(
+            name, len(packed),
+            min(timeit.repeat(lambda: unpack(packed), number=NUMBER, repeat=5)) / NUMBER * 1e6,
+            min(timeit.repeat(lambda: pack(value), number=NUMBER, repeat=5)) / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    run()
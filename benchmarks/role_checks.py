@@ -0,0 +1,61 @@
+"""Micro benchmark of the check_role role matching
+
+runs without database or firebase, the roles are plain objects like the ones the ORM load
+$ python -m benchmarks.role_checks
+"""
+import timeit
+from collections import namedtuple
+
+from src.utils.enums import RolesTypes
+from src.utils.roles_mask import compile_requirements, match_requirements, user_roles_mask
+
+Role = namedtuple('Role', ['name', 'is_active'])
+
+ROUTE_REQUIREMENTS = ([RolesTypes.Support.value, RolesTypes.StoreOwner.value, RolesTypes.StoreAccount.value],)
+USER_ROLES = [Role(RolesTypes.StoreCustomer.value, True), Role(RolesTypes.StoreReport.value, True), Role(RolesTypes.StoreAccount.value, True)]
+NUMBER = 200000
+
+
+def legacy_check_user_roles(roles, *requirements_roles):
+    # the loops check_user_roles used before the masks (only the tuple branch is used by check_role)
+    for requirement in requirements_roles:
+        if isinstance(requirement, (list, tuple)):
+            tuple_of_role_names = requirement
+            authorized = False
+            for role_object in roles:
+                if role_object.name in tuple_of_role_names[0]:
+                    if role_object.is_active:
+                        authorized = True
+                        break
+            if not authorized:
+                return False
+    return True
+
+
+def legacy_has_any_role(roles, role_names):
+    match_roles = 0
+    for role in role_names:
+        for user_role in roles:
+            if role == user_role.name:
+                match_roles = 1 + match_roles
+    return match_roles != 0
+
+
+def run():
+    compiled = compile_requirements((ROUTE_REQUIREMENTS,))
+    user_mask = user_roles_mask(USER_ROLES)
+    assert legacy_check_user_roles(USER_ROLES, ROUTE_REQUIREMENTS) == match_requirements(user_mask, compiled)
+
+    cases = [
+        ('check_role loops', lambda: legacy_check_user_roles(USER_ROLES, ROUTE_REQUIREMENTS)),
+        ('check_role mask', lambda: match_requirements(user_mask, compiled)),
+        ('has_any_role loops', lambda: legacy_has_any_role(USER_ROLES, ROUTE_REQUIREMENTS[0])),
+        ('has_any_role mask', lambda: user_mask & compiled[0] != 0),
+    ]
+    for name, case in cases:
+        seconds = min(timeit.repeat(case, number=NUMBER, repeat=5))
+        print('{:20s} {:8.1f} ns per check'.format(name, seconds / NUMBER * 1e9))
+
+
+if __name__ == '__main__':
+    run()
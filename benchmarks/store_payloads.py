@@ -0,0 +1,70 @@
+"""Benchmark of the /store/<code>/info payload, legacy nested marshmallow dumps against the normalized serializer
+
+runs without database, the store is a transient aggregate like the one StoreService.load_stores return
+$ python -m benchmarks.store_payloads
+"""
+import json
+import timeit
+from datetime import datetime
+
+import config  # noqa: F401 the models are imported by the app package first
+from sqlalchemy.orm.attributes import set_committed_value
+
+from src.models import Roles, User
+from src.models.store_hours import StoreHours
+from src.models.store_locations import StoreLocations
+from src.models.stores import Store
+from src.services.store import StoreService
+from src.utils.enums import StorePayloadShape
+
+LOCATIONS = 5
+HOURS = 14
+NUMBER = 500
+
+
+def make_store():
+    owner = User('owner-uid', 'owner@store.com', 'Store Owner', True, True, 'ISR', 'ILS')
+    owner.id = 1
+    roles = []
+    for index, name in enumerate(('store_owner', 'store_account', 'store_reports'), 1):
+        role = Roles(name)
+        role.id = index
+        roles.append(role)
+    set_committed_value(owner, 'roles', roles)
+
+    store = Store('store-code', owner.id, 'Store', 'USD', None, 'description of the store')
+    store.id = 1
+    store.created_at = store.updated_at = datetime(2021, 6, 1, 12, 0, 0)
+    set_committed_value(store, 'owner', owner)
+    locations = []
+    for index in range(LOCATIONS):
+        location = StoreLocations(store.id, '{} Main street'.format(index), 'Tel Aviv', 'ISR', 32, 34, False)
+        location.id = index + 1
+        set_committed_value(location, 'store', store)
+        locations.append(location)
+    hours = []
+    for index in range(HOURS):
+        location = locations[index % LOCATIONS]
+        hour = StoreHours(store.id, index % 7, location.id, 9, 18, False, False)
+        hour.id = index + 1
+        set_committed_value(hour, 'store', store)
+        set_committed_value(hour, 'location', location)
+        hours.append(hour)
+    set_committed_value(store, 'locations', locations)
+    set_committed_value(store, 'hours', hours)
+    return store
+
+
+def run():
+    store = make_store()
+    service = StoreService()
+    for shape in StorePayloadShape:
+        def render():
+            return json.dumps(service.store_payload(store, shape), separators=(',', ':'))
+
+        seconds = min(timeit.repeat(render, number=NUMBER, repeat=5)) / NUMBER
+        print('{:12s} {:8d} bytes {:8.1f} us per response'.format(shape.value, len(render()), seconds * 1e6))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,69 @@
+"""Benchmark of the /user/list free text search on a postgres table of 1M users
+
+needs a scratch postgres database with the pg_trgm extension available, the rows are seeded into
+a temporary copy of the users columns (bench_users) that is dropped at the end
+$ BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python -m benchmarks.user_search
+"""
+import os
+import time
+
+from sqlalchemy import create_engine, text
+
+ROWS = int(os.environ.get('BENCH_USERS_ROWS', 1000000))
+REPEAT = 5
+TERMS = ['smith', 'jhon', 'user-4242', '@example']
+
+SEED = """
+CREATE TABLE bench_users AS
+SELECT 'uid-' || i AS uid,
+       'user-' || i || '@example' || (i % 97) || '.com' AS email,
+       (ARRAY['john', 'jane', 'david', 'sarah', 'moshe', 'noa'])[1 + i % 6] || ' ' ||
+       (ARRAY['smith', 'cohen', 'levi', 'brown', 'miller', 'garcia'])[1 + (i / 6) % 6] || ' ' || i AS fullname
+FROM generate_series(1, :rows) AS i
+"""
+
+QUERIES = [
+    ('ilike', "SELECT uid FROM bench_users WHERE fullname ILIKE :pattern OR email ILIKE :pattern LIMIT 25"),
+    ('ilike+similar', "SELECT uid FROM bench_users WHERE fullname ILIKE :pattern OR email ILIKE :pattern OR :term <% fullname LIMIT 25"),
+    ('ranked', "SELECT uid FROM bench_users WHERE fullname ILIKE :pattern OR email ILIKE :pattern OR :term <% fullname "
+               "ORDER BY greatest(word_similarity(:term, fullname), similarity(:term, email)) DESC LIMIT 25"),
+]
+
+
+def timed(connection, sql, term):
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        connection.execute(text(sql), {'term': term, 'pattern': '%{}%'.format(term)}).fetchall()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(connection, title):
+    print(title)
+    for name, sql in QUERIES:
+        for term in TERMS:
+            print('  {:14s} {:12s} {:10.2f} ms'.format(name, term, timed(connection, sql, term) * 1000))
+
+
+def run():
+    engine = create_engine(os.environ['BENCH_DATABASE_URL'])
+    with engine.connect() as connection:
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        connection.execute(text('DROP TABLE IF EXISTS bench_users'))
+        connection.execute(text(SEED), {'rows': ROWS})
+        connection.execute(text('ANALYZE bench_users'))
+        try:
+            report(connection, 'sequential scan ({} rows)'.format(ROWS))
+            # same indexes as the migration b7e2c41f9a0d create on users
+            connection.execute(text('CREATE INDEX ix_bench_users_fullname_trgm ON bench_users USING gin (fullname gin_trgm_ops)'))
+            connection.execute(text('CREATE INDEX ix_bench_users_email_trgm ON bench_users USING gin (email gin_trgm_ops)'))
+            connection.execute(text('ANALYZE bench_users'))
+            report(connection, 'trigram gin indexes ({} rows)'.format(ROWS))
+        finally:
+            connection.execute(text('DROP TABLE IF EXISTS bench_users'))
+
+
+if __name__ == '__main__':
+    run()
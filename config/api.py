@@ -1,6 +1,7 @@
 import logging
 import os
 
+import redis
 import sentry_sdk
 from flask import Flask
 from flask_caching import Cache
@@ -10,6 +11,8 @@ from sentry_sdk.integrations.flask import FlaskIntegration
 from config import settings
 from config.database import db, migration
 from src.services.firebase import FirebaseService
+from src.services.signing_keys import SigningKeysService
+from src.utils.principal import clear_principal
 
 
 def load_application():
@@ -30,12 +33,17 @@ def load_application():
 
     firebase = FirebaseService()
     firebase.load_firebase()
+    # load the id token signing keys, each worker refresh them in the background so verification only read memory
+    signing_keys = SigningKeysService()
+    signing_keys.start()
     jwt = JWTManager(app)
     # Database ORM Initialization
     db.init_app(app)
 
     # Database Migrations Initialization
     migration.init_app(app, db)
+    # the principal of a request must never leak into the next one (tests share one app context)
+    app.teardown_request(clear_principal)
     app.logger = logging.getLogger('console')
     return app
 
@@ -58,3 +66,15 @@ else:
         'CACHE_REDIS_PASSWORD': settings[os.environ.get("FLASK_ENV", "development")].REDIS_PASSWORD
     })
 cache.init_app(app)
+
+# raw redis connection for the caches that need more than get/set (sets, expiry per entry)
+# on level of testing there is no redis as well
+if os.environ.get("FLASK_ENV", "development") == 'testing':
+    redis_client = None
+else:
+    redis_client = redis.Redis(
+        host=settings[os.environ.get("FLASK_ENV", "development")].REDIS_HOST,
+        port=settings[os.environ.get("FLASK_ENV", "development")].REDIS_PORT,
+        db=settings[os.environ.get("FLASK_ENV", "development")].REDIS_DB,
+        password=settings[os.environ.get("FLASK_ENV", "development")].REDIS_PASSWORD or None
+    )
@@ -28,6 +28,10 @@ class Config:
     FIREBASE_CONFIG = os.getenv('FIREBASE_CONFIG_FILE')
     FIREBASE_APIKEY = os.getenv('FIREBASE_APIKEY')
     FIREBASE_OWNER_ACCOUNT_UID = os.getenv('FIREBASE_OWNER_ACCOUNT_UID')
+    # when set the id token signing keys are loaded from this file and never fetched (tests / air-gapped nodes)
+    FIREBASE_SIGNING_KEYS_FILE = os.getenv('FIREBASE_SIGNING_KEYS_FILE')
+    SIGNING_KEYS_REFRESH_RATIO = float(os.getenv('SIGNING_KEYS_REFRESH_RATIO', 0.8))  # part of the max-age to wait before refresh
+    SIGNING_KEYS_RETRY_SECONDS = int(os.getenv('SIGNING_KEYS_RETRY_SECONDS', 30))
     # log file path
     # --------------------------------------------------------------------
     enable_access_log = True
@@ -42,9 +46,54 @@ class Config:
     REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
     CACHE_KEY_PREFIX = os.getenv('CACHE_KEY_PREFIX')
 
+    # verified firebase token claims cache
+    # --------------------------------------------------------------------
+    TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 2048))  # max tokens kept in each worker
+    TOKEN_CACHE_LOCAL_TTL = int(os.getenv('TOKEN_CACHE_LOCAL_TTL', 60))  # seconds a worker trust its own copy
+    TOKEN_CACHE_SHARED = os.getenv('TOKEN_CACHE_SHARED', 'True') == 'True'  # share verified claims between workers over redis
+    REVOCATION_SYNC_SECONDS = int(os.getenv('REVOCATION_SYNC_SECONDS', 5))  # how often a worker copy the revoked uids from redis
+    REVOCATION_RETENTION_SECONDS = int(os.getenv('REVOCATION_RETENTION_SECONDS', 3600))  # id tokens live one hour
+
+    # listing totals
+    # --------------------------------------------------------------------
+    COUNT_CACHE_SECONDS = int(os.getenv('COUNT_CACHE_SECONDS', 30))  # exact counts are cached per filters this long
+    COUNT_ESTIMATE_THRESHOLD = int(os.getenv('COUNT_ESTIMATE_THRESHOLD', 10000))  # count=auto trust the planner above this
+    USER_LIST_CACHE_SECONDS = int(os.getenv('USER_LIST_CACHE_SECONDS', 60))  # pages of /user/list are cached this long (writes drop them sooner)
+    USER_BATCH_MAX_UIDS = int(os.getenv('USER_BATCH_MAX_UIDS', 300))  # uids accepted by one /user/batch request
+    FIREBASE_META_TTL = int(os.getenv('FIREBASE_META_TTL', 300))  # seconds the cached firebase display_name / disabled are fresh
+    FIREBASE_META_STALE_TTL = int(os.getenv('FIREBASE_META_STALE_TTL', 3600))  # stale entries are served (and refreshed) until then
+    USER_CACHE_SECONDS = int(os.getenv('USER_CACHE_SECONDS', 21600))  # cached users, every write path update them
+    FIREBASE_META_CACHE_SIZE = int(os.getenv('FIREBASE_META_CACHE_SIZE', 4096))  # entries kept by a worker when redis is off
+    NEAR_CACHE_SIZE = int(os.getenv('NEAR_CACHE_SIZE', 1024))  # entries of each memoized method / record cache kept by a worker
+    NEAR_CACHE_TTL = int(os.getenv('NEAR_CACHE_TTL', 5))  # seconds a worker serve its own copy (pub/sub drop it sooner), 0 disable
+    MEMO_STALE_SECONDS = int(os.getenv('MEMO_STALE_SECONDS', 30))  # memoized entries are served stale this long while one worker refresh them
+    MEMO_EARLY_REFRESH_BETA = float(os.getenv('MEMO_EARLY_REFRESH_BETA', 1.0))  # eagerness of the probabilistic early refresh, 0 disable
+    MEMO_LOCK_SECONDS = int(os.getenv('MEMO_LOCK_SECONDS', 10))  # expiry of the recompute lock of a memoized key
+    MEMO_LOCK_WAIT_MS = int(os.getenv('MEMO_LOCK_WAIT_MS', 500))  # a worker without stale entry wait that long for the lock holder
+    NEGATIVE_CACHE_SECONDS = int(os.getenv('NEGATIVE_CACHE_SECONDS', 15))  # lookups of missing users / stores are cached this long
+    KNOWN_KEYS_FILTER = os.getenv('KNOWN_KEYS_FILTER', 'False') == 'True'  # bloom filters of the existing uids / store codes in each worker
+    KNOWN_KEYS_CAPACITY = int(os.getenv('KNOWN_KEYS_CAPACITY', 1000000))  # keys of each kind the filters are sized for
+    KNOWN_KEYS_ERROR_RATE = float(os.getenv('KNOWN_KEYS_ERROR_RATE', 0.01))  # false positive rate of the filters at capacity
+
+    # store payloads
+    # --------------------------------------------------------------------
+    STORE_PAYLOAD_SHAPE = os.getenv('STORE_PAYLOAD_SHAPE', 'legacy')  # default shape of /store/<code>/info (legacy / normalized), ?shape= override it
+    STORE_SNAPSHOT_SECONDS = int(os.getenv('STORE_SNAPSHOT_SECONDS', 3600))  # rendered /store/<code>/info responses (every store write render them again)
+
+    # conditional GETs (ETag / Last-Modified) and Cache-Control of the read routes
+    # --------------------------------------------------------------------
+    VALIDATORS_CACHE_SECONDS = int(os.getenv('VALIDATORS_CACHE_SECONDS', 300))  # validators kept per request, 304 are answered from them
+    CACHE_CONTROL_STORE_INFO = os.getenv('CACHE_CONTROL_STORE_INFO', 'public, no-cache')
+    CACHE_CONTROL_STORE_LIST = os.getenv('CACHE_CONTROL_STORE_LIST', 'private, no-cache')
+    CACHE_CONTROL_USER = os.getenv('CACHE_CONTROL_USER', 'private, no-cache')
+    CACHE_CONTROL_UTILS = os.getenv('CACHE_CONTROL_UTILS', 'public, max-age=86400')
+
     # elasticsearch config
     # --------------------------------------------------------------------
     ELASTICSEARCH_URL = os.getenv('ELASTICSEARCH_URL')
+    USER_SEARCH_BACKEND = os.getenv('USER_SEARCH_BACKEND', '')  # elasticsearch / memory / empty disable the user search index
+    USER_SEARCH_INDEX = os.getenv('USER_SEARCH_INDEX', 'users')  # alias of the users index
+    USER_SEARCH_BULK_SIZE = int(os.getenv('USER_SEARCH_BULK_SIZE', 500))  # documents per bulk request of a reindex
 
     # sqlalchemy database config
     # --------------------------------------------------------------------
@@ -81,6 +130,7 @@ class TestingConfig(Config):
     DEBUG = True
     SENTRY_ENABLE = False
     TESTING = True
+    USER_SEARCH_BACKEND = os.getenv('USER_SEARCH_BACKEND', 'memory')
 
 
 class ProductionConfig(Config):
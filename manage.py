@@ -1,6 +1,8 @@
 from flask_migrate import MigrateCommand
 from flask_script import Manager
 from app import app
+from src.services.signing_keys import SigningKeysService
+from src.services.user_search import UserSearchService
 from src.utils.common_methods import scan_routes, setup_owner_user, setup_accounts_user, setup_support_user
 from src.utils.firebase_utils import login_user
 
@@ -34,5 +36,24 @@ def get_id_token(email, password):
     print(user)
 
 
+@manager.command
+def dump_signing_keys(path):
+    signing_keys = SigningKeysService()
+    if not signing_keys.keys:
+        signing_keys.refresh()
+    signing_keys.dump_file(path)
+    signing_keys.stop()
+    print('signing keys saved into %s' % path)
+
+
+@manager.command
+def reindex_users():
+    user_search = UserSearchService()
+    if not user_search.enabled:
+        print('user search index is disabled (USER_SEARCH_BACKEND)')
+        return
+    print('%d users indexed' % user_search.reindex())
+
+
 if __name__ == '__main__':
     manager.run()
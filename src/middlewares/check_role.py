@@ -5,14 +5,19 @@ from config import app
 from src.exceptions.unknown_roles import UnknownRolesOrNotMatched
 from src.utils.common_methods import verify_response
 from src.utils.responses import response_error
+from src.utils.roles_mask import compile_requirements
 
 
-def check_role(*role_names):
+def check_role(*role_names, strict=False):
+    # the roles are compiled once into bit masks, each request only AND them with the user mask
+    # the requests that are not json skip the check, with strict every request is checked (routes no client may call)
+    requirements = compile_requirements(role_names)
+
     def wrapper(f):
         @wraps(f)
         def decorator(*args, **kwargs):
             from src.routes import userService
-            response = verify_response()
+            response = None if strict else verify_response()
             if response is None:
                 try:
                     res = userService.check_user_auth(request, True)
@@ -20,7 +25,7 @@ def check_role(*role_names):
                         return res
                     uid = request.uid
 
-                    if not userService.check_user_roles(uid, role_names):
+                    if not userService.check_user_roles_mask(uid, requirements):
                         raise UnknownRolesOrNotMatched(role_names)
                 except Exception as e:
                     app.logger.error(e)
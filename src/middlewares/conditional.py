@@ -0,0 +1,80 @@
+import hashlib
+import os
+from functools import wraps
+
+from flask import request
+
+import config
+from config import app
+from src.utils.caching import cache_key, fingerprint, get_value, set_value
+from src.utils.general import epoch
+from src.utils.generations import generations
+from src.utils.responses import negotiate_encoding
+
+
+def conditional(route, cache_control, namespaces=None, vary_encoding=False, precheck=True):
+    """Conditional GETs of a read route, strong ETag / Last-Modified validators and the Cache-Control of the route.
+
+    The validators of a 200 response are kept in redis (VALIDATORS_CACHE_SECONDS) under the request and the
+    generations of ``namespaces(**view_args)``, so a write that bump them (see src.utils.generations) retire them.
+    A request whose If-None-Match / If-Modified-Since match the kept validators get a 304 before the view run, no
+    database and no serializer. Otherwise the view run and the 304 is decided on its response. The ETag is the hash
+    of the body, with ``vary_encoding`` the negotiated encoding is part of the key (gzip bodies have their own tag).
+    The Last-Modified is the one the view set on the response.
+    A route whose response has data no generation follow (the firebase metadata of /user/<uid>) set ``precheck=False``,
+    the view always run and only the body of a 304 is saved.
+    Put it under the auth decorators, a 304 must not skip them.
+    """
+    timeout = config.settings[os.environ.get("FLASK_ENV", "development")].VALIDATORS_CACHE_SECONDS
+
+    def wrapper(f):
+        @wraps(f)
+        def decorator(*args, **kwargs):
+            key = None
+            if precheck:
+                versions = generations(*namespaces(**kwargs)) if namespaces is not None else []
+                encoding = negotiate_encoding() if vary_encoding else None
+                key = cache_key('validators', route, fingerprint(versions, kwargs, sorted(request.args.items(multi=True)), encoding))
+                validators = get_value(key)
+                if validators is not None and is_not_modified(validators):
+                    return not_modified_response(validators, cache_control, vary_encoding)
+
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            validators = {
+                'etag': hashlib.sha1(response.get_data()).hexdigest(),
+                'last_modified': epoch(response.last_modified) if response.last_modified is not None else None,
+            }
+            if key is not None:
+                set_value(key, validators, timeout)
+            if is_not_modified(validators):
+                return not_modified_response(validators, cache_control, vary_encoding)
+            apply_validators(response, validators, cache_control)
+            return response
+        return decorator
+    return wrapper
+
+
+def is_not_modified(validators):
+    # If-None-Match win over If-Modified-Since (RFC 7232 section 6)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(validators['etag'])
+    if request.if_modified_since is not None and validators['last_modified'] is not None:
+        return epoch(request.if_modified_since) >= validators['last_modified']
+    return False
+
+
+def apply_validators(response, validators, cache_control):
+    response.set_etag(validators['etag'])
+    if validators['last_modified'] is not None:
+        response.last_modified = validators['last_modified']
+    response.headers['Cache-Control'] = cache_control
+
+
+def not_modified_response(validators, cache_control, vary_encoding):
+    response = app.response_class(status=304)
+    apply_validators(response, validators, cache_control)
+    if vary_encoding:
+        response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,29 @@
+"""users trigram search indexes
+
+Revision ID: b7e2c41f9a0d
+Revises: aace8b1bfe38
+Create Date: 2026-10-18 10:12:41.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2c41f9a0d'
+down_revision = 'aace8b1bfe38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # GIN trigram indexes serve ILIKE '%name%' and the similarity operators of the user search
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_users_fullname_trgm', 'users', ['fullname'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'fullname': 'gin_trgm_ops'})
+    op.create_index('ix_users_email_trgm', 'users', ['email'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_users_email_trgm', table_name='users')
+    op.drop_index('ix_users_fullname_trgm', table_name='users')
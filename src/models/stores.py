@@ -24,6 +24,9 @@ class Store(TimestampMixin, db.Model):
     is_maintenance = db.Column(Boolean, nullable=False, default=False)
 
     owner = db.relationship(User, uselist=False)
+    # read side of the store aggregate (see StoreService.load_stores), the rows are written through their own models
+    locations = db.relationship('StoreLocations', viewonly=True, order_by='StoreLocations.id')
+    hours = db.relationship('StoreHours', viewonly=True, order_by='StoreHours.id')
 
     def __init__(self, store_code, owner_id, name, default_currency_code, logo_id=None, description=None, is_maintenance=False):
         self.store_code = store_code
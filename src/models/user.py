@@ -4,6 +4,7 @@ from sqlalchemy import Integer, String, Boolean
 
 from config.database import db
 from src.models.mixin.TimestampMixin import TimestampMixin
+from src.utils.roles_mask import roles_mask, user_roles_mask
 
 
 class User(TimestampMixin, db.Model):
@@ -11,6 +12,11 @@ class User(TimestampMixin, db.Model):
     This is a base user Model
     """
     __tablename__ = 'users'
+    __table_args__ = (
+        # trigram indexes for the user search (postgres only, see migration b7e2c41f9a0d)
+        db.Index('ix_users_fullname_trgm', 'fullname', postgresql_using='gin', postgresql_ops={'fullname': 'gin_trgm_ops'}),
+        db.Index('ix_users_email_trgm', 'email', postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(Integer, primary_key=True)
     uid = db.Column(String(100), nullable=False)
@@ -57,25 +63,26 @@ class User(TimestampMixin, db.Model):
     def to_dict(self):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
+    @property
+    def role_mask(self):
+        # cached on the instance, add_user_roles reset it
+        mask = self.__dict__.get('_role_mask')
+        if mask is None:
+            mask = user_roles_mask(self.roles)
+            self.__dict__['_role_mask'] = mask
+        return mask
+
     def has_any_role(self, roles):
-        match_roles = 0
-        for role in roles:
-            for user_role in self.roles:
-                if role == user_role.name:
-                    match_roles = 1 + match_roles
-        return match_roles != 0
+        return self.role_mask & roles_mask(roles) != 0
 
     def has_role(self, roles):
-        match_roles = 0
-        for role in roles:
-            for user_role in self.roles:
-                if role == user_role.name:
-                    match_roles = 1 + match_roles
-        return match_roles == len(roles)
+        required = roles_mask(roles)
+        return self.role_mask & required == required
 
     def add_user_roles(self, roles):
         for role in roles:
             self.roles.append(role)
+        self.__dict__.pop('_role_mask', None)
 
     def remove_user_roles(self, roles):
         for role in roles:
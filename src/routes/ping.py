@@ -4,8 +4,17 @@ from firebase_admin.auth import UserNotFoundError
 from firebase_admin.exceptions import FirebaseError
 from config import settings
 from config.api import app as current_app
+from src.middlewares.check_role import check_role
+from src.utils.enums import RolesTypes
+from src.utils.record_cache import cache_stats
 from src.utils.responses import  response_success
 
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/ping/health"))
 def get_health():
-    return response_success({"status": "OK"})
\ No newline at end of file
+    return response_success({"status": "OK"})
+
+
+@current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/ping/cache"))
+@check_role([RolesTypes.Support.value, RolesTypes.Owner.value], strict=True)
+def get_cache_stats():
+    return response_success(cache_stats())
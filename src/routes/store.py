@@ -6,29 +6,39 @@ from marshmallow import ValidationError
 from config import settings
 from config.api import app as current_app
 from src.middlewares.check_role import check_role
+from src.middlewares.conditional import conditional
 from src.schemas.requests.store import RequestStoreCreate, RequestStoreUpdate, RequestStoreLocationSchema, RequestStoreHourSchema
+from src.services.store import store_list_namespaces, store_owner_namespaces
 from src.utils.common_methods import verify_uid
-from src.utils.enums import RolesTypes
-from src.utils.general import Struct
-from src.utils.responses import response_success, response_error
+from src.utils.enums import RolesTypes, StorePayloadShape
+from src.utils.general import Struct, last_modified_of
+from src.utils.responses import negotiate_encoding, response_success, response_error, response_rendered
 from src.utils.validations import valid_currency_code
 from src.routes import userService, storeService
 
 
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/store/<store_code>/info"))
+@conditional('store_info', settings[os.environ.get("FLASK_ENV", "development")].CACHE_CONTROL_STORE_INFO, store_owner_namespaces, vary_encoding=True)
 def get_store_info(store_code):
-    store = storeService.get_store_by_status_code(store_code)
-    if store is None:
-        response_error("error store not existed", {store_code: store_code})
+    try:
+        shape = StorePayloadShape(request.args.get('shape', settings[os.environ.get("FLASK_ENV", "development")].STORE_PAYLOAD_SHAPE))
+    except ValueError:
+        return response_error("shape not supported", {'shape': request.args.get('shape')})
+    encoding = negotiate_encoding()
+    snapshot = storeService.get_store_snapshot(store_code, shape, encoding)
+    if snapshot is None:
+        return response_error("error store not existed", {'store_code': store_code}, 404)
 
-    return response_success(store)
+    body, last_modified = snapshot
+    return response_rendered(body, 'gzip' if encoding == 'gzip' else None, last_modified)
 
 
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/store/list"))
 @check_role([RolesTypes.Support.value, RolesTypes.Owner.value, RolesTypes.Accounts.value, RolesTypes.Reports.value])
+@conditional('store_list', settings[os.environ.get("FLASK_ENV", "development")].CACHE_CONTROL_STORE_LIST, store_list_namespaces)
 def list_stores():
     stores = storeService.get_stores()
-    return response_success(stores)
+    return response_success(stores, last_modified_of(*[store['created_at'] for store in stores], *[store['updated_at'] for store in stores]))
 
 
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/store/<uid>/create"), methods=["POST"])
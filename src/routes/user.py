@@ -8,33 +8,30 @@ from marshmallow import ValidationError
 from config import settings
 from config.api import app as current_app
 from src.middlewares.check_role import check_role
+from src.middlewares.conditional import conditional
 from src.middlewares.check_token import check_token_register_firebase_user, check_token_of_user
 from src.routes import userService, storeService, roleSerivce
-from src.schemas.requests.user import UserRolesList, CreateStoreStaffUser, UpdateUserInfo
+from src.schemas.requests.user import UserRolesList, CreateStoreStaffUser, UpdateUserInfo, UserBatchLookup
 from src.schemas.user_schema import UserSchema
-from src.utils.enums import RolesTypes
-from src.utils.general import Struct
+from src.utils.enums import RolesTypes, CountStrategy
+from src.utils.general import Struct, last_modified_of
 from src.utils.responses import response_error, response_success, response_success_paging
 from src.utils.common_methods import verify_uid
 from src.utils.validations import vaild_per_page, valid_user_list_by_permissions, valid_currency_code, valid_country_code, valid_user_list_params
 
 
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/user/<uid>"))
+# user_meta come from firebase and change without a write here, the view always run (the 304 save the body only)
+@conditional('user', settings[os.environ.get("FLASK_ENV", "development")].CACHE_CONTROL_USER, precheck=False)
 def get(uid):
     if verify_uid(userService, uid):
         try:
-            firebase_response = {
-                'display_name': '',
-                'disabled': False
-            }
-            firebase_user_object = userService.get_firebase_user(uid)
-            firebase_response['display_name'] = firebase_user_object.display_name
-            firebase_response['disabled'] = firebase_user_object.disabled
+            record = userService.get_user_record(uid)
             response = {
-                'user_meta': firebase_response,
-                'user_data': userService.get_user(uid)
+                'user_meta': userService.get_firebase_metadata(uid),
+                'user_data': userService.user_schema.dump(record, many=False)
             }
-            return response_success(response)
+            return response_success(response, last_modified_of(record['created_at'], record['updated_at']))
         except ValueError:
             current_app.logger.error("User not found", {uid: uid})
             return response_error("Error on format of the params", {uid: uid})
@@ -46,11 +43,28 @@ def get(uid):
     return response_error("Error on format of the params", {uid: uid})
 
 
+@current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/user/batch"), methods=["POST"])
+@check_role([RolesTypes.Support.value, RolesTypes.Accounts.value, RolesTypes.Owner.value])
+def get_users_batch():
+    if not request.is_json:
+        return response_error("Request Data must be in json format", request.data)
+    try:
+        schema = UserBatchLookup()
+        data = schema.load(request.json)
+    except ValidationError as e:
+        return response_error("Error on format of the params", {'params': request.json})
+    return response_success(userService.get_users_batch(data['uids']))
+
+
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/user/list"))
 @check_token_of_user
 def get_users():
     per_page = request.args.get('per_page', type=int)
     page = request.args.get('page', type=int)
+    # paging=cursor opt in the keyset pagination (cursor / next_cursor / prev_cursor instead of page numbers)
+    is_cursor_paging = request.args.get('paging') == 'cursor'
+    if is_cursor_paging and not vaild_per_page(per_page):
+        return response_error("Error on support per page invalid", {'per_page': per_page}, 400)
     if not vaild_per_page(per_page) and isinstance(page, int):
         return response_error("Error on support per page or page number invalid", {'per_page': 'per_page', page: page},400)
     is_platform = False
@@ -72,6 +86,8 @@ def get_users():
         'countries': [],
         'store_users': show_store_users,
         'platform': is_platform,
+        'search': None,
+        'search_ranked': request.args.get('search_ranked', type=int) == 1,
     }
 
     if request.args.get('filter_stores') is not None and request.args.get('filter_stores') != 'None':
@@ -85,6 +101,10 @@ def get_users():
 
     if request.args.get('filter_names') is not None and request.args.get('filter_names') != 'None':
         filters['names'] = request.args.get('filter_names').split(',')
+
+    # free text search over fullname and email (trigram similarity on postgres)
+    if request.args.get('filter_search') is not None and request.args.get('filter_search') != 'None':
+        filters['search'] = request.args.get('filter_search').strip()
     order_by = []
 
     if request.args.get('order_by') is not None and request.args.get('order_by') != 'None' and request.args.get('order_by') != '':
@@ -108,9 +128,37 @@ def get_users():
         filters['stores'] = result['stores']
         show_store_users = result['store_users']
 
-    result = userService.get_users(filters, orders, int(per_page), int(page), is_inactive, show_store_users)
+    # count=exact|estimate|auto|none pick how total_items is computed, cursor paging count only with with_total=1 (or count)
+    default_count = CountStrategy.Exact.value
+    if is_cursor_paging and request.args.get('with_total', type=int) != 1:
+        default_count = CountStrategy.Skip.value
+    try:
+        count = CountStrategy(request.args.get('count', default_count))
+    except ValueError:
+        return response_error("Error on count strategy invalid", {'count': request.args.get('count')}, 400)
+
     schema = UserSchema()
-    return response_success_paging(schema.dump(result.items, many=True), result.total, result.pages, result.has_next, result.has_prev)
+    if is_cursor_paging:
+        if filters['search'] and filters['search_ranked']:
+            return response_error("Error ranked search not supported by cursor paging", {'filters': filters}, 400)
+        try:
+            result = userService.get_users_by_cursor(filters, orders, int(per_page), request.args.get('cursor'), is_inactive, show_store_users, count)
+        except ValueError:
+            return response_error("Error on cursor invalid", {'cursor': request.args.get('cursor')}, 400)
+        return response_success_paging(schema.dump(result.items, many=True), result.total, result.pages, result.has_next, result.has_prev,
+                                       result.next_cursor, result.prev_cursor, result.total_is_estimate)
+
+    # search_index=1 route the name / email / country / free text search to the user search index (database when it is off)
+    # the index match the start of words where the database match any substring
+    result = None
+    if request.args.get('search_index', type=int) == 1 and (filters['names'] or filters['emails'] or filters['countries'] or filters['search']):
+        result = userService.search_users(filters, orders, int(per_page), int(page), is_inactive, show_store_users)
+    if result is None:
+        result = userService.list_users(filters, orders, int(per_page), int(page), is_inactive, show_store_users, count)
+        return response_success_paging(result['items'], result['total'], result['pages'], result['has_next'], result['has_prev'],
+                                       total_is_estimate=result['total_is_estimate'])
+    return response_success_paging(schema.dump(result.items, many=True), result.total, result.pages, result.has_next, result.has_prev,
+                                   total_is_estimate=result.total_is_estimate)
 
 
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/user/<uid>/toggle_active"), methods=["PUT"])
@@ -118,8 +166,8 @@ def get_users():
 def user_toggle_active(uid):
     if verify_uid(userService, uid):
         try:
-            userService.toggle_freeze_user(uid)
-            return response_success({})
+            row = userService.toggle_freeze_user(uid)
+            return response_success({'changed': row is not None})
         except ValueError:
             current_app.logger.error("User not found", {uid: uid})
             return response_error("Error on format of the params", {uid: uid})
@@ -162,8 +210,8 @@ def get_store_users(store_code, per_page, page):
 def mark_user_passed_tutorial(uid):
     if verify_uid(userService, uid):
         try:
-            userService.mark_user_passed_tutorial(uid)
-            return response_success({})
+            row = userService.mark_user_passed_tutorial(uid)
+            return response_success({'changed': row is not None})
         except ValueError:
             current_app.logger.error("User not found", {uid: uid})
             return response_error("Error on format of the params", {uid: uid})
@@ -189,8 +237,8 @@ def update_user_info():
     if not valid_currency_code(data.currency) or not valid_country_code(data.country):
         return response_error("Error on format of the params", {'params': request.json})
     uid = request.uid
-    userService.update_user_info(uid, data)
-    return response_success({})
+    row = userService.update_user_info(uid, data)
+    return response_success({'changed': row is not None})
 
 
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/user/<uid>/update"), methods=["PUT"])
@@ -199,10 +247,10 @@ def update_user_info_by_support_user(uid):
     if not request.is_json:
         return response_error("Request Data must be in json format", request.data)
     if verify_uid(userService, uid):
-        if userService.user_has_role_matched(request.uid, [RolesTypes.StoreSupport.value]):
+        requester = userService.get_principal(request.uid)
+        if requester.has_role([RolesTypes.StoreSupport.value]):
             user = userService.get_user(uid, True)
-            requester_user = userService.get_user(request.uid, True)
-            if user.store_code != requester_user.store_code:
+            if user.store_code != requester.store_code:
                 return response_error("Error support store user not matched with user (not in same store)", {'params': request.json})
 
         try:
@@ -213,8 +261,8 @@ def update_user_info_by_support_user(uid):
         data = Struct(data)
         if not valid_currency_code(data.currency) or not valid_country_code(data.country):
             return response_error("Error on format of the params", {'params': request.json})
-        userService.update_user_info(uid, data)
-        return response_success({})
+        row = userService.update_user_info(uid, data)
+        return response_success({'changed': row is not None})
     return response_error("Error on format of the params", {'uid': uid})
 
 
@@ -229,9 +277,9 @@ def create_store_stuff(store_code):
     except ValidationError as e:
         return response_error("Error on format of the params", {'params': request.json})
 
-    if userService.user_has_any_role_matched(request.uid, [RolesTypes.StoreSupport.value, RolesTypes.StoreOwner.value]):
-        requester_user = userService.get_user(request.uid, True)
-        if store_code != requester_user.store_code:
+    requester = userService.get_principal(request.uid)
+    if requester.has_any_role([RolesTypes.StoreSupport.value, RolesTypes.StoreOwner.value]):
+        if store_code != requester.store_code:
             return response_error("Error support store user not matched with user (not in same store)", {'params': request.json})
     data = Struct(data)
     if not roleSerivce.check_roles(data.roles):
@@ -299,11 +347,12 @@ def sync_store_user_create(uid, store_code):
 
 
 def sync_user_from_firebase_user(uid, role_names, is_platform_user, store_code=None, new_user=True):
-    user_object = userService.get_firebase_user(uid).__dict__['_data']
+    firebase_user = userService.get_firebase_user(uid)
+    user_object = firebase_user.__dict__['_data']
     response = {'user': json.dumps(user_object, indent=4), 'extend_info': None}
     roles = roleSerivce.get_roles(role_names)
     email = user_object['email']
     fullname = user_object['displayName']
-    userService.sync_firebase_user(uid, roles, email, fullname, is_platform_user, store_code, new_user)
+    userService.sync_firebase_user(uid, roles, email, fullname, is_platform_user, store_code, new_user, firebase_user)
     response['extend_info'] = userService.get_user(uid)
     return response
@@ -1,24 +1,31 @@
 import os
+from datetime import datetime
 
 import pycountry
 from config import settings
 from config.api import app as current_app
+from src.middlewares.conditional import conditional
 from src.utils.responses import response_success
 
+# the countries / currencies change only with the pycountry databases
+DATABASES_MODIFIED = datetime.utcfromtimestamp(os.path.getmtime(pycountry.DATABASE_DIR))
+
 
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/utils/countries"))
+@conditional('utils_countries', settings[os.environ.get("FLASK_ENV", "development")].CACHE_CONTROL_UTILS)
 def get_countries():
     countries = {}
     for country in list(pycountry.countries):
         obj = {"{}".format(country.alpha_3): country.__dict__['_fields']}
         countries.update(obj)
-    return response_success(countries)
+    return response_success(countries, DATABASES_MODIFIED)
 
 
 @current_app.route(settings[os.environ.get("FLASK_ENV", "development")].API_ROUTE.format(route="/utils/currencies"))
+@conditional('utils_currencies', settings[os.environ.get("FLASK_ENV", "development")].CACHE_CONTROL_UTILS)
 def get_currencies():
     currencies = {}
     for currency in list(pycountry.currencies):
         obj = {"{}".format(currency.alpha_3): currency.__dict__['_fields']}
         currencies.update(obj)
-    return response_success(currencies)
+    return response_success(currencies, DATABASES_MODIFIED)
@@ -12,6 +12,7 @@ class RequestStoreUpdate(RequestStoreCreate):
 
 
 class RequestStoreLocationSchema(Schema):
+    id = fields.Int(missing=None, allow_none=True)  # the location kept (and updated), without it the location is matched by its address
     lat = fields.Int(missing=None, allow_none=True)
     lng = fields.Int(missing=None, allow_none=True)
     address = fields.Str(required=True, validate=validate.Length(max=255, error='field address not valid'))
@@ -21,6 +22,7 @@ class RequestStoreLocationSchema(Schema):
 
 
 class RequestStoreHourSchema(Schema):
+    id = fields.Int(missing=None, allow_none=True)  # the hour kept (and updated), without it the hour is matched by its day and location
     location_id = fields.Int(missing=None, allow_none=True)
     day = fields.Int(required=True, validate=validate.Range(max=7, min=1, error='field day not valid'))
     from_time = fields.Int(missing=None, allow_none=True, validate=validate.Range(max=23, min=0, error='field from_time not valid'))
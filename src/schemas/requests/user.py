@@ -1,5 +1,9 @@
+import os
+
 from marshmallow import Schema, fields, validate
 
+from config import settings
+
 
 class UserRolesList(Schema):
     role_names: fields.List(
@@ -16,6 +20,14 @@ class CreateStoreStaffUser(Schema):
     password = fields.Str(required=True, validate=validate.Length(min=8, max=100, error='field name not valid'))
 
 
+class UserBatchLookup(Schema):
+    uids = fields.List(
+        fields.Str(validate=validate.Length(min=10, max=128, error='field uid not valid')),
+        required=True,
+        validate=validate.Length(min=1, max=settings[os.environ.get("FLASK_ENV", "development")].USER_BATCH_MAX_UIDS, error='field uids not valid')
+    )
+
+
 class UpdateUserInfo(Schema):
     fullname = fields.Str(required=True, validate=validate.Length(min=5, max=255, error='field fullname not valid'))
     address1 = fields.Str(missing=None, allow_none=True, validate=validate.Length(min=5, max=100, error='field address1 not valid'))
@@ -0,0 +1,82 @@
+"""Hand written serializers of the normalized store payload (see StorePayloadShape)
+
+the store and its owner appear once, locations carry the store id and hours the store and location ids,
+the fields and their formats are the ones of StoreSchema / StoreLocationSchema / StoreHourSchema
+"""
+
+
+def datetime_value(value):
+    return value.isoformat() if value is not None else None
+
+
+def role_data(role):
+    return {'id': role.id, 'name': role.name, 'is_active': role.is_active}
+
+
+def owner_data(user):
+    if user is None:
+        return None
+    return {
+        'id': user.id,
+        'uid': user.uid,
+        'email': user.email,
+        'fullname': user.fullname,
+        'address1': user.address1,
+        'address2': user.address2,
+        'phone': user.phone,
+        'is_pass_tutorial': user.is_pass_tutorial,
+        'country': user.country,
+        'store_code': user.store_code,
+        'currency': user.currency,
+        'roles': [role_data(role) for role in user.roles],
+    }
+
+
+def store_info(store):
+    return {
+        'id': store.id,
+        'store_code': store.store_code,
+        'owner': owner_data(store.owner),
+        'logo_id': store.logo_id,
+        'name': store.name,
+        'description': store.description,
+        'default_currency_code': store.default_currency_code,
+        'is_maintenance': store.is_maintenance,
+        'created_at': datetime_value(store.created_at),
+        'updated_at': datetime_value(store.updated_at),
+    }
+
+
+def location_data(location):
+    return {
+        'id': location.id,
+        'store_id': location.store_id,
+        'lat': location.lat,
+        'lng': location.lng,
+        'address': location.address,
+        'city': location.city,
+        'country_code': location.country_code,
+        'is_close': location.is_close,
+    }
+
+
+def hour_data(hour):
+    return {
+        'id': hour.id,
+        'store_id': hour.store_id,
+        'location_id': hour.store_location_id,
+        'day': hour.day,
+        'from_time': hour.from_time,
+        'to_time': hour.to_time,
+        'is_open_24': hour.is_open_24,
+        'is_close': hour.is_close,
+    }
+
+
+def normalized_store(store):
+    """ Store with its locations and hours loaded (see StoreService.load_stores) """
+    return {
+        'info': store_info(store),
+        'locations': [location_data(location) for location in store.locations],
+        'hours': [hour_data(hour) for hour in store.hours],
+    }
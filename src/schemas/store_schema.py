@@ -31,6 +31,7 @@ class StoreLocationSchema(SQLAlchemySchema):
         include_fk = True
         load_instance = True
 
+    id = auto_field()
     lat = auto_field()
     lng = auto_field()
     store = Nested(StoreSchema)
@@ -46,6 +47,7 @@ class StoreHourSchema(SQLAlchemySchema):
         include_fk = True
         load_instance = True
 
+    id = auto_field()
     store = Nested(StoreSchema)
     location = Nested(StoreLocationSchema)
     day = auto_field()
@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from cachetools import LRUCache
+from firebase_admin import auth
+from firebase_admin.exceptions import FirebaseError
+from redis import RedisError
+
+import config
+from config.api import redis_client
+from src.utils.singleton import singleton
+
+logger = logging.getLogger('console')
+
+
+@singleton
+class FirebaseMetadataService:
+    """Cache of the firebase user fields the API return (``display_name`` and ``disabled``).
+
+    Entries are fresh for ``FIREBASE_META_TTL`` seconds, after that and until ``FIREBASE_META_STALE_TTL`` they are
+    still served while a background thread fetch them again (stale while revalidate). The entries live in redis,
+    without redis (tests / local runs) in a bounded LRU of the worker. The writes of UserService put the firebase record they got back.
+    """
+    key_prefix = 'firebase_meta'
+
+    def __init__(self):
+        app_settings = config.settings[os.environ.get("FLASK_ENV", "development")]
+        self.ttl = app_settings.FIREBASE_META_TTL
+        self.stale_ttl = app_settings.FIREBASE_META_STALE_TTL
+        self.prefix = '{}:{}'.format(app_settings.CACHE_KEY_PREFIX or '', self.key_prefix)
+        self.local = LRUCache(maxsize=app_settings.FIREBASE_META_CACHE_SIZE)
+        self.lock = threading.Lock()
+        self.refreshing = set()
+
+    def key(self, uid):
+        return '{}:{}'.format(self.prefix, uid)
+
+    @staticmethod
+    def metadata(entry):
+        return {'display_name': entry['display_name'], 'disabled': entry['disabled']}
+
+    def read(self, uids):
+        if redis_client is None:
+            with self.lock:
+                return {uid: dict(self.local[uid]) for uid in uids if uid in self.local}
+        try:
+            payloads = redis_client.mget([self.key(uid) for uid in uids])
+        except RedisError:
+            return {}
+        return {uid: json.loads(payload) for uid, payload in zip(uids, payloads) if payload is not None}
+
+    def write(self, entries):
+        if redis_client is None:
+            with self.lock:
+                self.local.update(entries)
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for uid, entry in entries.items():
+                pipe.setex(self.key(uid), self.stale_ttl, json.dumps(entry))
+            pipe.execute()
+        except RedisError as e:
+            logger.error('failed store firebase metadata {}'.format(e))
+
+    def put(self, *records):
+        """ Store the metadata of firebase UserRecord objects (fetched or just created) """
+        now = time.time()
+        self.write({record.uid: {'display_name': record.display_name, 'disabled': record.disabled, 'fetched_at': now} for record in records})
+
+    def forget(self, uid):
+        if redis_client is None:
+            with self.lock:
+                self.local.pop(uid, None)
+            return
+        try:
+            redis_client.delete(self.key(uid))
+        except RedisError:
+            pass
+
+    def get(self, uid):
+        """ Metadata of the uid, raise the firebase errors (UserNotFoundError...) when it must be fetched and it failed """
+        return self.get_many([uid]).get(uid) or self.fetch(uid)
+
+    def get_many(self, uids):
+        """ Cached metadata of the uids that are fresh or stale (stale ones are refreshed in the background) """
+        now = time.time()
+        result = {}
+        for uid, entry in self.read(uids).items():
+            age = now - entry['fetched_at']
+            if age >= self.stale_ttl:
+                continue
+            if age >= self.ttl:
+                self.refresh_later(uid)
+            result[uid] = self.metadata(entry)
+        return result
+
+    def fetch(self, uid):
+        record = auth.get_user(uid)
+        self.put(record)
+        return {'display_name': record.display_name, 'disabled': record.disabled}
+
+    def refresh_later(self, uid):
+        with self.lock:
+            if uid in self.refreshing:
+                return
+            self.refreshing.add(uid)
+        threading.Thread(target=self.refresh, args=(uid,), name='firebase-meta-refresh', daemon=True).start()
+
+    def refresh(self, uid):
+        try:
+            self.fetch(uid)
+        except auth.UserNotFoundError:
+            self.forget(uid)
+        except (FirebaseError, ValueError) as e:
+            logger.error('failed refresh firebase metadata of {} {}'.format(uid, e))
+        finally:
+            with self.lock:
+                self.refreshing.discard(uid)
@@ -0,0 +1,96 @@
+import logging
+import os
+import threading
+
+import config
+from config.api import redis_client
+from src.models import User
+from src.models.stores import Store
+from src.utils.bloom import BloomFilter
+from src.utils.near_cache import add_listener, publish
+from src.utils.singleton import singleton
+
+logger = logging.getLogger('console')
+
+# the column of every kind of key
+KEY_COLUMNS = {
+    'store': Store.store_code,
+    'user': User.uid,
+}
+
+
+@singleton
+class KnownKeysService:
+    """In memory Bloom filters of the store codes and the uids that exist, so lookups of unknown keys skip redis and the database.
+
+    A worker build the filters on the first lookup (after the fork) and add the keys it create, the keys created by
+    the other workers come over the pub/sub channel of the near caches. A worker that may have lost messages build
+    the filters again on its next lookup. Optional (KNOWN_KEYS_FILTER), it needs redis to hear about the other workers.
+    A key created by another worker is unknown here until its message arrive (the pub/sub delay, usually milliseconds),
+    a lookup of it in between is answered as missing without checking the database. The worker that created the key
+    know it before it answer the request, so only a lookup racing the creation from another worker see the window.
+    """
+    listener_name = 'known_keys'
+
+    def __init__(self):
+        app_settings = config.settings[os.environ.get("FLASK_ENV", "development")]
+        self.enabled = app_settings.KNOWN_KEYS_FILTER and redis_client is not None
+        self.capacity = app_settings.KNOWN_KEYS_CAPACITY
+        self.error_rate = app_settings.KNOWN_KEYS_ERROR_RATE
+        self.filters = None
+        self.pending = None
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+
+    def might_exist(self, kind, key):
+        """ False when the key does not exist or was created by another worker whose message did not arrive yet
+            (always True when the filters are disabled)
+        """
+        if not self.enabled:
+            return True
+        filters = self.filters
+        if filters is None:
+            filters = self.rebuild()
+        return key in filters[kind]
+
+    def add(self, kind, key):
+        """ A key was created (after the commit), every worker add it to its filter """
+        if not self.enabled:
+            return
+        self.add_local(kind, key)
+        publish(self.listener_name, kind=kind, key=key)
+
+    def add_local(self, kind, key):
+        with self.lock:
+            if self.filters is not None:
+                self.filters[kind].add(key)
+            if self.pending is not None:
+                self.pending.append((kind, key))
+
+    def rebuild(self):
+        """ Load every key from the database, the keys added while it run are added after """
+        with self.build_lock:
+            if self.filters is not None:
+                return self.filters
+            add_listener(self.listener_name, lambda message: self.add_local(message['kind'], message['key']), self.invalidate)
+            with self.lock:
+                self.pending = []
+            filters = {}
+            counts = {}
+            for kind, column in KEY_COLUMNS.items():
+                keys = [key for key, in column.class_.query.with_entities(column).all()]
+                filters[kind] = BloomFilter(max(self.capacity, len(keys) * 2), self.error_rate)
+                for key in keys:
+                    filters[kind].add(key)
+                counts[kind] = len(keys)
+            with self.lock:
+                for kind, key in self.pending:
+                    filters[kind].add(key)
+                self.pending = None
+                self.filters = filters
+            logger.info('known keys filters built {}'.format(counts))
+            return filters
+
+    def invalidate(self):
+        with self.lock:
+            self.filters = None
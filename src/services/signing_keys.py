@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from http import client as http_client
+
+import firebase_admin
+import requests
+from firebase_admin import auth
+from google.auth import exceptions, transport
+from google.oauth2 import id_token
+
+import config
+from src.utils.singleton import singleton
+
+logger = logging.getLogger('console')
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+# certificates of the keys google sign the firebase id tokens with, and the issuer of the tokens of a project
+ID_TOKEN_CERT_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+ID_TOKEN_ISSUER = 'https://securetoken.google.com/{}'
+
+
+class KeysetResponse(transport.Response):
+    """ google-auth response built from the in memory keyset (never touch the network) """
+
+    def __init__(self, keys):
+        self._keys = keys
+
+    @property
+    def status(self):
+        return http_client.OK if self._keys else http_client.SERVICE_UNAVAILABLE
+
+    @property
+    def headers(self):
+        return {'content-type': 'application/json'}
+
+    @property
+    def data(self):
+        return json.dumps(self._keys).encode('utf-8')
+
+
+class KeysetRequest(transport.Request):
+    """ google-auth transport that answer the id token certificates url from the keyset manager, and nothing else """
+
+    def __init__(self, keyset):
+        self.keyset = keyset
+
+    def __call__(self, url, method='GET', body=None, headers=None, timeout=None, **kwargs):
+        if url == ID_TOKEN_CERT_URL and method == 'GET':
+            return KeysetResponse(self.keyset.keys)
+        raise exceptions.TransportError('{} is not served by the keyset'.format(url))
+
+
+@singleton
+class SigningKeysService:
+    """Keeps the google signing keys of the firebase id tokens in memory.
+
+    On start the keys are fetched once, after that a background timer fetch them again ahead of the
+    ``Cache-Control`` max-age google send with them, so verification of a token only ever read memory.
+    The timer is started by the first verification of each worker, a timer of the master does not survive the fork.
+    When ``FIREBASE_SIGNING_KEYS_FILE`` is set the keys are loaded from that file and never refreshed (tests, air-gapped nodes).
+    Tokens are checked with the public google-auth verifier (signature, expiry, audience) and the firebase claims
+    (issuer, subject), without the emulator the tokens are not signed and firebase verify them. Until the keys are
+    fetched (google was not reachable on start) firebase verify the tokens too.
+    """
+
+    def __init__(self):
+        app_settings = config.settings[os.environ.get("FLASK_ENV", "development")]
+        self.keys_file = app_settings.FIREBASE_SIGNING_KEYS_FILE
+        self.refresh_ratio = app_settings.SIGNING_KEYS_REFRESH_RATIO
+        self.retry_seconds = app_settings.SIGNING_KEYS_RETRY_SECONDS
+        self.keys = {}
+        self.request = KeysetRequest(self)
+        self.refresh_at = 0
+        self.timer = None
+        self.timer_pid = None
+        self.started = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.started:
+            return
+        if self.keys_file:
+            self.load_file(self.keys_file)
+        elif os.environ.get('FIREBASE_AUTH_EMULATOR_HOST'):
+            return  # the emulator tokens are not signed, there is nothing to verify against
+        else:
+            self.refresh()
+        self.started = True
+
+    def stop(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.timer_pid = None
+        self.started = False
+
+    def verify_id_token(self, token):
+        """ Claims of a firebase id token (with ``uid``), raise ValueError / the firebase errors when it is not valid """
+        if not self.started:
+            return auth.verify_id_token(token)
+        self.ensure_timer()
+        if not self.keys:
+            # the fetch on start failed and no refresh got them yet, firebase verify the token meanwhile
+            return auth.verify_id_token(token)
+        return self.verify(token)
+
+    def verify(self, token):
+        project_id = firebase_admin.get_app().project_id
+        claims = id_token.verify_token(token, self.request, audience=project_id, certs_url=ID_TOKEN_CERT_URL)
+        if claims.get('iss') != ID_TOKEN_ISSUER.format(project_id):
+            raise ValueError('id token has an incorrect issuer {}'.format(claims.get('iss')))
+        subject = claims.get('sub')
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise ValueError('id token has an invalid subject')
+        claims['uid'] = subject
+        return claims
+
+    def refresh(self):
+        """ Fetch the keys, the next refresh is due at SIGNING_KEYS_REFRESH_RATIO of their max-age """
+        try:
+            response = requests.get(ID_TOKEN_CERT_URL, timeout=10)
+            response.raise_for_status()
+            keys = response.json()
+            max_age = self.parse_max_age(response.headers.get('Cache-Control', ''))
+            self.keys = keys
+            delay = max(max_age * self.refresh_ratio, self.retry_seconds)
+            logger.info('signing keys refreshed ({} keys) next refresh in {}s'.format(len(keys), int(delay)))
+        except (requests.RequestException, ValueError) as e:
+            logger.error('failed refresh signing keys {}'.format(e))
+            delay = self.retry_seconds
+        self.refresh_at = time.time() + delay
+
+    def ensure_timer(self):
+        if self.keys_file or self.timer_pid == os.getpid():
+            return
+        with self.lock:
+            if self.timer_pid == os.getpid():
+                return
+            self.timer_pid = os.getpid()
+        self.schedule()
+
+    def refresh_and_schedule(self):
+        self.refresh()
+        self.schedule()
+
+    def schedule(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(max(self.refresh_at - time.time(), 0), self.refresh_and_schedule)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def parse_max_age(self, cache_control):
+        match = MAX_AGE_PATTERN.search(cache_control)
+        if match is None:
+            return 0
+        return int(match.group(1))
+
+    def load_file(self, path):
+        with open(path) as f:
+            self.keys = json.load(f)
+
+    def dump_file(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.keys, f, indent=4)
@@ -1,181 +1,318 @@
+import gzip
+import os
+from datetime import datetime
+
+from redis import RedisError
 from sqlalchemy import desc
+from sqlalchemy.orm import joinedload, selectinload
 
-from config.api import cache
+import config
+from config.api import redis_client
 from config.database import db
 import uuid
 
 from src.exceptions.params_not_match_create_store import ParamsNotMatchCreateStore
+from src.models import User
 from src.models.store_hours import StoreHours
 from src.models.store_locations import StoreLocations
 from src.models.stores import Store
+from src.schemas.store_payload import normalized_store
 from src.schemas.store_schema import StoreSchema, StoreLocationSchema, StoreHourSchema
+from src.services.known_keys import KnownKeysService
+from src.utils.caching import cache_key, fingerprint
+from src.utils.enums import StorePayloadShape
+from src.utils.general import epoch, last_modified_of
+from src.utils.generations import bump_generations, generations
+from src.utils.memoize import memoize
+from src.utils.reconcile import reconcile
+from src.utils.responses import render_success
 from src.utils.validations import valid_currency_code
 
 storeSchema = StoreSchema()
 storeLocationSchema = StoreLocationSchema()
 storeHourSchema = StoreHourSchema()
 
+NEGATIVE_CACHE_SECONDS = config.settings[os.environ.get("FLASK_ENV", "development")].NEGATIVE_CACHE_SECONDS
+STORE_SNAPSHOT_SECONDS = config.settings[os.environ.get("FLASK_ENV", "development")].STORE_SNAPSHOT_SECONDS
+
+# the store payload nest the owner with his roles in the store, its locations and its hours (hours nest their
+# location and store, both already in the identity map), the owner and locations are joined, hours come in a second query
+STORE_INFO_LOADS = (joinedload(Store.owner).joinedload(User.roles),)
+STORE_AGGREGATE_LOADS = STORE_INFO_LOADS + (joinedload(Store.locations), selectinload(Store.hours))
+
+# columns matching a submitted location / hour without id to a current one
+LOCATION_KEY = ('address', 'city', 'country_code')
+HOUR_KEY = ('day', 'store_location_id')
+
+
+# namespaces of the cached store entries (see memoize), 'stores' is part of all of them
+# the payloads nest the owner, a write of the user bump his namespace and 'stores:owners' (see owner_written)
+def store_namespace(store_code):
+    return 'store:{}'.format(store_code)
+
+
+def owner_namespace(owner_uid):
+    return 'stores:owner:{}'.format(owner_uid)
+
+
+def store_list_namespaces(*_):
+    return 'stores', 'stores:list', 'stores:owners'
+
+
+def store_namespaces(store_code, *_):
+    return 'stores', store_namespace(store_code)
+
+
+def store_owner_namespaces(store_code, *_):
+    # without redis there are no generations, the owner is not looked up for nothing
+    if redis_client is None:
+        return store_namespaces(store_code)
+    return store_namespaces(store_code) + (owner_namespace(StoreService().get_store_owner(store_code)),)
+
+
+def owner_store_namespaces(owner_uid, store_code, *_):
+    return 'stores', store_namespace(store_code), owner_namespace(owner_uid)
+
 
 class StoreService:
-    @cache.memoize(50)
+    known_keys = KnownKeysService()
+
+    @memoize(50, namespaces=store_list_namespaces, near_size=2)
     def get_stores(self, return_model=False):
-        stores = Store.query.order_by(desc(Store.created_at)).all()
+        stores = self.load_stores(order_by=desc(Store.created_at), children=False)
         if not return_model:
             return storeSchema.dump(stores, many=True)
 
         return stores
 
-    @cache.memoize(50)
-    def get_store(self, owner_uid, store_code, return_model=False):
-        store = Store.query.filter_by(owner_id=owner_uid, store_code=store_code).first()
-        store_data = self.get_store_data(store)
-        if not return_model:
-            return {
-                'info': storeSchema.dump(store),
-                'locations': storeLocationSchema.dump(store_data['locations'], many=True),
-                'hours': storeHourSchema.dump(store_data['hours'], many=True)
-            }
-
+    @memoize(50, namespaces=owner_store_namespaces)
+    def get_store(self, owner_uid, store_code, return_model=False, shape=StorePayloadShape.Legacy):
+        """ The store payload, with return_model a read-only row of the store (writers use load_store) """
+        store = self.load_store_aggregate(Store.owner_id == owner_uid, Store.store_code == store_code)
         if store is None:
             return None
+        if not return_model:
+            return self.store_payload(store, shape)
         return store
 
-    @cache.memoize(50)
-    def get_store_by_status_code(self, store_code, return_model=False):
-        store = Store.query.filter_by(store_code=store_code).first()
-        store_data = self.get_store_data(store)
-        if not return_model:
-            return {
-                'info': storeSchema.dump(store),
-                'locations': storeLocationSchema.dump(store_data['locations'], many=True),
-                'hours': storeHourSchema.dump(store_data['hours'], many=True)
-            }
+    def get_store_by_status_code(self, store_code, return_model=False, shape=StorePayloadShape.Legacy):
+        """ None when there is no such store, the codes the known keys filter never saw skip the caches and the database """
+        if not self.known_keys.might_exist('store', store_code):
+            return None
+        return self.find_store_by_code(store_code, return_model, shape)
+
+    @memoize(50, namespaces=store_owner_namespaces, negative_timeout=NEGATIVE_CACHE_SECONDS)
+    def find_store_by_code(self, store_code, return_model=False, shape=StorePayloadShape.Legacy):
+        store = self.load_store_aggregate(Store.store_code == store_code)
         if store is None:
             return None
+        if not return_model:
+            return self.store_payload(store, shape)
         return store
 
-    @cache.memoize(50)
+    @memoize(STORE_SNAPSHOT_SECONDS, namespaces=store_namespaces, negative_timeout=NEGATIVE_CACHE_SECONDS)
+    def get_store_owner(self, store_code):
+        """ uid of the owner of the store (a store never change owner), None when there is no such store """
+        return db.session.query(Store.owner_id).filter(Store.store_code == store_code).scalar()
+
     def store_exists(self, owner_uid, store_code):
+        """ True when the owner has NO such store """
+        if not self.known_keys.might_exist('store', store_code):
+            return True
+        return self.store_missing(owner_uid, store_code)
+
+    @memoize(50, namespaces=owner_store_namespaces)
+    def store_missing(self, owner_uid, store_code):
         store = Store.query.filter_by(owner_id=owner_uid, store_code=store_code).first()
         if store is None:
             return True
         return False
 
-    @cache.memoize(50)
+    @memoize(50, namespaces=owner_store_namespaces)
     def get_locations(self, owner_uid, store_code):
         store = self.get_store(owner_uid, store_code, True)
         store_locations = StoreLocations.query.filter_by(store_id=store.id).all()
         return store_locations
 
-    def location_exist(self, store_location_id):
-        object = StoreLocations.query.filter_by(id=store_location_id).first()
-        if object is None:
-            return True
-        return False
+    def load_store(self, owner_uid, store_code):
+        """ The store model from the database, not cached, for the writers """
+        return Store.query.filter_by(owner_id=owner_uid, store_code=store_code).first()
+
+    def load_stores(self, *criteria, order_by=None, children=True):
+        """ Stores with their owner (and his roles), with children their locations and hours too, in 1-2 queries for any number of stores """
+        query = Store.query.options(*(STORE_AGGREGATE_LOADS if children else STORE_INFO_LOADS)).filter(*criteria)
+        if order_by is not None:
+            query = query.order_by(order_by)
+        return query.all()
+
+    def load_store_aggregate(self, *criteria):
+        stores = self.load_stores(*criteria)
+        return stores[0] if stores else None
+
+    def store_payload(self, store, shape=StorePayloadShape.Legacy):
+        """ Legacy nest the store (and owner) in every location and hour, Normalized has it once (see store_payload.py) """
+        if shape == StorePayloadShape.Normalized:
+            return normalized_store(store)
+        return {
+            'info': storeSchema.dump(store),
+            'locations': storeLocationSchema.dump(store.locations, many=True),
+            'hours': storeHourSchema.dump(store.hours, many=True)
+        }
 
     def update_locations(self, owner_uid, store_code, store_locations):
-        cache.delete_memoized(self.get_locations, owner_uid, store_code)
-        self.remove_locations(owner_uid, store_code)
-        bulk_locations = []
-        store = self.get_store(owner_uid, store_code, True)
-        for store_location in store_locations.locations:
-            bulk_locations.append(StoreLocations(store.id,
-                                                 store_location.address,
-                                                 store_location.city,
-                                                 store_location.country_code,
-                                                 store_location.lat,
-                                                 store_location.lng,
-                                                 store_location.is_close))
-        db.session.bulk_save_objects(bulk_locations, return_defaults=True)
-        db.session.commit()
-        return self.get_store(owner_uid, store_code)
+        """ Reconcile the locations of the store with the submitted ones (see reconcile), the payload carry the change counts """
+        store = self.load_store(owner_uid, store_code)
+        rows = [{
+            'id': getattr(store_location, 'id', None),
+            'address': store_location.address,
+            'city': store_location.city,
+            'country_code': store_location.country_code,
+            'lat': store_location.lat,
+            'lng': store_location.lng,
+            'is_close': store_location.is_close,
+        } for store_location in store_locations.locations]
+        result = reconcile(StoreLocations.__table__, {'store_id': store.id}, rows, LOCATION_KEY, self.release_locations)
+        return self.reconciled(owner_uid, store, result)
 
-    @cache.memoize(50)
+    @memoize(50, namespaces=owner_store_namespaces)
     def get_hours(self, owner_uid, store_code):
         store = self.get_store(owner_uid, store_code, True)
         list = StoreHours.query.filter_by(store_id=store.id).all()
         return list
 
     def update_hours(self, owner_uid, store_code, store_hours):
-        self.remove_hours(owner_uid, store_code)
-        bulk = []
-        store = self.get_store(owner_uid, store_code, True)
-        for store_hour in store_hours.hours:
-            location_id = None
-            if self.location_exist(store_hour.location_id):
-                location_id = store_hour.location_id
-            bulk.append(StoreHours(store.id,
-                                   store_hour.day,
-                                   location_id,
-                                   store_hour.from_time,
-                                   store_hour.to_time,
-                                   store_hour.is_open_24,
-                                   store_hour.is_close))
-        db.session.bulk_save_objects(bulk, return_defaults=True)
+        """ Reconcile the hours of the store with the submitted ones, a location of another store (or missing) is dropped """
+        store = self.load_store(owner_uid, store_code)
+        location_ids = {location_id for location_id, in db.session.query(StoreLocations.id).filter_by(store_id=store.id)}
+        rows = [{
+            'id': getattr(store_hour, 'id', None),
+            'day': store_hour.day,
+            'store_location_id': store_hour.location_id if store_hour.location_id in location_ids else None,
+            'from_time': store_hour.from_time,
+            'to_time': store_hour.to_time,
+            'is_open_24': store_hour.is_open_24,
+            'is_close': store_hour.is_close,
+        } for store_hour in store_hours.hours]
+        result = reconcile(StoreHours.__table__, {'store_id': store.id}, rows, HOUR_KEY)
+        return self.reconciled(owner_uid, store, result)
+
+    def reconciled(self, owner_uid, store, result):
+        if result.changed:
+            self.touch_store(store.id)
         db.session.commit()
-        return self.get_store(owner_uid, store_code)
+        if result.changed:
+            self.clear_store_cache(store.store_code)
+        return dict(self.get_store(owner_uid, store.store_code), changes=result.counts())
+
+    def release_locations(self, location_ids):
+        # hours of deleted locations stay, for the whole store
+        StoreHours.query.filter(StoreHours.store_location_id.in_(location_ids)).update({'store_location_id': None}, synchronize_session=False)
 
     def update_store_info(self, owner_uid, store_code, store_object):
         if not valid_currency_code(store_object.currency_code):
             raise ParamsNotMatchCreateStore(owner_uid, store_object.name, store_object.currency_code, None, store_object.description)
-        self.clear_stores_cache()
-        store = self.get_store(owner_uid, store_code, True)
+        store = self.load_store(owner_uid, store_code)
         store.name = store_object.name
         store.description = store_object.description
         store.default_currency_code = store_object.currency_code
-        db.session.merge(store)
         db.session.commit()
+        self.clear_store_cache(store_code)
         return self.get_store(owner_uid, store_code)
 
-    def remove_locations(self, owner_uid, store_code):
-        cache.delete_memoized(self.get_locations, owner_uid, store_code)
-        store = self.get_store(owner_uid, store_code, True)
-        StoreLocations.query.filter_by(store_id=store.id).delete()
-
-    def remove_hours(self, owner_uid, store_code):
-        cache.delete_memoized(self.get_hours, owner_uid, store_code)
-        store = self.get_store(owner_uid, store_code, True)
-        StoreHours.query.filter_by(store_id=store.id).delete()
+    def touch_store(self, store_id):
+        # locations and hours have no timestamps, their writes move the updated_at of the store (Last-Modified of its info)
+        Store.query.filter_by(id=store_id).update({'updated_at': datetime.utcnow()}, synchronize_session=False)
 
     def create_store(self, owner_id, store_object):
         if not valid_currency_code(store_object['currency_code']):
             raise ParamsNotMatchCreateStore(owner_id, store_object['name'], store_object['currency_code'], store_object['description'])
-        self.clear_stores_cache()
         store_code = "%s" % uuid.uuid4()
         store = Store(store_code, owner_id, store_object['name'], store_object['currency_code'], None, store_object['description'])
         db.session.add(store)
         db.session.commit()
+        self.known_keys.add('store', store_code)
+        # a lookup of the new code (or of the stores of the owner) may be cached from before
+        bump_generations('stores:list', store_namespace(store_code), owner_namespace(owner_id))
+        self.render_snapshots(store_code)
         return self.get_store_by_status_code(store_code)
 
     def freeze_store(self, uid, store_code):
-        self.clear_store_cache(uid, store_code)
-        store = self.get_store(uid, store_code, True)
+        store = self.load_store(uid, store_code)
         store.is_maintenance = True
-        db.session.merge(store)
         db.session.commit()
+        self.clear_store_cache(store_code)
 
     def toggle_maintenance_store(self, owner_id, store_code):
-        self.clear_store_cache(owner_id, store_code)
-        store = self.get_store(owner_id, store_code, True)
+        store = self.load_store(owner_id, store_code)
         store.is_maintenance = not store.is_maintenance
-        db.session.merge(store)
         db.session.commit()
+        self.clear_store_cache(store_code)
+
+    def owner_written(self, owner_uid):
+        """ Drop the cached entries nesting the user after a write of the user (the store list only when he own a store),
+            render the snapshots of his stores again
+        """
+        store_codes = [store_code for store_code, in db.session.query(Store.store_code).filter(Store.owner_id == owner_uid)]
+        bump_generations(owner_namespace(owner_uid), *(('stores:owners',) if store_codes else ()))
+        for store_code in store_codes:
+            self.render_snapshots(store_code)
 
     def clear_stores_cache(self):
-        stores = self.get_stores(True)
-        cache.delete_memoized(self.get_stores)
-        for store in stores:
-            self.clear_store_cache(store.owner_id, store.store_code)
+        """ Drop every cached store entry """
+        bump_generations('stores')
 
-    def clear_store_cache(self, owner_uid, store_code):
-        cache.delete_memoized(self.get_store, owner_uid, store_code)
-        cache.delete_memoized(self.get_locations, owner_uid, store_code)
-        cache.delete_memoized(self.get_hours, owner_uid, store_code)
+    def clear_store_cache(self, store_code):
+        """ Drop the cached entries of a store and the store list, render the snapshots of the store again """
+        bump_generations('stores:list', store_namespace(store_code))
+        self.render_snapshots(store_code)
 
-    def get_store_data(self, store):
-        store_locations = StoreLocations.query.filter_by(store_id=store.id).all()
-        store_hours = StoreHours.query.filter_by(store_id=store.id).all()
-        return {
-            'locations': store_locations,
-            'hours': store_hours
-        }
+    def snapshot_key(self, store_code, shape):
+        # the generations of the store and of its owner are part of the key, a snapshot rendered before a write is never
+        # read after it, take it before the payload is loaded, a payload older than a write then land under the retired key
+        return cache_key('store_snapshot', fingerprint(generations(*store_owner_namespaces(store_code))), store_code, shape.value)
+
+    def write_snapshot(self, key, payload):
+        """ Render the public response of a store payload (plain and gzip) and keep it in redis under the snapshot key """
+        body = render_success(payload)
+        modified = last_modified_of(payload['info']['created_at'], payload['info']['updated_at'])
+        snapshot = {'identity': body, 'gzip': gzip.compress(body, mtime=0), 'last_modified': epoch(modified)}
+        if redis_client is not None:
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.hset(key, mapping=snapshot)
+                pipe.expire(key, STORE_SNAPSHOT_SECONDS)
+                pipe.execute()
+            except RedisError:
+                pass
+        return snapshot
+
+    def render_snapshots(self, store_code):
+        """ Render every shape of the store after a write, the store is loaded once """
+        if redis_client is None:
+            return
+        keys = {shape: self.snapshot_key(store_code, shape) for shape in StorePayloadShape}
+        store = self.load_store_aggregate(Store.store_code == store_code)
+        if store is None:
+            return
+        for shape, key in keys.items():
+            self.write_snapshot(key, self.store_payload(store, shape))
+
+    def get_store_snapshot(self, store_code, shape, encoding):
+        """ The rendered /store/<code>/info response in that encoding (identity / gzip) and the epoch of the last change
+            of the store, None when there is no such store
+        """
+        if not self.known_keys.might_exist('store', store_code):
+            return None
+        key = self.snapshot_key(store_code, shape)
+        if redis_client is not None:
+            try:
+                body, modified = redis_client.hmget(key, encoding, 'last_modified')
+            except RedisError:
+                body = None
+            if body is not None:
+                return body, int(modified)
+        payload = self.get_store_by_status_code(store_code, shape=shape)
+        if payload is None:
+            return None
+        snapshot = self.write_snapshot(key, payload)
+        return snapshot[encoding], snapshot['last_modified']
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from cachetools import LRUCache
+from redis import RedisError
+
+import config
+from config.api import redis_client
+from src.utils.near_cache import add_listener, publish
+from src.utils.singleton import singleton
+
+
+@singleton
+class TokenCacheService:
+    """Cache of verified firebase id token claims.
+
+    Entries are keyed by a sha256 of the bearer token (the raw token never reach the cache) and live until the token ``exp``.
+    Each worker keep a bounded LRU that it trust for ``TOKEN_CACHE_LOCAL_TTL`` seconds at most, behind it there is
+    an optional redis tier shared by all the workers. ``forget_uid`` is published on the invalidation channel of the
+    near caches, every worker drop the tokens of the uid from its LRU (and all of them when it may have lost messages).
+    """
+    key_prefix = 'token_claims'
+    listener_name = 'token_cache'
+
+    def __init__(self):
+        app_settings = config.settings[os.environ.get("FLASK_ENV", "development")]
+        self.local_ttl = app_settings.TOKEN_CACHE_LOCAL_TTL
+        self.shared = app_settings.TOKEN_CACHE_SHARED and redis_client is not None
+        self.prefix = '{}:{}'.format(app_settings.CACHE_KEY_PREFIX or '', self.key_prefix)
+        self.local = LRUCache(maxsize=app_settings.TOKEN_CACHE_SIZE)
+        self.lock = threading.Lock()
+        self.listening = False
+
+    def hash_token(self, token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def claims_key(self, token_hash):
+        return '{}:{}'.format(self.prefix, token_hash)
+
+    def uid_key(self, uid):
+        return '{}:uid:{}'.format(self.prefix, uid)
+
+    def get(self, token):
+        """ Return the cached claims of the token or None when the token must be verified again """
+        self.listen()
+        token_hash = self.hash_token(token)
+        now = time.time()
+        with self.lock:
+            entry = self.local.get(token_hash)
+        if entry is not None:
+            claims, trusted_until = entry
+            if now < trusted_until:
+                return claims
+            with self.lock:
+                self.local.pop(token_hash, None)
+
+        if not self.shared:
+            return None
+        try:
+            payload = redis_client.get(self.claims_key(token_hash))
+        except RedisError:
+            return None
+        if payload is None:
+            return None
+        claims = json.loads(payload)
+        if now >= claims['exp']:
+            return None
+        self.remember_local(token_hash, claims, now)
+        return claims
+
+    def set(self, token, claims):
+        token_hash = self.hash_token(token)
+        now = time.time()
+        ttl = int(claims['exp'] - now)
+        if ttl <= 0:
+            return
+        self.remember_local(token_hash, claims, now)
+        if not self.shared:
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.setex(self.claims_key(token_hash), ttl, json.dumps(claims))
+            # index of the token hashes per uid so a freeze can drop all of them
+            pipe.sadd(self.uid_key(claims['uid']), token_hash)
+            pipe.expire(self.uid_key(claims['uid']), ttl)
+            pipe.execute()
+        except RedisError:
+            pass
+
+    def listen(self):
+        # registered on the first lookup, the listener thread must start after the fork of the worker
+        if self.listening:
+            return
+        self.listening = True
+        add_listener(self.listener_name, lambda message: self.forget_local(message['uid']), self.clear_local)
+
+    def forget_uid(self, uid):
+        """ Drop every cached token of the uid in every worker so the next request of this user is verified again """
+        self.forget_local(uid)
+        if redis_client is not None:
+            publish(self.listener_name, uid=uid)
+
+        if not self.shared:
+            return
+        try:
+            token_hashes = redis_client.smembers(self.uid_key(uid))
+            keys = [self.claims_key(token_hash.decode('utf-8')) for token_hash in token_hashes]
+            redis_client.delete(self.uid_key(uid), *keys)
+        except RedisError:
+            pass
+
+    def forget_local(self, uid):
+        with self.lock:
+            token_hashes = [token_hash for token_hash, (claims, _) in self.local.items() if claims.get('uid') == uid]
+            for token_hash in token_hashes:
+                self.local.pop(token_hash, None)
+
+    def clear_local(self):
+        with self.lock:
+            self.local.clear()
+
+    def remember_local(self, token_hash, claims, now):
+        trusted_until = min(claims['exp'], now + self.local_ttl)
+        with self.lock:
+            self.local[token_hash] = (claims, trusted_until)
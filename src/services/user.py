@@ -1,21 +1,84 @@
+import logging
+import os
+
 import firebase_admin
 from firebase_admin import auth
-from sqlalchemy import or_, desc, asc
+from firebase_admin.exceptions import FirebaseError
+from sqlalchemy import or_, desc, asc, case, func, literal, not_, select, update, String
+from sqlalchemy.orm import joinedload, selectinload
 
-from config.api import cache
+import config
 from config.database import db
 from src.models import User
 from src.models.stores import Store
 from src.schemas.user_schema import UserSchema
-from src.utils.enums import AllowSortByDirection
+from src.services.firebase_metadata import FirebaseMetadataService
+from src.services.known_keys import KnownKeysService
+from src.services.revocation import RevocationService
+from src.services.signing_keys import SigningKeysService
+from src.services.store import StoreService
+from src.services.token_cache import TokenCacheService
+from src.services.user_search import UserSearchService
+from src.utils.caching import cache_key, fingerprint, get_value, set_value
+from src.utils.counting import count_query
+from src.utils.enums import AllowSortByDirection, AllowUserColumnOrderBy, CountStrategy
 from src.utils.firebase_utils import create_firebase_user
+from src.utils.generations import bump_generations, generations
+from src.utils.pagination import SortKey, keyset_paginate, offset_paginate
+from src.utils.principal import Principal, current_principal, set_principal
+from src.utils.record_cache import RecordCache
 from src.utils.responses import response_error
+from src.utils.roles_mask import compile_requirements
 from src.utils.singleton import singleton
 
+logger = logging.getLogger('console')
+
+# keyset columns of the user list, nullable ones are compared with a fallback value
+USER_SORT_COLUMNS = {
+    AllowUserColumnOrderBy.CreateAt: ('created_at', User.created_at, None),
+    AllowUserColumnOrderBy.Fullname: ('fullname', User.fullname, None),
+    AllowUserColumnOrderBy.Email: ('email', User.email, None),
+    AllowUserColumnOrderBy.Country: ('country', User.country, ''),
+    AllowUserColumnOrderBy.Store: ('store_code', User.store_code, ''),
+}
+
+# auth.get_users accept at most 100 identifiers
+FIREBASE_BATCH_SIZE = 100
+
+# UserSchema nest the roles, pages load them for every user in one extra IN query and single users in the same joined query
+USERS_SCHEMA_LOADS = (selectinload(User.roles),)
+USER_SCHEMA_LOADS = (joinedload(User.roles),)
+
+
+def user_namespace(uid):
+    # generation of the validators of GET /user/<uid> (see src.middlewares.conditional)
+    return 'user:{}'.format(uid)
+
+
+def escape_like(term):
+    """ The term with the LIKE wildcards escaped (use with escape='\\') """
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def user_record(user):
+    """ Cached form of a user, his columns and his roles """
+    record = {column.name: getattr(user, column.name) for column in User.__table__.columns}
+    record['roles'] = [{'id': role.id, 'name': role.name, 'is_active': role.is_active} for role in user.roles]
+    return record
+
 
 @singleton
 class UserService:
     user_schema = UserSchema()
+    token_cache = TokenCacheService()
+    revocation = RevocationService()
+    signing_keys = SigningKeysService()
+    user_search = UserSearchService()
+    firebase_metadata = FirebaseMetadataService()
+    known_keys = KnownKeysService()
+    stores = StoreService()
+    user_cache = RecordCache('user', config.settings[os.environ.get("FLASK_ENV", "development")].USER_CACHE_SECONDS,
+                             negative_timeout=config.settings[os.environ.get("FLASK_ENV", "development")].NEGATIVE_CACHE_SECONDS)
     """Verifies the signature and data for the provided JWT.
 
     Accepts a signed token string, verifies that it is current, was issued
@@ -46,17 +109,159 @@ class UserService:
     def get_firebase_user(self, uid):
         return auth.get_user(uid)
 
-    @cache.memoize(50)
+    def get_firebase_metadata(self, uid):
+        """ display_name / disabled of the firebase user, cached (see FirebaseMetadataService) """
+        return self.firebase_metadata.get(uid)
+
+    def get_firebase_users(self, uids):
+        """ Firebase users of many uids by the batched lookup (100 uids per call)
+            return (records by uid, uids of the chunks that failed)
+        """
+        records = {}
+        failed = set()
+        for start in range(0, len(uids), FIREBASE_BATCH_SIZE):
+            chunk = uids[start:start + FIREBASE_BATCH_SIZE]
+            try:
+                result = auth.get_users([auth.UidIdentifier(uid) for uid in chunk])
+            except (ValueError, FirebaseError) as e:
+                logger.error('failed get firebase users {}'.format(e))
+                failed.update(chunk)
+                continue
+            for record in result.users:
+                records[record.uid] = record
+        return records, failed
+
+    def get_users_batch(self, uids):
+        """ Same data as GET /user/<uid> for many users, one IN query and the batched firebase lookup
+            return a dict by uid of {'user_meta', 'user_data'} or {'error'} for the uids that failed
+        """
+        uids = list(dict.fromkeys(uids))
+        users = {user.uid: user for user in User.query.options(*USERS_SCHEMA_LOADS).filter(User.uid.in_(uids), User.is_active == True).all()}
+        metadata = self.firebase_metadata.get_many([uid for uid in uids if uid in users])
+        records, failed = self.get_firebase_users([uid for uid in uids if uid in users and uid not in metadata])
+        if records:
+            self.firebase_metadata.put(*records.values())
+        for uid, record in records.items():
+            metadata[uid] = {'display_name': record.display_name, 'disabled': record.disabled}
+        result = {}
+        for uid in uids:
+            if uid not in users:
+                result[uid] = {'error': 'user not found'}
+            elif uid in failed:
+                result[uid] = {'error': 'firebase lookup failed'}
+            elif uid not in metadata:
+                result[uid] = {'error': 'firebase user not found'}
+            else:
+                result[uid] = {
+                    'user_meta': metadata[uid],
+                    'user_data': self.user_schema.dump(users[uid], many=False)
+                }
+        return result
+
     def get_user(self, uid, return_model=False):
-        user = User.query.filter_by(uid=uid).first()
         if not return_model:
-            return self.user_schema.dump(user, many=False)
-        return user
+            return self.user_schema.dump(self.get_user_record(uid), many=False)
+        return User.query.options(*USER_SCHEMA_LOADS).filter_by(uid=uid).first()
+
+    def get_user_record(self, uid):
+        """ The user and his roles as a dict (see user_record), from the user cache """
+        return self.user_cache.load(uid, lambda: self.read_user_record(uid))
+
+    def read_user_record(self, uid):
+        user = User.query.options(*USER_SCHEMA_LOADS).filter_by(uid=uid).first()
+        if user is None:
+            return None
+        return user_record(user)
+
+    def list_users(self, filters, orders, per_page, page, is_inactive=False, show_store_users=False, count=CountStrategy.Exact):
+        """ Serialized page of get_users (items and paging meta) cached per normalized query
+            the key carry the generation of every scope (tag) the query can see, a user write bump the tags of his scope
+        """
+        tags = self.users_scope_tags(filters, show_store_users)
+        key = cache_key('user_list', fingerprint(generations(*tags), self.normalize_filters(filters), orders, per_page, page,
+                                                 is_inactive, show_store_users, count))
+        page_data = get_value(key)
+        if page_data is None:
+            result = self.get_users(filters, orders, per_page, page, is_inactive, show_store_users, count)
+            page_data = {
+                'items': self.user_schema.dump(result.items, many=True),
+                'total': result.total,
+                'pages': result.pages,
+                'has_next': result.has_next,
+                'has_prev': result.has_prev,
+                'total_is_estimate': result.total_is_estimate,
+            }
+            set_value(key, page_data, config.settings[os.environ.get("FLASK_ENV", "development")].USER_LIST_CACHE_SECONDS)
+        return page_data
+
+    def normalize_filters(self, filters):
+        # the list filters are alternatives, their order does not change the result
+        return {name: sorted(value) if isinstance(value, list) else value for name, value in filters.items()}
+
+    def users_scope_tags(self, filters, show_store_users=False):
+        """ Tags of the users a listing can see: users:platform, users:stores (every store) or users:store:<code> """
+        if filters['platform']:
+            return ['users:platform', 'users:stores'] if show_store_users else ['users:platform']
+        if len(filters['stores']) > 0 and not (filters['emails'] or filters['names'] or filters['countries']):
+            return ['users:store:{}'.format(store_code) for store_code in sorted(filters['stores'])]
+        # the other filters are alternatives to the stores, they can match any user
+        return ['users:platform', 'users:stores']
 
     # todo: need add better filters with the store that include things like store name and more...
-    @cache.memoize(50)
-    def get_users(self, filters, orders, per_page, page, is_inactive=False, show_store_users=False):
-        query = User.query
+    def get_users(self, filters, orders, per_page, page, is_inactive=False, show_store_users=False, count=CountStrategy.Exact):
+        query = self.users_query(filters, is_inactive, show_store_users)
+        total, total_is_estimate = self.count_users(query, filters, is_inactive, show_store_users, count)
+        if filters.get('search') and filters.get('search_ranked'):
+            query = query.order_by(self.search_rank(filters['search']))
+        if len(orders) <= 0:
+            query = query.order_by(User.created_at.desc())
+        else:
+            for order in orders:
+                if order['sort'] == AllowSortByDirection.DESC:
+                    query = query.order_by(desc(order['field'].value))
+                else:
+                    query = query.order_by(asc(order['field'].value))
+        return offset_paginate(query, page, per_page, total, total_is_estimate)
+
+    def search_users(self, filters, orders, per_page, page, is_inactive=False, show_store_users=False):
+        """ Same listing as get_users served by the user search index, None when the index is disabled or unavailable """
+        return self.user_search.search(filters, orders, per_page, page, is_inactive, show_store_users)
+
+    def get_users_by_cursor(self, filters, orders, per_page, cursor=None, is_inactive=False, show_store_users=False, count=CountStrategy.Skip):
+        """ Same listing as get_users paginated by keyset, no OFFSET scan and the total is counted only on demand
+            raise ValueError when the cursor is broken or was made for another order
+        """
+        query = self.users_query(filters, is_inactive, show_store_users)
+        result = keyset_paginate(query, self.users_sort_keys(orders), per_page, cursor)
+        result.total, result.total_is_estimate = self.count_users(query, filters, is_inactive, show_store_users, count)
+        return result
+
+    def count_users(self, query, filters, is_inactive, show_store_users, count):
+        return count_query(query, count, 'users', fingerprint(filters, is_inactive, show_store_users))
+
+    def invalidate_user_lists(self, *store_codes):
+        """ Drop the cached pages and totals of the user listings that can see users of these stores (None is the platform) """
+        tags = {'users'}
+        for store_code in store_codes:
+            if store_code is None:
+                tags.add('users:platform')
+            else:
+                tags.update(('users:stores', 'users:store:{}'.format(store_code)))
+        bump_generations(*sorted(tags))
+
+    def users_sort_keys(self, orders):
+        if len(orders) <= 0:
+            return [SortKey('created_at', User.created_at, True), SortKey('id', User.id, True)]
+        sort_keys = []
+        for order in orders:
+            name, column, null_value = USER_SORT_COLUMNS[order['field']]
+            sort_keys.append(SortKey(name, column, order['sort'] == AllowSortByDirection.DESC, null_value))
+        # the primary key make every position unique
+        sort_keys.append(SortKey('id', User.id, False))
+        return sort_keys
+
+    def users_query(self, filters, is_inactive=False, show_store_users=False):
+        query = User.query.options(*USERS_SCHEMA_LOADS)
         query_filters = []
         # setup filter params
         if not filters['platform']:
@@ -85,98 +290,201 @@ class UserService:
             else:
                 query = query.filter_by(store_code=None)
 
-        if len(orders) <= 0:
-            query = query.order_by(User.created_at.desc())
-        else:
-            for order in orders:
-                if order['sort'] == AllowSortByDirection.DESC:
-                    query = query.order_by(desc(order['field'].value))
-                else:
-                    query = query.order_by(asc(order['field'].value))
-        return query.paginate(page=page, per_page=per_page, error_out=False)
+        if filters.get('search'):
+            query = query.filter(self.search_clause(filters['search']))
+        return query
+
+    def search_clause(self, term):
+        """ fullname / email containing the term, on postgres also the names similar to it (pg_trgm word similarity)
+            both are served by the trigram GIN indexes, sqlite (tests) fallback to a LIKE scan
+        """
+        pattern = '%{}%'.format(escape_like(term.lower()))
+        if db.engine.dialect.name == 'postgresql':
+            return or_(User.fullname.ilike(pattern, escape='\\'),
+                       User.email.ilike(pattern, escape='\\'),
+                       literal(term, String).op('<%')(User.fullname))
+        return or_(func.lower(User.fullname).like(pattern, escape='\\'),
+                   func.lower(User.email).like(pattern, escape='\\'))
+
+    def search_rank(self, term):
+        """ Order of a ranked search, the best match first """
+        if db.engine.dialect.name == 'postgresql':
+            return func.greatest(func.word_similarity(term, User.fullname), func.similarity(term, User.email)).desc()
+        return case((func.lower(User.fullname).like('{}%'.format(escape_like(term.lower())), escape='\\'), 0), else_=1)
 
-    @cache.memoize(50)
     def get_active_user(self, uid, return_model=False):
-        user = User.query.filter_by(uid=uid, is_active=True).first()
         if not return_model:
-            return self.user_schema.dump(user, many=False)
-        return user
+            record = self.get_user_record(uid)
+            return self.user_schema.dump(record if record is not None and record['is_active'] else None, many=False)
+        return User.query.options(*USER_SCHEMA_LOADS).filter_by(uid=uid, is_active=True).first()
 
-    @cache.memoize(50)
     def user_exists(self, uid):
-        user = User.query.filter_by(uid=uid, is_active=True).first()
-        if user is None:
+        principal = current_principal(uid)
+        if principal is not None:
+            return principal.is_active
+        if not self.known_keys.might_exist('user', uid):
             return False
-        return True
+        return self.active_user_exists(uid)
+
+    def active_user_exists(self, uid):
+        record = self.get_user_record(uid)
+        return record is not None and record['is_active']
+
+    def load_principal(self, uid):
+        """ Load the user with his roles in one joined query """
+        user = User.query.options(*USER_SCHEMA_LOADS).filter_by(uid=uid).first()
+        if user is None:
+            return None
+        return Principal(user)
+
+    def get_principal(self, uid):
+        """ Return the principal of the uid, the one of the current request is reused when it is the same user """
+        principal = current_principal(uid)
+        if principal is None:
+            principal = self.load_principal(uid)
+        return principal
 
     def user_has_any_role_matched(self, uid, roles):
-        user = self.get_user(uid, True)
-        return user.has_any_role(roles)
+        principal = self.get_principal(uid)
+        if principal is None:
+            return False
+        return principal.has_any_role(roles)
 
     def user_has_role_matched(self, uid, roles):
-        user = self.get_user(uid, True)
-        return user.has_role(roles)
+        principal = self.get_principal(uid)
+        if principal is None:
+            return False
+        return principal.has_role(roles)
 
     def check_user_part_store(self, uid, store_code):
         store = Store.query.filter_by(store_code=store_code).first()
-        user = self.get_user(uid, True)
-        if store is None or user is None:
+        principal = self.get_principal(uid)
+        if store is None or principal is None:
             return False
-        if store.owner_id == uid or user.store_code == store_code:
+        if store.owner_id == uid or principal.store_code == store_code:
             return True
         return False
 
     def check_user_auth(self, request, existed_on_system):
+        set_principal(None)
         if not request.headers.get('authorization'):
             return response_error('No token provided', None, 400)
         try:
             token = request.headers['authorization'].replace('Bearer ', '')
-            firebase_obj = auth.verify_id_token(token)
+            firebase_obj = self.token_cache.get(token)
+            if firebase_obj is None:
+                firebase_obj = self.signing_keys.verify_id_token(token)
+                self.token_cache.set(token, firebase_obj)
+            # same check as check_revoked=True but against the local registry (no firebase round trip)
+            if self.revocation.is_revoked(firebase_obj):
+                raise auth.RevokedIdTokenError('The Firebase ID token has been revoked.')
             if existed_on_system:
-                uid = firebase_obj["uid"]
-                user_exist = self.user_exists(uid)
-                if not user_exist:
+                principal = self.load_principal(firebase_obj["uid"])
+                if principal is None or not principal.is_active:
                     return response_error('user not active', None, 400)
+                set_principal(principal)
             request.uid = firebase_obj["uid"]
         except:
             return response_error('Invalid token provided', None, 400)
 
-    def update_user_info(self, uid, user_data):
-        user = self.get_user(uid, True)
-        user.fullname = user_data.fullname
-        user.address1 = user_data.address1
-        user.address2 = user_data.address2
-        user.country = user_data.country
-        user.currency = user_data.currency
-        db.session.merge(user)
+    def update_user_row(self, uid, values, changed_only=True, previous=()):
+        """ UPDATE users SET values WHERE uid = uid RETURNING the updated row, None when no row changed
+            with changed_only the row is updated only when one of the values differ from the stored one
+            previous are columns returned also with their value before the update (as previous_<column>)
+            postgres run it as one statement, databases without UPDATE .. RETURNING (sqlite in tests) read the row around the update
+        """
+        users = User.__table__
+        conditions = [users.c.uid == uid]
+        if changed_only:
+            conditions.append(or_(*[users.c[name].is_distinct_from(value) for name, value in values.items()]))
+
+        if db.engine.dialect.full_returning:
+            statement = update(users).where(*conditions).values(**values)
+            if previous:
+                # the joined copy of the row still hold the values before the update
+                old = users.alias('previous')
+                statement = statement.where(old.c.id == users.c.id)
+                row = db.session.execute(statement.returning(*users.c, *[old.c[name].label('previous_' + name) for name in previous])).first()
+            else:
+                row = db.session.execute(statement.returning(*users.c)).first()
+            db.session.commit()
+            return row
+
+        old_values = []
+        if previous:
+            old_row = db.session.execute(select(*[users.c[name] for name in previous]).where(users.c.uid == uid)).first()
+            old_values = [literal(old_row[index] if old_row else None, users.c[name].type).label('previous_' + name) for index, name in enumerate(previous)]
+        row = None
+        if db.session.execute(update(users).where(*conditions).values(**values)).rowcount:
+            row = db.session.execute(select(*users.c, *old_values).where(users.c.uid == uid)).first()
         db.session.commit()
+        return row
+
+    def user_written(self, row):
+        """ Retire the cached user after an UPDATE, merging the row into the cached record could race another write
+            the cached stores nest their owner, his ones are retired too
+        """
+        self.user_cache.forget(row.uid)
+        bump_generations(user_namespace(row.uid))
+        self.stores.owner_written(row.uid)
+
+    def update_user_info(self, uid, user_data):
+        """ Return the updated row, None when nothing changed """
+        row = self.update_user_row(uid, {
+            'fullname': user_data.fullname,
+            'address1': user_data.address1,
+            'address2': user_data.address2,
+            'country': user_data.country,
+            'currency': user_data.currency,
+        })
+        if row is not None:
+            self.user_written(row)
+            self.invalidate_user_lists(row.store_code)
+            self.user_search.index_users([row])
+        return row
 
     def update_user_store_owner(self, uid, store_code):
-        user = self.get_user(uid, True)
-        user.store_code = store_code
-        db.session.merge(user)
-        db.session.commit()
+        row = self.update_user_row(uid, {'store_code': store_code}, previous=('store_code',))
+        if row is not None:
+            self.user_written(row)
+            self.invalidate_user_lists(row.previous_store_code, row.store_code)
+            self.user_search.index_users([row])
+        return row
 
     def mark_user_passed_tutorial(self, uid):
-        user = self.get_user(uid, True)
-        user.is_pass_tutorial = True
-        db.session.merge(user)
-        db.session.commit()
+        row = self.update_user_row(uid, {'is_pass_tutorial': True})
+        if row is not None:
+            self.user_written(row)
+            self.invalidate_user_lists(row.store_code)
+        return row
 
     def toggle_freeze_user(self, uid):
-        user = self.get_user(uid, True)
-        user.is_active = not user.is_active
-        firebase_admin.auth.update_user(uid, disabled=not user.is_active)
-        db.session.merge(user)
-        db.session.commit()
+        row = self.update_user_row(uid, {'is_active': not_(User.__table__.c.is_active)}, changed_only=False)
+        if row is None:
+            return None
+        try:
+            firebase_user = firebase_admin.auth.update_user(uid, disabled=not row.is_active)
+        except Exception:
+            # firebase kept the previous state, the row go back to it
+            reverted = self.update_user_row(uid, {'is_active': not row.is_active})
+            if reverted is not None:
+                self.user_written(reverted)
+            raise
+        self.user_written(row)
+        self.firebase_metadata.put(firebase_user)
         auth.revoke_refresh_tokens(uid)
+        self.revocation.revoke(uid)
+        self.token_cache.forget_uid(uid)
+        self.invalidate_user_lists(row.store_code)
+        self.user_search.index_users([row])
+        return row
 
     ''' Will create staff user for the store (this will not for customer as he work on different workflow'''
 
     def create_user(self, email, fullname, password, roles, store_code):
         user_obj = create_firebase_user(email, password)
         uid = user_obj.uid
-        self.sync_firebase_user(uid, roles, email, fullname, True, store_code, True)
+        self.sync_firebase_user(uid, roles, email, fullname, True, store_code, True, user_obj)
         return self.get_user(uid)
 
     # TODO: Remove this method
@@ -214,33 +522,17 @@ class UserService:
                 has_roles('a', ('b', 'c'), d)
             Translates to:
                 User has role 'a' AND (role 'b' OR role 'c') AND role 'd'"""
-        user = self.get_user(uid, True)
-        role_names = user.roles
-        for requirement in requirements_roles:
-            if isinstance(requirement, (list, tuple)):
-                # this is a tuple_of_role_names requirement
-                tuple_of_role_names = requirement
-                authorized = False
-                for role_object in role_names:
-                    if role_object.name in tuple_of_role_names[0]:
-                        # tuple_of_role_names requirement was met: break out of loop
-                        if role_object.is_active:
-                            authorized = True
-                            break
-                if not authorized:
-                    return False  # tuple_of_role_names requirement failed: return False
-            else:
-                # the user must have this role
-                for role_object in role_names:
-                    if not role_object.is_active:
-                        return False
-                    if role_object.name in requirements_roles:
-                        return False  # role_name requirement failed: return False
+        return self.check_user_roles_mask(uid, compile_requirements(requirements_roles))
 
-            # All requirements have been met: return True
-        return True
+    def check_user_roles_mask(self, uid, compiled_requirements):
+        """ Same as check_user_roles with requirements already compiled by compile_requirements (see check_role) """
+        principal = self.get_principal(uid)
+        if principal is None:
+            return False
+        return principal.matches(compiled_requirements)
 
-    def sync_firebase_user(self, uid, roles, email, fullname, is_platform_user, store_code=None, is_new_user=True):
+    def sync_firebase_user(self, uid, roles, email, fullname, is_platform_user, store_code=None, is_new_user=True, firebase_user=None):
+        """ Create the user row of a firebase user, firebase_user is the UserRecord when the caller already fetched it """
         user = User(uid, email, fullname, True, is_new_user)
         if not is_platform_user:
             if store_code is not None:
@@ -251,3 +543,11 @@ class UserService:
         user.add_user_roles(roles)
         db.session.add(user)
         db.session.commit()
+        self.known_keys.add('user', uid)
+        self.user_cache.put(uid, user_record(user))
+        self.invalidate_user_lists(user.store_code)
+        self.user_search.index_users([user])
+        if firebase_user is not None:
+            self.firebase_metadata.put(firebase_user)
+        else:
+            self.firebase_metadata.forget(uid)
@@ -0,0 +1,340 @@
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy.orm import selectinload
+
+import config
+from src.models import User
+from src.utils.enums import AllowSortByDirection, AllowUserColumnOrderBy
+from src.utils.pagination import OffsetPage
+from src.utils.singleton import singleton
+
+logger = logging.getLogger('console')
+
+# fullname / email are also indexed as edge ngrams so a query word match the start of any word of them
+USER_INDEX_BODY = {
+    'settings': {
+        'analysis': {
+            'tokenizer': {
+                'words': {'type': 'pattern', 'pattern': '\\W+'},
+            },
+            'filter': {
+                'prefixes': {'type': 'edge_ngram', 'min_gram': 1, 'max_gram': 20},
+            },
+            'analyzer': {
+                'prefix_index': {'type': 'custom', 'tokenizer': 'words', 'filter': ['lowercase', 'prefixes']},
+                'prefix_search': {'type': 'custom', 'tokenizer': 'words', 'filter': ['lowercase']},
+            },
+            'normalizer': {
+                'lower': {'type': 'custom', 'filter': ['lowercase']},
+            },
+        },
+    },
+    'mappings': {
+        'dynamic': 'strict',
+        'properties': {
+            'uid': {'type': 'keyword'},
+            'fullname': {'type': 'text', 'analyzer': 'prefix_index', 'search_analyzer': 'prefix_search',
+                         'fields': {'raw': {'type': 'keyword'}}},
+            'email': {'type': 'keyword', 'normalizer': 'lower',
+                      'fields': {'search': {'type': 'text', 'analyzer': 'prefix_index', 'search_analyzer': 'prefix_search'}}},
+            'country': {'type': 'keyword'},
+            'store_code': {'type': 'keyword'},
+            'is_active': {'type': 'boolean'},
+            'created_at': {'type': 'date'},
+        },
+    },
+}
+
+# sort field of each /user/list order column
+USER_SORT_FIELDS = {
+    AllowUserColumnOrderBy.CreateAt: 'created_at',
+    AllowUserColumnOrderBy.Fullname: 'fullname.raw',
+    AllowUserColumnOrderBy.Email: 'email',
+    AllowUserColumnOrderBy.Country: 'country',
+    AllowUserColumnOrderBy.Store: 'store_code',
+}
+
+
+def user_document(user):
+    return {
+        'uid': user.uid,
+        'fullname': user.fullname,
+        'email': user.email,
+        'country': user.country,
+        'store_code': user.store_code,
+        'is_active': bool(user.is_active),
+        'created_at': user.created_at.isoformat() if user.created_at is not None else None,
+    }
+
+
+def user_search_body(filters, orders, is_inactive=False, show_store_users=False):
+    """ The /user/list filters as an elasticsearch query, same meaning as UserService.users_query
+        stores / emails / names / countries are alternatives (any of them match), the free text search must match
+    """
+    should = []
+    if not filters['platform'] and len(filters['stores']) > 0:
+        should.append({'terms': {'store_code': list(filters['stores'])}})
+    if len(filters['emails']) > 0:
+        should.append({'terms': {'email': list(filters['emails'])}})
+    for name in filters['names']:
+        should.append({'match': {'fullname': {'query': name, 'operator': 'and'}}})
+    if len(filters['countries']) > 0:
+        should.append({'terms': {'country': list(filters['countries'])}})
+
+    query = {'filter': [{'term': {'is_active': not is_inactive}}]}
+    if filters['platform'] and not show_store_users:
+        query['must_not'] = [{'exists': {'field': 'store_code'}}]
+    if should:
+        query['should'] = should
+        query['minimum_should_match'] = 1
+    if filters.get('search'):
+        query['must'] = [{'multi_match': {'query': filters['search'], 'fields': ['fullname', 'email.search'], 'operator': 'and'}}]
+
+    sort = []
+    if filters.get('search') and filters.get('search_ranked'):
+        sort.append({'_score': 'desc'})
+    if len(orders) <= 0:
+        sort.append({'created_at': 'desc'})
+    for order in orders:
+        sort.append({USER_SORT_FIELDS[order['field']]: 'desc' if order['sort'] == AllowSortByDirection.DESC else 'asc'})
+    sort.append({'uid': 'asc'})
+    return {'query': {'bool': query}, 'sort': sort}
+
+
+class ElasticsearchUserIndex:
+    """Users index on elasticsearch.
+
+    Writes and searches go through an alias, a full reindex build a new index behind it and swap the alias
+    when it is complete so the search keep working during the reindex.
+    """
+
+    def __init__(self, url, alias, bulk_size):
+        # the client is imported only when the backend is used
+        from elasticsearch import Elasticsearch
+        self.client = Elasticsearch(url)
+        self.alias = alias
+        self.bulk_size = bulk_size
+        self.is_ready = False
+        self.lock = threading.Lock()
+
+    def ensure_index(self):
+        if self.is_ready:
+            return
+        with self.lock:
+            if not self.is_ready and not self.client.indices.exists_alias(name=self.alias):
+                self.create_index(is_write_index=True)
+            self.is_ready = True
+
+    def create_index(self, is_write_index=False):
+        name = '{}-{}'.format(self.alias, int(time.time() * 1000))
+        body = dict(USER_INDEX_BODY)
+        if is_write_index:
+            body['aliases'] = {self.alias: {}}
+        self.client.indices.create(index=name, body=body)
+        return name
+
+    def bulk(self, documents, index=None):
+        from elasticsearch import helpers
+        actions = ({'_index': index or self.alias, '_id': document['uid'], '_source': document} for document in documents)
+        indexed, _ = helpers.bulk(self.client, actions, chunk_size=self.bulk_size)
+        return indexed
+
+    def index(self, documents):
+        self.ensure_index()
+        return self.bulk(documents)
+
+    def search(self, body, offset, size):
+        self.ensure_index()
+        response = self.client.search(index=self.alias, body=dict(body, track_total_hits=True, _source=False), from_=offset, size=size)
+        return [hit['_id'] for hit in response['hits']['hits']], response['hits']['total']['value']
+
+    def rebuild(self, documents):
+        name = self.create_index()
+        indexed = self.bulk(documents, name)
+        self.client.indices.refresh(index=name)
+        previous = []
+        if self.client.indices.exists_alias(name=self.alias):
+            previous = list(self.client.indices.get_alias(name=self.alias).keys())
+        actions = [{'remove': {'index': index, 'alias': self.alias}} for index in previous]
+        actions.append({'add': {'index': name, 'alias': self.alias}})
+        self.client.indices.update_aliases(body={'actions': actions})
+        for index in previous:
+            self.client.indices.delete(index=index, ignore_unavailable=True)
+        self.is_ready = True
+        return indexed
+
+    def clear(self):
+        self.ensure_index()
+        self.client.delete_by_query(index=self.alias, body={'query': {'match_all': {}}}, refresh=True)
+
+
+class MemoryUserIndex:
+    """In process stand-in of ElasticsearchUserIndex for tests and local runs without elasticsearch.
+
+    It evaluate the subset of the query DSL built by user_search_body with the same analysis as USER_INDEX_BODY
+    (prefix match of every query word on text fields, lowercase email), so both backends return the same users.
+    Like elasticsearch it match the start of words, not any substring as the database ILIKE '%term%' does
+    ("qui" find "Zed Quill", "uill" does not), the tests rely on it behaving as the real index.
+    """
+    text_fields = {'fullname': 'fullname', 'email.search': 'email'}
+    keyword_fields = {'fullname.raw': 'fullname'}
+    lowercase_fields = {'email'}
+
+    def __init__(self):
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def index(self, documents):
+        documents = list(documents)
+        with self.lock:
+            for document in documents:
+                self.documents[document['uid']] = dict(document)
+        return len(documents)
+
+    def rebuild(self, documents):
+        rebuilt = {document['uid']: dict(document) for document in documents}
+        with self.lock:
+            self.documents = rebuilt
+        return len(rebuilt)
+
+    def clear(self):
+        with self.lock:
+            self.documents = {}
+
+    def search(self, body, offset, size):
+        with self.lock:
+            documents = list(self.documents.values())
+        scored = []
+        for document in documents:
+            score = self.score(body['query'], document)
+            if score is not None:
+                scored.append((document, score))
+        for sort in reversed(body['sort']):
+            field, direction = next(iter(sort.items()))
+            scored = self.sort(scored, field, direction == 'desc')
+        return [document['uid'] for document, _ in scored[offset:offset + size]], len(scored)
+
+    def sort(self, scored, field, descending):
+        if field == '_score':
+            return sorted(scored, key=lambda item: item[1], reverse=descending)
+        field = self.keyword_fields.get(field, field)
+        # missing values are last in both directions, like elasticsearch
+        present = [item for item in scored if item[0].get(field) is not None]
+        missing = [item for item in scored if item[0].get(field) is None]
+        return sorted(present, key=lambda item: item[0][field], reverse=descending) + missing
+
+    def score(self, query, document):
+        """ Number of matched clauses, None when the document does not match """
+        kind, params = next(iter(query.items()))
+        if kind == 'bool':
+            if not all(self.score(clause, document) is not None for clause in params.get('filter', [])):
+                return None
+            if any(self.score(clause, document) is not None for clause in params.get('must_not', [])):
+                return None
+            score = 0
+            for clause in params.get('must', []):
+                matched = self.score(clause, document)
+                if matched is None:
+                    return None
+                score += matched
+            matched_should = [self.score(clause, document) for clause in params.get('should', [])]
+            matched_should = [matched for matched in matched_should if matched is not None]
+            if len(matched_should) < params.get('minimum_should_match', 0):
+                return None
+            return score + sum(matched_should)
+        if kind == 'term':
+            field, value = next(iter(params.items()))
+            return 1 if self.keyword(field, document) == self.normalize(field, value) else None
+        if kind == 'terms':
+            field, values = next(iter(params.items()))
+            return 1 if self.keyword(field, document) in [self.normalize(field, value) for value in values] else None
+        if kind == 'exists':
+            return 1 if document.get(params['field']) is not None else None
+        if kind == 'match':
+            field, match = next(iter(params.items()))
+            return 1 if self.words_match(match['query'], [field], document) else None
+        if kind == 'multi_match':
+            return 1 if self.words_match(params['query'], params['fields'], document) else None
+        raise ValueError('{} query is not supported by the memory index'.format(kind))
+
+    def keyword(self, field, document):
+        return self.normalize(field, document.get(self.keyword_fields.get(field, field)))
+
+    def normalize(self, field, value):
+        if field in self.lowercase_fields and isinstance(value, str):
+            return value.lower()
+        return value
+
+    def words_match(self, text, fields, document):
+        """ operator=and, every query word must be the start of a word of one of the fields """
+        words = []
+        for field in fields:
+            words.extend(re.split(r'\W+', (document.get(self.text_fields[field]) or '').lower()))
+        return all(any(word.startswith(query_word) for word in words if word) for query_word in re.split(r'\W+', text.lower()) if query_word)
+
+
+@singleton
+class UserSearchService:
+    """User directory search.
+
+    ``USER_SEARCH_BACKEND`` pick the index: ``elasticsearch`` (``ELASTICSEARCH_URL``), ``memory`` (stand-in for tests)
+    or empty to disable it. The index is fed by the UserService writes and rebuilt by ``manage.py reindex_users``,
+    search return only uids, the users are read back from the database.
+    Names and free text match the start of the words of fullname / email, the database fallback match any substring of them.
+    Index failures are logged and never fail the write, a failed search return None so the caller fallback to the database.
+    """
+
+    def __init__(self):
+        app_settings = config.settings[os.environ.get("FLASK_ENV", "development")]
+        self.bulk_size = app_settings.USER_SEARCH_BULK_SIZE
+        self.index = None
+        if app_settings.USER_SEARCH_BACKEND == 'elasticsearch':
+            self.index = ElasticsearchUserIndex(app_settings.ELASTICSEARCH_URL, app_settings.USER_SEARCH_INDEX, self.bulk_size)
+        elif app_settings.USER_SEARCH_BACKEND == 'memory':
+            self.index = MemoryUserIndex()
+
+    @property
+    def enabled(self):
+        return self.index is not None
+
+    def index_users(self, users):
+        if self.index is None:
+            return
+        try:
+            self.index.index(user_document(user) for user in users)
+        except Exception as e:
+            logger.error('failed index users {} {}'.format([user.uid for user in users], e))
+
+    def reindex(self):
+        """ Rebuild the whole index from the users table, return the number of users indexed """
+        if self.index is None:
+            return 0
+        users = User.query.order_by(User.id).yield_per(self.bulk_size)
+        return self.index.rebuild(user_document(user) for user in users)
+
+    def clear(self):
+        if self.index is not None:
+            self.index.clear()
+
+    def search(self, filters, orders, per_page, page, is_inactive=False, show_store_users=False):
+        """ Page of users (OffsetPage) matching the /user/list filters, None when the index is disabled or failed """
+        if self.index is None:
+            return None
+        if page is None or page < 1:
+            page = 1
+        body = user_search_body(filters, orders, is_inactive, show_store_users)
+        try:
+            uids, total = self.index.search(body, (page - 1) * per_page, per_page)
+        except Exception as e:
+            logger.error('failed search users {}'.format(e))
+            return None
+        users = {}
+        if uids:
+            users = {user.uid: user for user in User.query.options(selectinload(User.roles)).filter(User.uid.in_(uids)).all()}
+        # the index can be a little behind the database, users deleted since are skipped
+        items = [users[uid] for uid in uids if uid in users]
+        return OffsetPage(items, page, per_page, total, page * per_page < total)
@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+from enum import Enum
+
+from redis import RedisError
+
+import config
+from config.api import redis_client
+
+
+def cache_key(*parts):
+    prefix = config.settings[os.environ.get("FLASK_ENV", "development")].CACHE_KEY_PREFIX or ''
+    return ':'.join([prefix] + [str(part) for part in parts])
+
+
+def fingerprint(*parts):
+    """ Stable hash of the params of a query, dict keys are sorted and enums are replaced by their value """
+    def default(value):
+        if isinstance(value, Enum):
+            return value.value
+        if isinstance(value, (set, frozenset)):
+            return sorted(value)
+        raise TypeError('{} is not part of a fingerprint'.format(type(value)))
+
+    raw = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=default)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_value(key):
+    if redis_client is None:
+        return None
+    try:
+        payload = redis_client.get(key)
+    except RedisError:
+        return None
+    return json.loads(payload) if payload is not None else None
+
+
+def set_value(key, value, timeout):
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(key, timeout, json.dumps(value))
+    except RedisError:
+        pass
@@ -0,0 +1,58 @@
+import json
+import os
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+import config
+from config.database import db
+from src.utils.caching import cache_key, get_value, set_value
+from src.utils.enums import CountStrategy
+from src.utils.generations import generations
+
+
+class Explain(Executable, ClauseElement):
+    """ EXPLAIN (FORMAT JSON) of a select, binds are rendered by the statement compiler as usual """
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, 'postgresql')
+def compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kw)
+
+
+def estimate_count(query):
+    """ Rows the postgres planner expect for the query, None on other databases """
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    plan = db.session.execute(Explain(query.order_by(None).statement)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def cached_count(query, namespace, fingerprint):
+    """ Exact COUNT(*) cached per normalized filters for COUNT_CACHE_SECONDS, bump the namespace to drop every count of it """
+    key = cache_key('count', namespace, generations(namespace)[0], fingerprint)
+    total = get_value(key)
+    if total is None:
+        total = query.order_by(None).count()
+        set_value(key, total, config.settings[os.environ.get("FLASK_ENV", "development")].COUNT_CACHE_SECONDS)
+    return total
+
+
+def count_query(query, strategy, namespace, fingerprint):
+    """ Return (total, is_estimate) of the query by the strategy, total is None when counting is skipped
+        auto use the planner estimate when it is above COUNT_ESTIMATE_THRESHOLD else the exact cached count
+    """
+    if strategy == CountStrategy.Skip:
+        return None, False
+    if strategy in (CountStrategy.Estimate, CountStrategy.Auto):
+        estimate = estimate_count(query)
+        threshold = config.settings[os.environ.get("FLASK_ENV", "development")].COUNT_ESTIMATE_THRESHOLD
+        if estimate is not None and (strategy == CountStrategy.Estimate or estimate >= threshold):
+            return estimate, True
+    return cached_count(query, namespace, fingerprint), False
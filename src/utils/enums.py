@@ -17,7 +17,7 @@ class AllowUserColumnOrderBy(Enum):
     CreateAt = "created_at"
     Fullname = "fullname"
     Email = "email"
-    Country = "County"
+    Country = "country"
     Store = "store_code"
 
 
@@ -26,6 +26,18 @@ class AllowSortByDirection(Enum):
     ASC = "asc"
 
 
+class CountStrategy(Enum):
+    Exact = "exact"
+    Estimate = "estimate"
+    Auto = "auto"
+    Skip = "none"
+
+
+class StorePayloadShape(Enum):
+    Legacy = "legacy"  # store nested in every location and hour (StoreSchema dumps)
+    Normalized = "normalized"  # store once, locations / hours reference it by id
+
+
 class PerPageSupport(Enum):
     Per20 = 20
     Per30 = 30
@@ -1,3 +1,7 @@
+import calendar
+from datetime import datetime
+
+
 
 def is_json_key_present(json, key):
     try:
@@ -14,4 +18,20 @@ class Struct:
             if isinstance(b, (list, tuple)):
                 setattr(self, a, [Struct(x) if isinstance(x, dict) else x for x in b])
             else:
-                setattr(self, a, Struct(b) if isinstance(b, dict) else b)
\ No newline at end of file
+                setattr(self, a, Struct(b) if isinstance(b, dict) else b)
+
+
+def epoch(value):
+    """ Seconds of a naive UTC datetime (the precision of the http dates) """
+    return calendar.timegm(value.utctimetuple())
+
+
+def last_modified_of(*values):
+    """ The latest of datetimes / isoformat strings (the serialized created_at / updated_at), None without any """
+    latest = None
+    for value in values:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if value is not None and (latest is None or value > latest):
+            latest = value
+    return latest
@@ -0,0 +1,51 @@
+from redis import RedisError
+
+from config.api import redis_client
+from src.utils.caching import cache_key
+from src.utils.near_cache import near_cache
+
+# the workers keep the counters they read, a bump publish the names so every worker read them again
+near = near_cache('generation')
+
+
+def generation_key(name):
+    return cache_key('generation', name)
+
+
+def generations(*names):
+    """ Generation counters of namespaces (0 when missing), read from the near cache or in one MGET """
+    if redis_client is None or not names:
+        return [0] * len(names)
+    counters = {}
+    missing = []
+    for name in names:
+        counter = near.get(name)
+        if counter is None:
+            missing.append(name)
+        else:
+            counters[name] = counter
+    if missing:
+        current = near.generation()
+        try:
+            values = redis_client.mget([generation_key(name) for name in missing])
+        except RedisError:
+            return [0] * len(names)
+        for name, value in zip(missing, values):
+            counters[name] = int(value) if value is not None else 0
+            near.set(name, counters[name], current)
+    return [counters[name] for name in names]
+
+
+def bump_generations(*names):
+    """ Invalidate every key built with the namespaces, one INCR each in a single round trip (old keys age out) """
+    if redis_client is None or not names:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for name in names:
+            pipe.incr(generation_key(name))
+        near.publish(names, pipe)
+        pipe.execute()
+    except RedisError:
+        pass
+    near.drop(names)
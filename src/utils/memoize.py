@@ -0,0 +1,198 @@
+import functools
+import inspect
+import math
+import os
+import random
+import threading
+import time
+
+import msgpack
+from redis import RedisError
+from redis.exceptions import LockError
+
+import config
+from config.api import redis_client
+from src.utils.caching import cache_key, fingerprint
+from src.utils.generations import generations
+from src.utils.near_cache import near_cache
+from src.utils.records import pack, unpack
+
+# payload of a None result, only cached with negative_timeout
+NONE_PAYLOAD = pack(None)
+
+# seconds between two reads of a follower waiting for the leader of another worker
+WAIT_POLL_SECONDS = 0.025
+
+flights = {}
+flights_lock = threading.Lock()
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.payload = None
+        self.error = None
+
+
+def single_flight(key, compute, stale=None):
+    """Run compute once for the concurrent callers of a key in this worker.
+
+    The first caller (leader) run it, the others wait for its payload, or get the stale payload right away when they
+    have one. An error of the leader is raised in every caller.
+    """
+    with flights_lock:
+        flight = flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = flights[key] = Flight()
+    if not leader:
+        if stale is not None:
+            return stale
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.payload
+
+    try:
+        flight.payload = compute()
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with flights_lock:
+            flights.pop(key, None)
+        flight.done.set()
+    return flight.payload
+
+
+def must_refresh(fresh_until, delta, beta, now):
+    """ Probabilistic early refresh (xfetch), the longer the method take the sooner one caller refresh the entry """
+    return now - delta * beta * math.log(1.0 - random.random()) >= fresh_until
+
+
+def memoize(timeout, name=None, namespaces=None, negative_timeout=None, near_size=None, near_ttl=None, stale_seconds=None, beta=None):
+    """Cache the result of a service method in redis as a compact msgpack record.
+
+    The key is the name of the method and its arguments with the defaults applied (``self`` is not part of it, the
+    services hold no state), so ``get_store(uid, code)`` and ``get_store(uid, code, False)`` share an entry.
+    ``namespaces(*args)`` name the namespaces of an entry, their generation counters are part of the key so
+    ``bump_generations`` (src.utils.generations) invalidate all their entries at once, the old ones expire.
+    Models in the result come back as read-only rows (see src.utils.records), also on a miss and without redis,
+    so callers never see a difference between a cached and a fresh result. None is cached ``negative_timeout``
+    seconds when it is given (lookups of missing keys), not at all otherwise.
+    In front of redis each worker keep the payloads in a near cache (see src.utils.near_cache), ``near_size`` and
+    ``near_ttl`` override the NEAR_CACHE_SIZE / NEAR_CACHE_TTL settings, 0 disable it for the method.
+    ``method.forget(*args)`` drop the single entry of these arguments in redis and in the near cache of every worker.
+
+    A miss is computed once: the callers of a worker share one computation (single_flight) and the workers share a
+    redis lock per key. Followers of another worker get the stale entry (kept ``stale_seconds`` after the timeout)
+    or wait up to MEMO_LOCK_WAIT_MS for the leader. Before the timeout a caller may refresh the entry early, with
+    a chance that grow with the time the method took (``beta`` scale it, 0 disable).
+    """
+    app_settings = config.settings[os.environ.get("FLASK_ENV", "development")]
+    stale_seconds = app_settings.MEMO_STALE_SECONDS if stale_seconds is None else stale_seconds
+    beta = app_settings.MEMO_EARLY_REFRESH_BETA if beta is None else beta
+    lock_seconds = app_settings.MEMO_LOCK_SECONDS
+    lock_wait = app_settings.MEMO_LOCK_WAIT_MS / 1000.0
+
+    def decorator(f):
+        signature = inspect.signature(f)
+        cache_name = name or f.__qualname__
+        near = near_cache(cache_name, near_size, near_ttl)
+
+        def make_key(*args, **kwargs):
+            bound = signature.bind(None, *args, **kwargs)
+            bound.apply_defaults()
+            values = list(bound.arguments.values())[1:]
+            versions = generations(*namespaces(*values)) if namespaces is not None else []
+            return cache_key('memo', cache_name, fingerprint(versions, *values))
+
+        def read(key):
+            try:
+                return redis_client.get(key)
+            except RedisError:
+                return None
+
+        def compute(self, args, kwargs, key, generation):
+            started = time.time()
+            payload = pack(f(self, *args, **kwargs))
+            if payload == NONE_PAYLOAD:
+                if not negative_timeout:
+                    return payload
+                # a missing key is not served stale, its entry expire with it
+                fresh_seconds, expire_seconds = negative_timeout, negative_timeout
+            else:
+                fresh_seconds, expire_seconds = timeout, timeout + stale_seconds
+            # the entry carry when it stop being fresh and how long it took, for the early refresh
+            entry = msgpack.packb([started + fresh_seconds, time.time() - started, payload], use_bin_type=True)
+            try:
+                redis_client.set(key, entry, ex=expire_seconds)
+            except RedisError:
+                return payload
+            near.set(key, entry, generation)
+            return payload
+
+        def refresh(self, args, kwargs, key, stale, generation):
+            lock = redis_client.lock(key + ':lock', timeout=lock_seconds)
+            try:
+                acquired = lock.acquire(blocking=False)
+            except RedisError:
+                return compute(self, args, kwargs, key, generation)
+            if acquired:
+                try:
+                    return compute(self, args, kwargs, key, generation)
+                finally:
+                    try:
+                        lock.release()
+                    except (LockError, RedisError):
+                        pass
+            if stale is not None:
+                return stale
+            # another worker compute it, wait for its entry (compute it anyway when it take too long)
+            deadline = time.time() + lock_wait
+            while time.time() < deadline:
+                time.sleep(WAIT_POLL_SECONDS)
+                entry = read(key)
+                if entry is not None:
+                    return msgpack.unpackb(entry, raw=False)[2]
+            return compute(self, args, kwargs, key, generation)
+
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            key = make_key(*args, **kwargs)
+            if redis_client is None:
+                return unpack(single_flight(key, lambda: pack(f(self, *args, **kwargs))))
+
+            generation = near.generation()
+            entry = near.get(key)
+            if entry is None:
+                entry = read(key)
+                if entry is not None:
+                    near.set(key, entry, generation)
+            stale = None
+            if entry is not None:
+                fresh_until, delta, payload = msgpack.unpackb(entry, raw=False)
+                if not must_refresh(fresh_until, delta, beta, time.time()):
+                    return unpack(payload)
+                stale = payload
+            return unpack(single_flight(key, lambda: refresh(self, args, kwargs, key, stale, generation), stale))
+
+        def forget(*args, **kwargs):
+            if redis_client is None:
+                return
+            key = make_key(*args, **kwargs)
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.delete(key)
+                near.publish([key], pipe)
+                pipe.execute()
+            except RedisError:
+                pass
+            near.drop([key])
+
+        wrapper.make_key = make_key
+        wrapper.forget = forget
+        wrapper.near = near
+        return wrapper
+
+    return decorator
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from cachetools import TTLCache
+from redis import RedisError
+
+import config
+from config.api import redis_client
+from src.utils.caching import cache_key
+
+logger = logging.getLogger('console')
+
+# every NearCache by name, the invalidation messages name the cache they are for
+NEAR_CACHES = {}
+
+# other listeners of the channel by name, (on_message(message), on_resubscribe())
+LISTENERS = {}
+
+# seconds a listener wait before it subscribe again after redis failed
+RESUBSCRIBE_SECONDS = 1
+
+listener_thread = None
+listener_lock = threading.Lock()
+
+
+class NearCache:
+    """Bounded LRU of a worker in front of redis, entries live ``ttl`` seconds at most.
+
+    The entries are the payloads read from redis (unpacked on every hit, a caller can not change the cached value).
+    A delete path call ``invalidate(*keys)`` once redis changed, a message is published on the invalidation channel
+    and the listener thread of every worker drop the entries (the caller drop them right away in its own). A worker
+    that lost the channel (redis down) clear its near caches when it subscribe again. The ttl bound the staleness when
+    a message is lost anyway. A reader capture ``generation()`` before it read redis, ``set`` ignore the payload when keys were
+    dropped since (it may be older than the invalidation). Without redis there is no near cache, nothing would tell
+    the other workers.
+    """
+
+    def __init__(self, name, size, ttl):
+        self.name = name
+        self.enabled = redis_client is not None and size > 0 and ttl > 0
+        self.entries = TTLCache(maxsize=max(size, 1), ttl=max(ttl, 1))
+        self.dropped = 0
+        self.lock = threading.Lock()
+        NEAR_CACHES[name] = self
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        ensure_listener()
+        with self.lock:
+            return self.entries.get(key)
+
+    def generation(self):
+        return self.dropped
+
+    def set(self, key, payload, generation):
+        if not self.enabled:
+            return
+        with self.lock:
+            if generation == self.dropped:
+                self.entries[key] = payload
+
+    def drop(self, keys):
+        with self.lock:
+            self.dropped += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.dropped += 1
+            self.entries.clear()
+
+    def invalidate(self, *keys):
+        """ Drop the keys in every worker, called after the keys were changed in redis """
+        if not self.enabled or not keys:
+            return
+        try:
+            self.publish(keys, redis_client)
+        except RedisError as e:
+            logger.error('failed publish near cache invalidation {}'.format(e))
+        self.drop(keys)
+
+    def publish(self, keys, pipe):
+        """ Add the invalidation message to a pipeline, the caller drop the keys once it is executed """
+        if self.enabled:
+            pipe.publish(channel(), json.dumps({'cache': self.name, 'keys': [str(key) for key in keys]}))
+
+
+def near_cache(name, size=None, ttl=None):
+    """ NearCache with the NEAR_CACHE_SIZE / NEAR_CACHE_TTL defaults, a ttl or size of 0 disable it """
+    app_settings = config.settings[os.environ.get("FLASK_ENV", "development")]
+    return NearCache(name,
+                     app_settings.NEAR_CACHE_SIZE if size is None else size,
+                     app_settings.NEAR_CACHE_TTL if ttl is None else ttl)
+
+
+def channel():
+    return cache_key('near_cache', 'invalidate')
+
+
+def add_listener(name, on_message, on_resubscribe):
+    """ Receive the messages published with that name, on_resubscribe is called when messages may have been lost """
+    LISTENERS[name] = (on_message, on_resubscribe)
+    if redis_client is not None:
+        ensure_listener()
+
+
+def publish(name, **fields):
+    try:
+        redis_client.publish(channel(), json.dumps(dict(fields, cache=name)))
+    except RedisError as e:
+        logger.error('failed publish {} message {}'.format(name, e))
+
+
+def ensure_listener():
+    """ The listener is started by the first lookup, after the fork of the worker """
+    global listener_thread
+    if listener_thread is not None:
+        return
+    with listener_lock:
+        if listener_thread is not None:
+            return
+        listener_thread = threading.Thread(target=listen_forever, name='near-cache-invalidation', daemon=True)
+        listener_thread.start()
+
+
+def listen_forever():
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel())
+            # the messages sent while this worker was not subscribed are lost
+            for near in list(NEAR_CACHES.values()):
+                near.clear()
+            for _, on_resubscribe in list(LISTENERS.values()):
+                on_resubscribe()
+            for message in pubsub.listen():
+                handle_message(message['data'])
+        except RedisError as e:
+            logger.error('near cache invalidation channel failed {}'.format(e))
+        time.sleep(RESUBSCRIBE_SECONDS)
+
+
+def handle_message(data):
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return
+    near = NEAR_CACHES.get(message.get('cache'))
+    if near is not None:
+        near.drop(message.get('keys', ()))
+    listener = LISTENERS.get(message.get('cache'))
+    if listener is not None:
+        listener[0](message)
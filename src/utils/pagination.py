@@ -0,0 +1,161 @@
+import base64
+import json
+from datetime import datetime
+from math import ceil
+
+from sqlalchemy import DateTime, and_, func, or_
+
+CURSOR_NEXT = 'next'
+CURSOR_PREV = 'prev'
+
+
+class CursorPage:
+    """ Page of a keyset (cursor) query, same shape as flask-sqlalchemy Pagination where it make sense """
+
+    def __init__(self, items, has_next, has_prev, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = False
+        self.pages = None
+
+
+class OffsetPage:
+    """ Page of an offset query, total is None when the count was skipped (pages is unknown then) """
+
+    def __init__(self, items, page, per_page, total, has_next, total_is_estimate=False):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+        self.has_next = has_next
+        self.has_prev = page > 1
+        self.pages = None
+        if total is not None:
+            self.pages = int(ceil(total / float(per_page))) if per_page else 0
+
+
+def offset_paginate(query, page, per_page, total=None, total_is_estimate=False):
+    """ Paginate without the COUNT(*) of flask-sqlalchemy paginate, the total is given by the caller """
+    if page is None or page < 1:
+        page = 1
+    query = query.offset((page - 1) * per_page)
+    if total is None or total_is_estimate:
+        # one extra row tell if there is a page after this one
+        rows = query.limit(per_page + 1).all()
+        return OffsetPage(rows[:per_page], page, per_page, total, len(rows) > per_page, total_is_estimate)
+    rows = query.limit(per_page).all()
+    return OffsetPage(rows, page, per_page, total, page * per_page < total)
+
+
+class SortKey:
+    """ One column of a keyset ordering
+        nullable columns need a null_value, NULL is ordered differently by each database so they are compared through coalesce
+    """
+
+    def __init__(self, name, column, descending, null_value=None):
+        self.name = name
+        self.descending = descending
+        self.null_value = null_value
+        self.is_datetime = isinstance(column.type, DateTime)
+        self.expression = column if null_value is None else func.coalesce(column, null_value)
+
+    def order_by(self, reverse=False):
+        descending = self.descending != reverse
+        return self.expression.desc() if descending else self.expression.asc()
+
+    def after(self, value, reverse=False):
+        descending = self.descending != reverse
+        return self.expression < value if descending else self.expression > value
+
+    def dump(self, value):
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    def load(self, value):
+        return datetime.fromisoformat(value) if self.is_datetime and value is not None else value
+
+
+def sort_signature(sort_keys):
+    return ','.join('{}:{}'.format(key.name, 'desc' if key.descending else 'asc') for key in sort_keys)
+
+
+def encode_cursor(sort_keys, values, direction):
+    payload = {
+        'o': sort_signature(sort_keys),
+        'd': direction,
+        'v': [key.dump(value) for key, value in zip(sort_keys, values)],
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(sort_keys, cursor):
+    """ Return (values, direction) of the cursor, ValueError if it is broken or made for another ordering """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+        values = payload['v']
+        direction = payload['d']
+        signature = payload['o']
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise ValueError('invalid cursor')
+    if signature != sort_signature(sort_keys) or direction not in (CURSOR_NEXT, CURSOR_PREV) or len(values) != len(sort_keys):
+        raise ValueError('cursor not match the ordering')
+    return [key.load(value) for key, value in zip(sort_keys, values)], direction
+
+
+def keyset_filter(sort_keys, values, reverse=False):
+    """ Rows strictly after values on the ordering (before it when reverse)
+        (a > va) OR (a = va AND b > vb) OR (a = va AND b = vb AND c > vc) ... each column with his own direction
+    """
+    clauses = []
+    for index, key in enumerate(sort_keys):
+        equals = [sort_keys[previous].expression == values[previous] for previous in range(index)]
+        clauses.append(and_(*equals, key.after(values[index], reverse)))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, sort_keys, per_page, cursor=None):
+    """ Paginate the query by keyset instead of offset, the last sort key must be unique (primary key)
+        the total is never counted here (see src.utils.counting)
+    """
+    values = None
+    direction = CURSOR_NEXT
+    if cursor:
+        values, direction = decode_cursor(sort_keys, cursor)
+    reverse = direction == CURSOR_PREV
+
+    page_query = query
+    if values is not None:
+        page_query = page_query.filter(keyset_filter(sort_keys, values, reverse))
+    page_query = page_query.order_by(*[key.order_by(reverse) for key in sort_keys])
+    # one extra row tell if there is a page after this one
+    rows = page_query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if reverse:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = values is not None, has_more
+
+    next_cursor = None
+    prev_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(sort_keys, row_values(sort_keys, rows[-1]), CURSOR_NEXT)
+    if rows and has_prev:
+        prev_cursor = encode_cursor(sort_keys, row_values(sort_keys, rows[0]), CURSOR_PREV)
+    return CursorPage(rows, has_next, has_prev, next_cursor, prev_cursor)
+
+
+def row_values(sort_keys, row):
+    values = []
+    for key in sort_keys:
+        value = getattr(row, key.name)
+        values.append(key.null_value if value is None else value)
+    return values
@@ -0,0 +1,49 @@
+from flask import g
+
+from src.utils.roles_mask import match_requirements, roles_mask, user_roles_mask
+
+
+class Principal:
+    """
+    The authenticated user of the request (user row, active role names and store_code)
+    it is loaded once by the auth middlewares and kept on flask.g for the rest of the request
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.uid = user.uid
+        self.store_code = user.store_code
+        self.is_active = user.is_active
+        self.role_names = frozenset(role.name for role in user.roles if role.is_active)
+        self.role_mask = user_roles_mask(user.roles)
+
+    def __repr__(self):
+        return "<Principal(uid='{}', store_code='{}', roles={})>".format(self.uid, self.store_code, sorted(self.role_names))
+
+    def has_any_role(self, role_names):
+        return self.role_mask & roles_mask(role_names) != 0
+
+    def has_role(self, role_names):
+        required = roles_mask(role_names)
+        return self.role_mask & required == required
+
+    def matches(self, compiled_requirements):
+        return match_requirements(self.role_mask, compiled_requirements)
+
+
+def set_principal(principal):
+    g.principal = principal
+
+
+def current_principal(uid=None):
+    """ Return the principal of the current request, when uid is given only if the principal is this user """
+    principal = g.get('principal') if g else None
+    if principal is None:
+        return None
+    if uid is not None and principal.uid != uid:
+        return None
+    return principal
+
+
+def clear_principal(exception=None):
+    g.pop('principal', None)
@@ -0,0 +1,85 @@
+from collections import defaultdict
+
+from sqlalchemy import bindparam, delete, insert, select, update
+
+from config.database import db
+
+
+class Reconciliation:
+    """ Changes made by reconcile, the counts of rows by kind of change """
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+
+    @property
+    def changed(self):
+        return bool(self.inserted or self.updated or self.deleted)
+
+    def counts(self):
+        return {'inserted': self.inserted, 'updated': self.updated, 'deleted': self.deleted, 'unchanged': self.unchanged}
+
+
+def update_by_id(table, names):
+    """ UPDATE .. SET names WHERE id = :id, run with a list of rows (executemany) """
+    return update(table).where(table.c.id == bindparam('row_id')).values({name: bindparam('row_' + name) for name in names})
+
+
+def reconcile(table, scope, rows, key, on_delete=None):
+    """Make the rows of ``table`` in ``scope`` (column values, like {'store_id': 1}) the submitted ``rows``.
+
+    A submitted row is matched to a current row by its ``id`` when it has one of the scope, otherwise by the ``key``
+    columns (equal keys are matched in the order of the ids). Matched rows keep their id and are written only when a
+    value changed, the others are inserted and the current rows left unmatched are deleted (``on_delete(ids)`` run
+    before, to release their references). The statements run in the session transaction, the caller commit.
+    The current rows of the scope are read FOR UPDATE, a concurrent reconcile of the scope wait for the commit.
+    """
+    result = Reconciliation()
+    current = db.session.execute(select(table).where(*[table.c[name] == value for name, value in scope.items()])
+                                 .order_by(table.c.id).with_for_update()).mappings().all()
+    by_id = {row['id']: row for row in current}
+    by_key = defaultdict(list)
+    for row in current:
+        by_key[tuple(row[name] for name in key)].append(row)
+
+    matched = {}
+    taken = set()
+    for index, row in enumerate(rows):
+        if row.get('id') in by_id and row['id'] not in taken:
+            matched[index] = by_id[row['id']]
+            taken.add(row['id'])
+    for index, row in enumerate(rows):
+        if index in matched:
+            continue
+        candidates = [candidate for candidate in by_key[tuple(row[name] for name in key)] if candidate['id'] not in taken]
+        if candidates:
+            matched[index] = candidates[0]
+            taken.add(candidates[0]['id'])
+
+    updates = []
+    inserts = []
+    for index, row in enumerate(rows):
+        values = dict(scope, **{name: value for name, value in row.items() if name != 'id'})
+        if index not in matched:
+            inserts.append(values)
+        elif any(matched[index][name] != value for name, value in values.items()):
+            updates.append(dict(values, id=matched[index]['id']))
+        else:
+            result.unchanged += 1
+
+    deleted_ids = [row['id'] for row in current if row['id'] not in taken]
+    if deleted_ids:
+        if on_delete is not None:
+            on_delete(deleted_ids)
+        db.session.execute(delete(table).where(table.c.id.in_(deleted_ids)))
+    by_names = defaultdict(list)
+    for row in updates:
+        by_names[tuple(name for name in row if name != 'id')].append({'row_' + name: value for name, value in row.items()})
+    for names, params in by_names.items():
+        db.session.execute(update_by_id(table, names), params)
+    if inserts:
+        db.session.execute(insert(table), inserts)
+    result.inserted, result.updated, result.deleted = len(inserts), len(updates), len(deleted_ids)
+    return result
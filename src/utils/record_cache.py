@@ -0,0 +1,171 @@
+import threading
+
+from redis import RedisError
+
+from config.api import redis_client
+from src.utils.caching import cache_key
+from src.utils.near_cache import near_cache
+from src.utils.records import pack, unpack
+
+# payload of a record that does not exist (negative entry)
+MISSING = pack(None)
+
+# every RecordCache by name, for the stats
+CACHES = {}
+
+# local counters are added to the shared stats hash every that many lookups
+STATS_FLUSH_EVERY = 100
+
+
+class RecordCache:
+    """Cache of records (plain dicts) by id, with an explicit version per id.
+
+    The version of an id is part of the key of its record. A reader capture the version before it load the record
+    from the database and store it under that version, a writer INCR the version and write its record under the
+    new one, so a slow reader can never put back a record older than the last write. The version keys outlive the
+    records, a missing version is 0. Without redis (tests) every lookup go to the loader.
+    Hits and misses are counted by the worker and added to a shared redis hash (see cache_stats).
+    Each worker keep the records it read in a near cache by id (see src.utils.near_cache, ``near_size`` and
+    ``near_ttl`` override the settings), every write of an id invalidate it in all the workers.
+    With ``negative_timeout`` the ids the loader did not find are cached that long too (a write drop it as usual).
+    """
+
+    def __init__(self, name, timeout, near_size=None, near_ttl=None, negative_timeout=None):
+        self.name = name
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.near = near_cache('record:{}'.format(name), near_size, near_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.unflushed = {'hits': 0, 'misses': 0}
+        self.lock = threading.Lock()
+        CACHES[name] = self
+
+    def version_key(self, record_id):
+        return cache_key(self.name, 'version', record_id)
+
+    def record_key(self, record_id, version):
+        return cache_key(self.name, record_id, version)
+
+    def encode(self, record):
+        return pack(record)
+
+    def decode(self, payload):
+        return unpack(payload)
+
+    def version(self, record_id):
+        version = redis_client.get(self.version_key(record_id))
+        return int(version) if version is not None else 0
+
+    def get(self, record_id):
+        """ The cached record of the id, None when it is not cached (or cached as missing) """
+        if redis_client is None:
+            return None
+        try:
+            payload = redis_client.get(self.record_key(record_id, self.version(record_id)))
+        except RedisError:
+            return None
+        return self.decode(payload) if payload is not None else None
+
+    def load(self, record_id, loader):
+        """ Cached record of the id, on a miss loader() is called and its record (when not None) is cached """
+        if redis_client is None:
+            return loader()
+        payload = self.near.get(record_id)
+        if payload is not None:
+            self.count('hits')
+            return self.decode(payload)
+
+        generation = self.near.generation()
+        try:
+            version = self.version(record_id)
+            payload = redis_client.get(self.record_key(record_id, version))
+        except RedisError:
+            return loader()
+        if payload is not None:
+            self.count('hits')
+            self.near.set(record_id, payload, generation)
+            return self.decode(payload)
+
+        self.count('misses')
+        record = loader()
+        if record is None and not self.negative_timeout:
+            return record
+        payload = self.encode(record) if record is not None else MISSING
+        try:
+            redis_client.set(self.record_key(record_id, version), payload, ex=self.timeout if record is not None else self.negative_timeout)
+        except RedisError:
+            return record
+        self.near.set(record_id, payload, generation)
+        return record
+
+    def put(self, record_id, record):
+        """ Write through, the record become the current one of the id """
+        if redis_client is None:
+            return
+        try:
+            version = self.bump(record_id)
+            redis_client.set(self.record_key(record_id, version), self.encode(record), ex=self.timeout)
+        except RedisError:
+            self.forget(record_id)
+            return
+        self.near.invalidate(record_id)
+
+    def forget(self, record_id):
+        """ Retire the cached record of the id, the next read load it (a write that has only some fields of the record) """
+        if redis_client is None:
+            return
+        try:
+            self.bump(record_id)
+        except RedisError:
+            pass
+        self.near.invalidate(record_id)
+
+    def bump(self, record_id):
+        pipe = redis_client.pipeline()
+        pipe.incr(self.version_key(record_id))
+        # the version must outlive the records made with the previous ones
+        pipe.expire(self.version_key(record_id), self.timeout * 2)
+        version, _ = pipe.execute()
+        return version
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self.unflushed[counter] += 1
+            if self.unflushed['hits'] + self.unflushed['misses'] < STATS_FLUSH_EVERY:
+                return
+            unflushed, self.unflushed = self.unflushed, {'hits': 0, 'misses': 0}
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for name, value in unflushed.items():
+                pipe.hincrby(cache_key('cache_stats'), '{}:{}'.format(self.name, name), value)
+            pipe.execute()
+        except RedisError:
+            pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': hit_rate(self.hits, self.misses)}
+
+
+def hit_rate(hits, misses):
+    return round(hits / float(hits + misses), 4) if hits + misses else None
+
+
+def cache_stats():
+    """ Hits / misses of every record cache, for this worker and for all the workers (redis hash, flushed every STATS_FLUSH_EVERY) """
+    shared = {}
+    if redis_client is not None:
+        try:
+            shared = {field.decode('utf-8'): int(value) for field, value in redis_client.hgetall(cache_key('cache_stats')).items()}
+        except RedisError:
+            shared = {}
+    stats = {}
+    for name, record_cache in CACHES.items():
+        hits = shared.get('{}:hits'.format(name), 0)
+        misses = shared.get('{}:misses'.format(name), 0)
+        stats[name] = {
+            'worker': record_cache.stats(),
+            'all': {'hits': hits, 'misses': misses, 'hit_rate': hit_rate(hits, misses)},
+        }
+    return stats
@@ -0,0 +1,162 @@
+import threading
+from datetime import date, datetime
+
+import msgpack
+from sqlalchemy import inspect
+
+from config.database import db
+
+# msgpack extension types of the cached values
+EXT_DATETIME = 1
+EXT_DATE = 2
+EXT_ROW = 3
+EXT_TABLE = 4
+
+# models being packed by this thread, a relationship back to one of them is packed without its relationships
+packing = threading.local()
+
+
+class FrozenRow:
+    """Read-only row rebuilt from a cached record.
+
+    Columns (and the relationships that were loaded when it was cached) are attributes, like on the model,
+    nested records are rows too. A relationship back to a row being cached (location.store of store.locations) has the
+    columns of that row only. Nothing can be assigned, a writer must load the model from the database.
+    """
+    __slots__ = ('_values',)
+
+    def __init__(self, values):
+        object.__setattr__(self, '_values', {name: freeze(value) for name, value in values.items()})
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{} is read-only'.format(type(self).__name__))
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenRow) and self._values == other._values
+
+    def __repr__(self):
+        return '<FrozenRow({})>'.format(', '.join('{}={!r}'.format(name, value) for name, value in self._values.items()))
+
+    def keys(self):
+        return self._values.keys()
+
+    def to_dict(self):
+        return {name: thaw(value) for name, value in self._values.items()}
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenRow(value)
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    if isinstance(value, FrozenRow):
+        return value.to_dict()
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+def model_record(model, relationships=True):
+    """ Columns of a model with its loaded relationships (the lazy ones are not followed) """
+    state = inspect(model)
+    unloaded = state.unloaded
+    values = state.dict
+    record = {}
+    for column in state.mapper.column_attrs:
+        record[column.key] = getattr(model, column.key) if column.key in unloaded else values.get(column.key)
+    if relationships:
+        for relationship in state.mapper.relationships:
+            if relationship.key not in unloaded:
+                record[relationship.key] = values.get(relationship.key)
+    return record
+
+
+def pack_model(model):
+    active = getattr(packing, 'models', None)
+    if active is None:
+        active = packing.models = set()
+    if id(model) in active:
+        # hour.store of store.hours, the store is already packed around it
+        return pack(model_record(model, relationships=False))
+    active.add(id(model))
+    try:
+        return pack(model_record(model))
+    finally:
+        active.discard(id(model))
+
+
+class Table:
+    """ Rows of a list that share their columns, packed once as the header of a table (see pack) """
+    __slots__ = ('keys', 'rows')
+
+    def __init__(self, keys, rows):
+        self.keys = keys
+        self.rows = rows
+
+
+def as_record(value):
+    if isinstance(value, db.Model):
+        return model_record(value)
+    if isinstance(value, FrozenRow):
+        return value.to_dict()
+    return None
+
+
+def tabulate(value):
+    """ A list of models (or rows) with the same columns become a Table, the names are not repeated by every row """
+    if isinstance(value, (list, tuple)) and len(value) > 1:
+        records = [as_record(item) for item in value]
+        if all(record is not None for record in records):
+            keys = list(records[0])
+            if all(list(record) == keys for record in records):
+                return Table(keys, [list(record.values()) for record in records])
+    return value
+
+
+def default(value):
+    if isinstance(value, datetime):
+        return msgpack.ExtType(EXT_DATETIME, value.isoformat().encode('utf-8'))
+    if isinstance(value, date):
+        return msgpack.ExtType(EXT_DATE, value.isoformat().encode('utf-8'))
+    if isinstance(value, db.Model):
+        return msgpack.ExtType(EXT_ROW, pack_model(value))
+    if isinstance(value, FrozenRow):
+        return msgpack.ExtType(EXT_ROW, pack(value.to_dict()))
+    if isinstance(value, Table):
+        return msgpack.ExtType(EXT_TABLE, msgpack.packb([value.keys, value.rows], use_bin_type=True, default=default))
+    raise TypeError('{} can not be cached'.format(type(value)))
+
+
+def ext_hook(code, data):
+    if code == EXT_DATETIME:
+        return datetime.fromisoformat(data.decode('utf-8'))
+    if code == EXT_DATE:
+        return date.fromisoformat(data.decode('utf-8'))
+    if code == EXT_ROW:
+        return FrozenRow(unpack(data))
+    if code == EXT_TABLE:
+        keys, rows = unpack(data)
+        return [FrozenRow(dict(zip(keys, row))) for row in rows]
+    return msgpack.ExtType(code, data)
+
+
+def pack(value):
+    """ msgpack of a cached value, models become rows (see FrozenRow) """
+    return msgpack.packb(tabulate(value), use_bin_type=True, default=default)
+
+
+def unpack(payload):
+    return msgpack.unpackb(payload, raw=False, ext_hook=ext_hook, strict_map_key=False)
@@ -1,13 +1,39 @@
-from flask import jsonify
+import json
 
+from flask import current_app, jsonify, request
 
-def generic_response(code, data, message=None, params=None):
-    return jsonify({
+
+def response_body(code, data, message=None, params=None):
+    return {
         "status": True if code == 200 else False,
         "data": data if code == 200 else {},
         "error_params": params if code != 200 else {},
         "error": message if code != 200 else {}
-    }), code
+    }
+
+
+def generic_response(code, data, message=None, params=None):
+    return jsonify(response_body(code, data, message, params)), code
+
+
+def render_success(data):
+    """ Body of response_success(data) as bytes, for the responses rendered ahead (see response_rendered) """
+    return json.dumps(response_body(200, data), sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def negotiate_encoding():
+    """ Encoding of the rendered bodies accepted by the client, gzip or identity """
+    return 'gzip' if 'gzip' in request.accept_encodings else 'identity'
+
+
+def response_rendered(body, content_encoding=None, last_modified=None):
+    """ 200 response of a body rendered ahead by render_success, sent as is (gzip bodies with their encoding) """
+    response = current_app.response_class(body, status=200, mimetype='application/json')
+    if content_encoding is not None:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept-Encoding')
+    response.last_modified = last_modified
+    return response
 
 
 def response_error(message, params=None, status_code=400):
@@ -16,19 +42,24 @@ def response_error(message, params=None, status_code=400):
     return generic_response(status_code, None, message, params)
 
 
-def response_success(data=None):
+def response_success(data=None, last_modified=None):
     if data is None:
         data = {}
-    return generic_response(200, data)
+    response, code = generic_response(200, data)
+    response.last_modified = last_modified
+    return response, code
 
 
-def response_success_paging(items, total, pages, has_next, has_prev):
+def response_success_paging(items, total, pages, has_next, has_prev, next_cursor=None, prev_cursor=None, total_is_estimate=False):
     return response_success({
         "meta": {
             "next": has_next,
             "prev": has_prev,
             "pages": pages,
             "total_items": total,
+            "total_is_estimate": total_is_estimate,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
         },
         "items": items
     })
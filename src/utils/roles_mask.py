@@ -0,0 +1,45 @@
+from src.utils.enums import RolesTypes
+
+# every RolesTypes member own one bit, the order of the enum is the order of the bits
+ROLE_BITS = {role.value: 1 << index for index, role in enumerate(RolesTypes)}
+# bit that no user can have, role names that are not part of RolesTypes compile into it so they never match
+UNKNOWN_ROLE_BIT = 1 << len(ROLE_BITS)
+
+
+def role_bit(role_name):
+    return ROLE_BITS.get(role_name, UNKNOWN_ROLE_BIT)
+
+
+def roles_mask(role_names):
+    """ Mask of a list of role names (nested lists / tuples are flatten) """
+    mask = 0
+    for role_name in role_names:
+        if isinstance(role_name, (list, tuple)):
+            mask |= roles_mask(role_name)
+        else:
+            mask |= role_bit(role_name)
+    return mask
+
+
+def user_roles_mask(roles):
+    """ Mask of the active roles objects of an user, roles unknown to RolesTypes are ignored """
+    mask = 0
+    for role in roles:
+        if role.is_active:
+            mask |= ROLE_BITS.get(role.name, 0)
+    return mask
+
+
+def compile_requirements(requirements):
+    """ Compile requirements of check_user_roles into masks
+        Each requirement is either a role_name (user must have it) or a list/tuple of role names (user must have one of them)
+        so every requirement end as one mask and is accepted when the AND with the user mask is not zero.
+    """
+    return tuple(roles_mask(requirement) if isinstance(requirement, (list, tuple)) else role_bit(requirement) for requirement in requirements)
+
+
+def match_requirements(mask, compiled_requirements):
+    for requirement in compiled_requirements:
+        if not mask & requirement:
+            return False
+    return True
@@ -79,6 +79,8 @@ def valid_user_list_params(filters, orders):
     filters['countries'] = list(filter(lambda x: valid_country_code(x), filters['countries']))  # will remove from query any in valid param
     filters['emails'] = list(filter(lambda x: check_email(x), filters['emails']))  # will remove from query any in valid param
     filters['names'] = list(filter(lambda x: check_string_not_empty(x), filters['names']))  # will remove from query any in valid param
+    if not check_string_not_empty(filters.get('search')):
+        filters['search'] = None  # will remove from query any in valid param
 
     try:
         for order in orders:
@@ -93,7 +95,9 @@ def valid_user_list_params(filters, orders):
 
 
 def valid_user_list_by_permissions(userService, requester_uid, filters):
-    user = userService.get_user(requester_uid, True)
+    principal = userService.get_principal(requester_uid)
+    if principal is None:
+        return False
     # check if requester user is platform user and have relevant roles allow to do query
     platform_roles = [
         RolesTypes.Owner.value,
@@ -101,7 +105,7 @@ def valid_user_list_by_permissions(userService, requester_uid, filters):
         RolesTypes.Support.value,
         RolesTypes.Reports.value,
     ]
-    if userService.user_has_any_role_matched(requester_uid, platform_roles):
+    if principal.has_any_role(platform_roles):
         return filters
     # check if requester user is store user filter the stores filter to his register store_code and remove the rest
     store_roles = [
@@ -110,8 +114,8 @@ def valid_user_list_by_permissions(userService, requester_uid, filters):
         RolesTypes.StoreReport.value,
         RolesTypes.StoreSupport.value,
     ]
-    if userService.user_has_any_role_matched(requester_uid, store_roles) and user.store_code is not None:
-        filters['stores'] = [user.store_code]  # we reset this flag allow only search by his own store not global search
+    if principal.has_any_role(store_roles) and principal.store_code is not None:
+        filters['stores'] = [principal.store_code]  # we reset this flag allow only search by his own store not global search
         filters['platform'] = False
         filters['store_users'] = False
         return filters
@@ -1,10 +1,12 @@
 import json
 import os
+from contextlib import contextmanager
 from random import randint
 
 from faker import Faker
 from firebase_admin import auth
 from flask_testing import TestCase
+from sqlalchemy import event
 
 from config import settings
 from config.api import app
@@ -51,6 +53,7 @@ class BaseTestCase(TestCase):
         db.create_all()
         db.session.commit()
         self.roleService.insert_roles()
+        self.userService.user_search.clear()
         print(self.roleService.get_all_roles())
         self.init_unit_data()
         Faker.seed(randint(0, 100))
@@ -227,3 +230,30 @@ class BaseTestCase(TestCase):
     def assertRequestPassed(self, response, message):
         print('response data -> %s' % response.data)
         self.assert200(response, message)
+
+    @contextmanager
+    def count_queries(self):
+        """ Collect the sql statements executed inside the block """
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+            print('queries executed -> %d' % len(statements))
+
+    @contextmanager
+    def assertNumQueries(self, expected, message=None):
+        with self.count_queries() as statements:
+            yield statements
+        self.assertEqual(len(statements), expected, '{}\n{}'.format(message or 'unexpected number of queries', '\n'.join(statements)))
+
+    @contextmanager
+    def assertMaxQueries(self, maximum, message=None):
+        with self.count_queries() as statements:
+            yield statements
+        self.assertLessEqual(len(statements), maximum, '{}\n{}'.format(message or 'too many queries', '\n'.join(statements)))
@@ -1,9 +1,24 @@
 # tests/test_basic.py
+import gzip
+import json
+import threading
+import time
 import unittest
+from unittest import mock
 
-from src.utils.enums import RolesTypes
+import msgpack
+from sqlalchemy import event
+
+from config.database import db
+
+from src.models.stores import Store
+from src.utils import memoize
+from src.utils.enums import RolesTypes, StorePayloadShape
 from src.utils.general import Struct
+from src.utils.near_cache import handle_message
+from src.utils.records import FrozenRow, pack, unpack
 from test.common.Basecase import BaseTestCase
+from test.utils.redis import fake_redis
 
 
 class FlaskTestCase(BaseTestCase):
@@ -456,6 +471,437 @@ class FlaskTestCase(BaseTestCase):
         self.assertEqual(response_data.data.info.name, store['info']['name'])
         self.assertEqual(response_data.data.info.default_currency_code, store['info']['default_currency_code'])
 
+    def test_get_store_aggregate_queries(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+        locations = [{'lat': 0, 'lng': 0, 'address': 'hagat', 'city': 'ramat fam', 'country_code': 'IL', 'is_close': False} for _ in range(5)]
+        self.storeService.update_locations(uid, store_code, Struct({'locations': locations}))
+        hours = [{'day': day % 7, 'location_id': None, 'from_time': 9, 'to_time': 18, 'is_open_24': False, 'is_close': False} for day in range(14)]
+        self.storeService.update_hours(uid, store_code, Struct({'hours': hours}))
+        db.session.expire_all()
+        with self.assertMaxQueries(2, 'store info must load with its locations and hours at once'):
+            store = self.storeService.get_store_by_status_code(store_code)
+        self.assertEqual(len(store['locations']), 5)
+        self.assertEqual(len(store['hours']), 14)
+        db.session.expire_all()
+        with self.assertMaxQueries(2, 'owner store must load with its locations and hours at once'):
+            self.assertEqual(self.storeService.get_store(uid, store_code), store)
+        db.session.expire_all()
+        with self.assertMaxQueries(2, 'stores list must not load per store'):
+            self.storeService.get_stores()
+
+    def test_get_store_info_normalized(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        token = user_object['idToken']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+        locations = [{'lat': 0, 'lng': 0, 'address': 'hagat', 'city': 'ramat fam', 'country_code': 'IL', 'is_close': False} for _ in range(2)]
+        self.storeService.update_locations(uid, store_code, Struct({'locations': locations}))
+        hours = [{'day': day, 'location_id': None, 'from_time': 9, 'to_time': 18, 'is_open_24': False, 'is_close': False} for day in range(7)]
+        self.storeService.update_hours(uid, store_code, Struct({'hours': hours}))
+        legacy = self.storeService.get_store_by_status_code(store_code)
+
+        response = self.request_get('/api/store/{}/info'.format(store_code), token, {'shape': 'normalized'})
+        self.assert200(response, 'get normalized store info request failed')
+        data = response.json['data']
+        self.assertEqual({key: value for key, value in data['info'].items() if key != 'id'}, legacy['info'])
+        self.assertEqual(len(data['locations']), 2)
+        self.assertEqual(len(data['hours']), 7)
+        self.assertTrue(all(location['store_id'] == data['info']['id'] and 'store' not in location for location in data['locations']))
+        self.assertTrue(all(hour['store_id'] == data['info']['id'] and 'store' not in hour for hour in data['hours']))
+
+        response = self.request_get('/api/store/{}/info'.format(store_code), token)
+        self.assert200(response, 'get store info request failed')
+        self.assertEqual(response.json['data'], legacy)
+
+    def test_get_store_info_gzip(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        token = user_object['idToken']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+
+        response = self.request_get('/api/store/{}/info'.format(store_code), token, extra_headers={'Accept-Encoding': 'gzip'})
+        self.assert200(response, 'get gzip store info request failed')
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        data = json.loads(gzip.decompress(response.data))
+        self.assertEqual(data['data'], self.storeService.get_store_by_status_code(store_code))
+
+        response = self.request_get('/api/store/{}/info'.format(store_code), token)
+        self.assert200(response, 'get store info request failed')
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        self.assertEqual(response.json['data'], data['data'])
+
+    def test_get_store_info_not_modified(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        token = user_object['idToken']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+
+        response = self.request_get('/api/store/{}/info'.format(store_code), token)
+        self.assert200(response, 'get store info request failed')
+        etag = response.headers.get('ETag')
+        self.assertIsNotNone(etag)
+        self.assertIsNotNone(response.headers.get('Last-Modified'))
+        self.assertIsNotNone(response.headers.get('Cache-Control'))
+
+        response = self.request_get('/api/store/{}/info'.format(store_code), token, extra_headers={'If-None-Match': etag})
+        self.assertStatus(response, 304)
+        self.assertEqual(response.data, b'')
+
+        self.storeService.update_store_info(uid, store_code, Struct({'name': 'renamed store', 'currency_code': 'USD', 'description': 'store description'}))
+        response = self.request_get('/api/store/{}/info'.format(store_code), token, extra_headers={'If-None-Match': etag})
+        self.assert200(response, 'get store info after update request failed')
+        self.assertNotEqual(response.headers.get('ETag'), etag)
+        self.assertEqual(response.json['data']['info']['name'], 'renamed store')
+
+    def test_update_locations_reconcile(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+        locations = [{'lat': 0, 'lng': 0, 'address': address, 'city': 'ramat fam', 'country_code': 'IL', 'is_close': False}
+                     for address in ('hagat', 'hagefen', 'hatamar')]
+        store = self.storeService.update_locations(uid, store_code, Struct({'locations': locations}))
+        self.assertEqual(store['changes'], {'inserted': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0})
+        ids = [location['id'] for location in store['locations']]
+        hours = [{'day': day, 'location_id': ids[2], 'from_time': 9, 'to_time': 18, 'is_open_24': False, 'is_close': False} for day in range(1, 8)]
+        store = self.storeService.update_hours(uid, store_code, Struct({'hours': hours}))
+        self.assertEqual(store['changes']['inserted'], 7)
+
+        store = self.storeService.update_locations(uid, store_code, Struct({'locations': locations}))
+        self.assertEqual(store['changes'], {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 3})
+        self.assertListEqual([location['id'] for location in store['locations']], ids)
+
+        locations = [dict(locations[0], is_close=True), dict(locations[1], id=ids[1], address='hazait'), dict(locations[0], address='harimon')]
+        with self.count_queries() as statements:
+            store = self.storeService.update_locations(uid, store_code, Struct({'locations': locations}))
+        self.assertEqual(store['changes'], {'inserted': 1, 'updated': 2, 'deleted': 1, 'unchanged': 0})
+        # the matched rows are updated by id, there is no conflict to resolve
+        updates = [statement for statement in statements if statement.startswith('UPDATE stores_locations')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('WHERE stores_locations.id = ?', updates[0])
+        self.assertFalse(any('ON CONFLICT' in statement for statement in statements))
+        self.assertListEqual([location['id'] for location in store['locations']][:2], ids[:2])
+        self.assertEqual(store['locations'][1]['address'], 'hazait')
+        self.assertTrue(all(hour['location'] is None for hour in store['hours']))
+
+    def test_get_stores_single_flight(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        results = []
+        followers = []
+        joined = []
+        all_joined = threading.Event()
+
+        class JoinedFlights(dict):
+            # a caller finding the flight of the leader wait for its payload
+            def get(self, key, default=None):
+                flight = super().get(key, default)
+                if flight is not None:
+                    joined.append(key)
+                    if len(joined) == 49:
+                        all_joined.set()
+                return flight
+
+        def follower():
+            results.append(self.storeService.get_stores(True))
+
+        def start_followers(conn, cursor, statement, parameters, context, executemany):
+            # 49 more callers arrive while the first one is still querying
+            if not followers:
+                followers.extend(threading.Thread(target=follower) for _ in range(49))
+                for thread in followers:
+                    thread.start()
+                self.assertTrue(all_joined.wait(5), 'the callers did not join the leader')
+
+        with fake_redis(), mock.patch.object(memoize, 'flights', JoinedFlights()):
+            event.listen(db.engine, 'before_cursor_execute', start_followers)
+            try:
+                with self.assertNumQueries(1, 'concurrent misses must be computed once'):
+                    results.append(self.storeService.get_stores(True))
+                    for thread in followers:
+                        thread.join()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', start_followers)
+        self.assertEqual(len(results), 50)
+        self.assertTrue(all(stores == results[0] for stores in results))
+
+    def test_get_stores_other_worker(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+        get_stores = self.storeService.get_stores
+        with fake_redis() as client:
+            names = [store['name'] for store in get_stores()]
+            key = get_stores.make_key()
+            fresh_until, delta, payload = msgpack.unpackb(client.get(key), raw=False)
+            # kept MEMO_STALE_SECONDS after the timeout
+            self.assertGreater(client.ttl(key), 50)
+            Store.query.filter_by(store_code=store_code).update({'name': 'renamed store'}, synchronize_session=False)
+            db.session.commit()
+
+            # the entry is past its timeout and another worker hold the lock, this one (own near cache) serve the stale entry
+            client.set(key, msgpack.packb([time.time() - 1, delta, payload], use_bin_type=True))
+            get_stores.near.clear()
+            lock = client.lock(key + ':lock', timeout=10)
+            lock.acquire()
+            with self.assertNumQueries(0, 'the stale entry was not served while another worker refresh it'):
+                self.assertListEqual([store['name'] for store in get_stores()], names)
+
+            # no entry at all, it wait for the entry of the lock holder
+            client.delete(key)
+            get_stores.near.clear()
+
+            def holder_done(seconds):
+                client.set(key, msgpack.packb([time.time() + 50, delta, payload], use_bin_type=True))
+
+            with mock.patch.object(memoize.time, 'sleep', side_effect=holder_done) as sleep:
+                with self.assertNumQueries(0, 'the entry of the lock holder was not waited for'):
+                    self.assertListEqual([store['name'] for store in get_stores()], names)
+            sleep.assert_called_once_with(memoize.WAIT_POLL_SECONDS)
+
+            # the lock holder never write it, after MEMO_LOCK_WAIT_MS it compute the entry itself
+            client.delete(key)
+            get_stores.near.clear()
+            with self.assertNumQueries(1, 'the entry was not computed after the wait'):
+                self.assertIn('renamed store', [store['name'] for store in get_stores()])
+            lock.release()
+
+            # a fresh entry that took 2s to compute is refreshed early when the draw say so, the entry is computed again
+            Store.query.filter_by(store_code=store_code).update({'name': 'early store'}, synchronize_session=False)
+            db.session.commit()
+            fresh_until, delta, payload = msgpack.unpackb(client.get(key), raw=False)
+            client.set(key, msgpack.packb([time.time() + 10, 2, payload], use_bin_type=True))
+            get_stores.near.clear()
+            with mock.patch.object(memoize.random, 'random', return_value=0.0):
+                with self.assertNumQueries(0, 'a fresh entry was refreshed'):
+                    self.assertIn('renamed store', [store['name'] for store in get_stores()])
+            with mock.patch.object(memoize.random, 'random', return_value=1 - 1e-12):
+                with self.assertNumQueries(1, 'the entry was not refreshed early'):
+                    self.assertIn('early store', [store['name'] for store in get_stores()])
+
+    def test_store_aggregate_cached_as_rows(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+        locations = [{'lat': 0, 'lng': 0, 'address': 'hagat', 'city': 'ramat fam', 'country_code': 'IL', 'is_close': False} for _ in range(2)]
+        self.storeService.update_locations(uid, store_code, Struct({'locations': locations}))
+        hours = [{'day': day, 'location_id': None, 'from_time': 9, 'to_time': 18, 'is_open_24': False, 'is_close': False} for day in range(7)]
+        self.storeService.update_hours(uid, store_code, Struct({'hours': hours}))
+        db.session.expire_all()
+        model = self.storeService.load_store_aggregate(Store.store_code == store_code)
+        payload = self.storeService.store_payload(model)
+
+        row = unpack(pack(model))
+        self.assertIsInstance(row, FrozenRow)
+        self.assertEqual(row.store_code, store_code)
+        self.assertEqual(row.owner_id, model.owner_id)
+        self.assertEqual(len(row.locations), 2)
+        self.assertEqual(len(row.hours), 7)
+        self.assertEqual(self.storeService.store_payload(row)['info'], payload['info'])
+        # the store of a location / hour is a back reference, it keep the columns of the store only
+        self.assertTrue(all(location.store.store_code == store_code and 'locations' not in location.store.keys() for location in row.locations))
+        self.assertListEqual([dict(location, store=None) for location in self.storeService.store_payload(row)['locations']],
+                             [dict(location, store=None) for location in payload['locations']])
+        self.assertEqual(unpack(pack(row)), row)
+        with self.assertRaises(AttributeError):
+            row.name = 'other name'
+
+        with fake_redis():
+            self.storeService.get_store(uid, store_code, True)
+            with self.assertNumQueries(0, 'the cached store row was not used'):
+                row = self.storeService.get_store(uid, store_code, True)
+            self.assertIsInstance(row, FrozenRow)
+            self.assertEqual(self.storeService.store_payload(row)['info'], payload['info'])
+            self.assertEqual(len(row.hours), 7)
+
+    def test_clear_store_cache(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+        other = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        with fake_redis():
+            name = self.storeService.get_store(uid, store_code)['info']['name']
+            self.assertIn(name, [store['name'] for store in self.storeService.get_stores()])
+            Store.query.filter_by(store_code=store_code).update({'name': 'renamed store'}, synchronize_session=False)
+            db.session.commit()
+            self.assertEqual(self.storeService.get_store(uid, store_code)['info']['name'], name)
+            self.assertIn(name, [store['name'] for store in self.storeService.get_stores()])
+
+            # clearing another store keep this one
+            self.storeService.clear_store_cache(other['info']['store_code'])
+            with self.assertNumQueries(0, 'the cache of another store was cleared'):
+                self.assertEqual(self.storeService.get_store(uid, store_code)['info']['name'], name)
+
+            self.storeService.clear_store_cache(store_code)
+            self.assertEqual(self.storeService.get_store(uid, store_code)['info']['name'], 'renamed store')
+            self.assertIn('renamed store', [store['name'] for store in self.storeService.get_stores()])
+
+    def test_owner_written(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+        user_data = Struct({'fullname': 'renamed owner', 'address1': 'hagat', 'address2': 'hagefen', 'country': 'IL', 'currency': 'USD'})
+        with fake_redis():
+            keys = [self.storeService.get_stores.make_key(), self.storeService.find_store_by_code.make_key(store_code),
+                    self.storeService.get_store.make_key(uid, store_code)]
+            # a user owning no store keep the store entries
+            self.userService.update_user_info(self.platform_support_object.uid, user_data)
+            self.assertListEqual([self.storeService.get_stores.make_key(), self.storeService.find_store_by_code.make_key(store_code),
+                                  self.storeService.get_store.make_key(uid, store_code)], keys)
+
+            # the entries nesting the owner are retired by a write of the owner
+            self.userService.update_user_info(uid, user_data)
+            self.assertNotEqual(self.storeService.get_stores.make_key(), keys[0])
+            self.assertNotEqual(self.storeService.find_store_by_code.make_key(store_code), keys[1])
+            self.assertNotEqual(self.storeService.get_store.make_key(uid, store_code), keys[2])
+
+    def test_known_keys_filter(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        known_keys = self.storeService.known_keys
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+        with fake_redis(), mock.patch.object(known_keys, 'enabled', True), mock.patch.object(known_keys, 'filters', None):
+            self.assertTrue(known_keys.might_exist('store', store_code))
+            with self.assertNumQueries(0, 'a store code the filter never saw was looked up'):
+                self.assertIsNone(self.storeService.get_store_by_status_code('missing-store-code'))
+                self.assertIsNone(self.storeService.get_store_snapshot('missing-store-code', StorePayloadShape.Legacy, 'identity'))
+
+            # the creating worker know the store at once
+            created = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+            self.assertEqual(self.storeService.get_store_by_status_code(created['info']['store_code'])['info']['name'], created['info']['name'])
+
+            # a store created by another worker is missing here until its message arrive
+            name = self.fake.company()
+            with mock.patch.object(known_keys, 'add'):
+                self.storeService.create_store(uid, {'name': name, 'currency_code': 'USD', 'description': 'store description'})
+            other_code = Store.query.filter_by(name=name).first().store_code
+            self.assertFalse(known_keys.might_exist('store', other_code))
+            self.assertIsNone(self.storeService.get_store_by_status_code(other_code))
+            handle_message(json.dumps({'cache': known_keys.listener_name, 'kind': 'store', 'key': other_code}))
+            self.assertTrue(known_keys.might_exist('store', other_code))
+            self.assertIsNotNone(self.storeService.get_store_by_status_code(other_code))
+
+            # lost messages, the filters are built again from the database
+            name = self.fake.company()
+            with mock.patch.object(known_keys, 'add'):
+                self.storeService.create_store(uid, {'name': name, 'currency_code': 'USD', 'description': 'store description'})
+            lost_code = Store.query.filter_by(name=name).first().store_code
+            self.assertFalse(known_keys.might_exist('store', lost_code))
+            known_keys.invalidate()
+            self.assertTrue(known_keys.might_exist('store', lost_code))
+
+    def test_missing_store_cached(self):
+        with fake_redis():
+            with self.assertMaxQueries(2, 'missing store was not looked up'):
+                self.assertIsNone(self.storeService.get_store_by_status_code('missing-store-code'))
+            with self.assertNumQueries(0, 'missing store was not cached'):
+                self.assertIsNone(self.storeService.get_store_by_status_code('missing-store-code'))
+
+    def test_get_store_snapshot(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        store_code = store['info']['store_code']
+        with fake_redis():
+            body, modified = self.storeService.get_store_snapshot(store_code, StorePayloadShape.Legacy, 'identity')
+            self.assertEqual(json.loads(body)['data'], store)
+            with self.assertNumQueries(0, 'the store snapshot was not served from redis'):
+                self.assertEqual(self.storeService.get_store_snapshot(store_code, StorePayloadShape.Legacy, 'identity'), (body, modified))
+                body, _ = self.storeService.get_store_snapshot(store_code, StorePayloadShape.Legacy, 'gzip')
+            self.assertEqual(json.loads(gzip.decompress(body))['data'], store)
+
+            # the store is renamed while a reader load it, the payload it loaded must not replace the new snapshot
+            self.storeService.clear_stores_cache()
+            loaded = self.storeService.get_store_by_status_code(store_code)
+
+            def load_racing_write(*args, **kwargs):
+                renamed = Struct({'name': 'renamed store', 'description': 'store description', 'currency_code': 'USD'})
+                self.storeService.update_store_info(uid, store_code, renamed)
+                return loaded
+
+            with mock.patch.object(self.storeService, 'get_store_by_status_code', side_effect=load_racing_write):
+                body, _ = self.storeService.get_store_snapshot(store_code, StorePayloadShape.Legacy, 'identity')
+            self.assertEqual(json.loads(body)['data']['info']['name'], store['info']['name'])
+            body, _ = self.storeService.get_store_snapshot(store_code, StorePayloadShape.Legacy, 'identity')
+            self.assertEqual(json.loads(body)['data']['info']['name'], 'renamed store')
+
+    def test_store_snapshot_owner_written(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        with fake_redis() as client:
+            store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+            store_code = store['info']['store_code']
+            key = self.storeService.snapshot_key(store_code, StorePayloadShape.Legacy)
+            self.assertTrue(client.exists(key))
+
+            # the owner get the store after it is rendered, the snapshot is rendered again with him
+            self.userService.update_user_store_owner(uid, store_code)
+            self.assertNotEqual(self.storeService.snapshot_key(store_code, StorePayloadShape.Legacy), key)
+            with self.assertNumQueries(0, 'the store snapshot was not rendered after the owner write'):
+                body, _ = self.storeService.get_store_snapshot(store_code, StorePayloadShape.Legacy, 'identity')
+            self.assertEqual(json.loads(body)['data'], self.storeService.get_store(uid, store_code))
+
+    def test_get_stores_not_modified(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        token = user_object['idToken']
+        self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        with fake_redis():
+            response = self.request_get('/api/store/list', token)
+            self.assert200(response, 'get stores request failed')
+            etag = response.headers.get('ETag')
+            self.assertIsNotNone(etag)
+            last_modified = response.headers.get('Last-Modified')
+            self.assertIsNotNone(last_modified)
+
+            # answered from the kept validators, the stores are not loaded
+            with mock.patch.object(self.storeService, 'get_stores') as get_stores:
+                response = self.request_get('/api/store/list', token, extra_headers={'If-None-Match': etag})
+                self.assertStatus(response, 304)
+                response = self.request_get('/api/store/list', token, extra_headers={'If-Modified-Since': last_modified})
+                self.assertStatus(response, 304)
+            get_stores.assert_not_called()
+
+            store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+            response = self.request_get('/api/store/list', token, extra_headers={'If-None-Match': etag})
+            self.assert200(response, 'get stores after create request failed')
+            self.assertNotEqual(response.headers.get('ETag'), etag)
+            self.assertIn(store['info']['store_code'], [store['store_code'] for store in response.json['data']])
+
+    def test_store_validators_owner_written(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        token = user_object['idToken']
+        store = self.storeService.create_store(uid, {'name': self.fake.company(), 'currency_code': 'USD', 'description': 'store description'})
+        urls = ('/api/store/list', '/api/store/{}/info'.format(store['info']['store_code']))
+        with fake_redis():
+            etags = {}
+            for url in urls:
+                response = self.request_get(url, token)
+                self.assert200(response, 'get {} request failed'.format(url))
+                etags[url] = response.headers.get('ETag')
+
+            # the kept validators of the stores of the owner are retired by a write of the owner, the views run again
+            self.userService.update_user_store_owner(uid, store['info']['store_code'])
+            with mock.patch.object(self.storeService, 'get_stores', wraps=self.storeService.get_stores) as get_stores:
+                with mock.patch.object(self.storeService, 'get_store_snapshot', wraps=self.storeService.get_store_snapshot) as get_store_snapshot:
+                    for url in urls:
+                        self.request_get(url, token, extra_headers={'If-None-Match': etags[url]})
+            get_stores.assert_called_once_with()
+            get_store_snapshot.assert_called_once()
+
 
 if __name__ == '__main__':
     unittest.main()
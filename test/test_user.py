@@ -1,11 +1,26 @@
 # tests/test_basic.py
+import json
+import time
 import unittest
+from unittest import mock
 
+import firebase_admin
+import rsa
+from firebase_admin import auth
+from firebase_admin.exceptions import FirebaseError
+from google.auth import crypt, jwt
+
+from config.database import db
+from src.models import User
 from src.schemas.user_schema import UserSchema
-from src.utils.enums import RolesTypes
+from src.utils.enums import AllowSortByDirection, AllowUserColumnOrderBy, CountStrategy, RolesTypes
+from src.utils.firebase_utils import create_firebase_user
 from src.utils.general import Struct
+from src.utils.near_cache import handle_message
+from src.utils.principal import current_principal
 from src.utils.validations import valid_user_list_params
 from test.common.Basecase import BaseTestCase
+from test.utils.redis import fake_redis
 from urllib.parse import urlencode
 
 
@@ -152,6 +167,68 @@ class FlaskTestCase(BaseTestCase):
             self.assertFalse(response_data.data.meta.next)
             self.assertFalse(response_data.data.meta.prev)
 
+    def test_get_user_list_platform_names_filters_search_index(self):
+        with self.client:
+            user_object = self.login_user(self.platform_owner_user)
+            token = user_object['idToken']
+            users = self.userUtils.create_platforms_users()
+            selected_params = [
+                users['accounts'][0]['name'],
+                users['support'][0]['name']
+            ]
+            query_params = {
+                'filter_names': ','.join(selected_params),
+                'filter_store_users': 0,
+                'filter_inactive': 0,
+                'filter_platform': 1,
+                'search_index': 1,
+                'per_page': 20,
+                'page': 1
+            }
+            response = self.request_get('/api/user/list', token, urlencode(query_params))
+            self.assertRequestPassed(response, 'getting user list from the search index request failed')
+            response_data = Struct(response.json)
+            filters = {
+                'names': selected_params,
+                'emails': [],
+                'stores': [],
+                'countries': [],
+                'store_users': False,
+                'platform': True
+            }
+            users = self.userService.get_users(filters, [], 20, 1, False)
+            self.assertTrue(response_data.status)
+            self.assertSetEqual({user.uid for user in users.items}, {user['uid'] for user in response.json['data']['items']})
+            self.assertEqual(response_data.data.meta.total_items, users.total)
+
+            # the index follow the writes, a frozen user leave the active list
+            self.userService.toggle_freeze_user(users.items[0].uid)
+            result = self.userService.search_users(filters, [], 20, 1)
+            self.assertNotIn(users.items[0].uid, [user.uid for user in result.items])
+            self.assertEqual(result.total, users.total - 1)
+
+    def test_get_user_list_roles_loaded_in_bulk(self):
+        with self.client:
+            self.userUtils.create_platforms_users()
+            filters = {
+                'names': [],
+                'emails': [],
+                'stores': [],
+                'countries': [],
+                'store_users': False,
+                'platform': True
+            }
+            schema = UserSchema()
+            # count + page + roles of the page, whatever the page size
+            with self.assertNumQueries(3, 'user list roles are loaded per user'):
+                data = schema.dump(self.userService.get_users(filters, [], 20, 1, False).items, many=True)
+            self.assertGreater(len(data), 10)
+            self.assertTrue(all(len(user['roles']) > 0 for user in data))
+
+            with self.assertNumQueries(1, 'user roles are not loaded with the user'):
+                user = schema.dump(self.userService.get_user(self.platform_owner_object.uid, True))
+            self.assertEqual(len(user['roles']), 1)
+
     def test_get_user_list_platform_inactive_filters_no_order(self):
         with self.client:
             self.assertEqual.__self__.maxDiff = None
@@ -763,6 +840,12 @@ class FlaskTestCase(BaseTestCase):
             self.assertEqual(user.address2, address2)
             self.assertEqual(user.country, country)
             self.assertEqual(user.currency, currency)
+            self.assertTrue(response_data.data.changed)
+
+            # same values again, the update match no row
+            response = self.request_put('/api/user/update', token, None, None, post_data)
+            self.assertRequestPassed(response, 'update user info request failed')
+            self.assertFalse(Struct(response.json).data.changed)
 
     def test_user_update_info_as_global_support(self):
         with self.client:
@@ -999,6 +1082,499 @@ class FlaskTestCase(BaseTestCase):
             self.assertEqual(response_data.data.user_data.fullname, user.fullname)
             self.assertEqual(response_data.data.user_data.roles[0].id, user.roles[0].id)
 
+    def test_get_users_batch(self):
+        with self.client:
+            user_object = self.login_user(self.platform_support_user)
+            token = user_object['idToken']
+            uids = [self.platform_owner_object.uid, self.platform_accounts_object.uid, 'missing-user-uid']
+            response = self.request_post('/api/user/batch', token, None, None, {'uids': uids})
+            self.assertRequestPassed(response, 'batch users request failed')
+            data = response.json['data']
+            self.assertListEqual(sorted(data.keys()), sorted(uids))
+            self.assertEqual(data['missing-user-uid']['error'], 'user not found')
+            owner = self.userService.get_user(self.platform_owner_object.uid)
+            self.assertDictEqual(data[self.platform_owner_object.uid]['user_data'], owner)
+            self.assertFalse(data[self.platform_owner_object.uid]['user_meta']['disabled'])
+
+            response = self.request_post('/api/user/batch', token, None, None, {'uids': []})
+            self.assert400(response, 'batch users request passed without uids')
+
+    def test_token_cache_forget_uid_message(self):
+        token_cache = self.userService.token_cache
+        uid = self.platform_support_object.uid
+        claims = {'uid': uid, 'exp': time.time() + 3600}
+        token_cache.set('support-token', claims)
+        token_cache.set('owner-token', {'uid': self.platform_owner_object.uid, 'exp': time.time() + 3600})
+        self.assertEqual(token_cache.get('support-token'), claims)
+
+        # the freeze happened in another worker, its message drop the tokens of the uid here
+        handle_message(json.dumps({'cache': token_cache.listener_name, 'uid': uid}))
+        self.assertIsNone(token_cache.get('support-token'))
+        self.assertIsNotNone(token_cache.get('owner-token'))
+
+        token_cache.forget_uid(self.platform_owner_object.uid)
+        self.assertIsNone(token_cache.get('owner-token'))
+
+    def test_signing_keys_offline_verification(self):
+        signing_keys = self.userService.signing_keys
+        uid = self.platform_owner_object.uid
+        project_id = firebase_admin.get_app().project_id
+        public_key, private_key = rsa.newkeys(1024)
+        signer = crypt.RSASigner.from_string(private_key.save_pkcs1(), 'test-key')
+        now = int(time.time())
+        claims = {'iss': 'https://securetoken.google.com/{}'.format(project_id), 'aud': project_id, 'sub': uid,
+                  'iat': now, 'exp': now + 3600, 'auth_time': now}
+        keys = signing_keys.keys
+        signing_keys.keys = {'test-key': public_key.save_pkcs1().decode('utf-8')}
+        try:
+            verified = signing_keys.verify(jwt.encode(signer, claims).decode('utf-8'))
+            self.assertEqual(verified['uid'], uid)
+            with self.assertRaises(ValueError):
+                signing_keys.verify(jwt.encode(signer, dict(claims, aud='other-project')).decode('utf-8'))
+            with self.assertRaises(ValueError):
+                signing_keys.verify(jwt.encode(signer, dict(claims, iss='https://securetoken.google.com/other-project')).decode('utf-8'))
+            with self.assertRaises(ValueError):
+                signing_keys.verify(jwt.encode(signer, dict(claims, iat=now - 7200, exp=now - 3600)).decode('utf-8'))
+            other_public_key, _ = rsa.newkeys(1024)
+            signing_keys.keys = {'test-key': other_public_key.save_pkcs1().decode('utf-8')}
+            with self.assertRaises(ValueError):
+                signing_keys.verify(jwt.encode(signer, claims).decode('utf-8'))
+        finally:
+            signing_keys.keys = keys
+
+    def test_signing_keys_missing(self):
+        signing_keys = self.userService.signing_keys
+        claims = {'uid': self.platform_owner_object.uid}
+        # the fetch on start failed, the tokens are verified by firebase until the timer get the keys
+        with mock.patch.object(signing_keys, 'started', True), mock.patch.object(signing_keys, 'keys', {}):
+            with mock.patch.object(signing_keys, 'ensure_timer') as ensure_timer:
+                with mock.patch.object(auth, 'verify_id_token', return_value=claims) as verify_id_token:
+                    self.assertEqual(signing_keys.verify_id_token('token'), claims)
+        verify_id_token.assert_called_once_with('token')
+        ensure_timer.assert_called_once_with()
+
+    def test_principal_loaded_once_per_request(self):
+        user_object = self.login_user(self.platform_owner_user)
+        uid = user_object['uid']
+        headers = {'Authorization': 'Bearer %s' % user_object['idToken']}
+        with self.app.test_request_context('/api/user/{}'.format(uid), headers=headers) as context:
+            with self.assertNumQueries(1, 'the principal is not loaded with his roles in one query'):
+                self.assertIsNone(self.userService.check_user_auth(context.request, True))
+            self.assertEqual(current_principal().uid, uid)
+            with self.assertNumQueries(0, 'the checks of the request user load him again'):
+                self.assertTrue(self.userService.user_exists(uid))
+                self.assertTrue(self.userService.user_has_any_role_matched(uid, [RolesTypes.Owner.value, RolesTypes.Support.value]))
+                self.assertFalse(self.userService.user_has_role_matched(uid, [RolesTypes.Support.value]))
+            # other users are still read from the database
+            self.assertIsNone(current_principal(self.platform_support_object.uid))
+            self.assertTrue(self.userService.user_has_role_matched(self.platform_support_object.uid, [RolesTypes.Support.value]))
+
+    def test_revoked_token_rejected(self):
+        with self.client:
+            user_object = self.login_user(self.platform_support_user)
+            uid = user_object['uid']
+            token = user_object['idToken']
+            query_string = urlencode({'filter_platform': 1, 'per_page': 20, 'page': 1})
+            response = self.request_get('/api/user/list', token, query_string)
+            self.assertRequestPassed(response, 'getting user list request failed')
+
+            revocation = self.userService.revocation
+            claims = {'uid': uid, 'auth_time': int(time.time())}
+            self.assertFalse(revocation.is_revoked(claims))
+            revocation.revoke(uid, claims['auth_time'] + 1)
+            try:
+                self.assertTrue(revocation.is_revoked(claims))
+                self.assertFalse(revocation.is_revoked(dict(claims, auth_time=claims['auth_time'] + 1)))
+                # the claims of the token are cached by now, the revocation is checked on them too
+                response = self.request_get('/api/user/list', token, query_string)
+                self.assert400(response, 'getting user list request passed with a revoked token')
+            finally:
+                revocation.valid_after.pop(uid, None)
+
+    def test_get_user_list_count_strategies(self):
+        with self.client:
+            self.userUtils.create_platforms_users()
+            filters = {
+                'names': [],
+                'emails': [],
+                'stores': [],
+                'countries': [],
+                'store_users': False,
+                'platform': True
+            }
+            exact = self.userService.get_users(filters, [], 5, 1, False)
+            self.assertGreater(exact.pages, 1)
+            self.assertFalse(exact.total_is_estimate)
+
+            # no count at all, the extra row of the page tell if there is a next one
+            with self.count_queries() as statements:
+                skipped = self.userService.get_users(filters, [], 5, 1, False, count=CountStrategy.Skip)
+            self.assertFalse(any('count(' in statement.lower() for statement in statements))
+            self.assertIsNone(skipped.total)
+            self.assertIsNone(skipped.pages)
+            self.assertTrue(skipped.has_next)
+            self.assertListEqual([user.uid for user in skipped.items], [user.uid for user in exact.items])
+            last = self.userService.get_users(filters, [], 5, exact.pages, False, count=CountStrategy.Skip)
+            self.assertFalse(last.has_next)
+            self.assertTrue(last.has_prev)
+
+            # the planner estimate is postgres only, the other databases fall back to the exact count
+            estimated = self.userService.get_users(filters, [], 5, 1, False, count=CountStrategy.Estimate)
+            self.assertEqual(estimated.total, exact.total)
+            self.assertFalse(estimated.total_is_estimate)
+
+            token = self.login_user(self.platform_owner_user)['idToken']
+            query_string = urlencode({'filter_platform': 1, 'per_page': 20, 'page': 1, 'count': CountStrategy.Skip.value})
+            response = self.request_get('/api/user/list', token, query_string)
+            self.assertRequestPassed(response, 'getting user list request failed')
+            response_data = Struct(response.json)
+            self.assertIsNone(response_data.data.meta.total_items)
+            self.assertIsNone(response_data.data.meta.pages)
+            self.assertFalse(response_data.data.meta.next)
+            response = self.request_get('/api/user/list', token, urlencode({'filter_platform': 1, 'per_page': 20, 'page': 1, 'count': 'all'}))
+            self.assert400(response, 'getting user list request passed with an unknown count strategy')
+
+    def cursor_pages(self, filters, orders, per_page, show_store_users=False):
+        """ Pages of get_users_by_cursor walked forward by next_cursor, then back by prev_cursor from the last one """
+        forward = [self.userService.get_users_by_cursor(filters, orders, per_page, None, False, show_store_users)]
+        while forward[-1].next_cursor is not None:
+            forward.append(self.userService.get_users_by_cursor(filters, orders, per_page, forward[-1].next_cursor, False, show_store_users))
+        backward = [forward[-1]]
+        while backward[-1].prev_cursor is not None:
+            backward.append(self.userService.get_users_by_cursor(filters, orders, per_page, backward[-1].prev_cursor, False, show_store_users))
+        return [[user.uid for user in page.items] for page in forward], [[user.uid for user in page.items] for page in reversed(backward)]
+
+    def test_get_users_by_cursor(self):
+        with self.client:
+            self.userUtils.create_platforms_users()
+            filters = {
+                'names': [],
+                'emails': [],
+                'stores': [],
+                'countries': [],
+                'store_users': False,
+                'platform': True
+            }
+            exact = self.userService.get_users(filters, [], 100, 1, False)
+            forward, backward = self.cursor_pages(filters, [], 5)
+            self.assertGreater(len(forward), 2)
+            self.assertTrue(all(len(page) == 5 for page in forward[:-1]))
+            uids = [uid for page in forward for uid in page]
+            self.assertEqual(len(uids), len(set(uids)), 'a user is on two pages')
+            self.assertListEqual(uids, [user.uid for user in sorted(exact.items, key=lambda user: (user.created_at, user.id), reverse=True)])
+            self.assertListEqual(backward, forward)
+
+            # the total is counted only on demand
+            first = self.userService.get_users_by_cursor(filters, [], 5)
+            self.assertIsNone(first.total)
+            self.assertFalse(first.has_prev)
+            self.assertIsNone(first.prev_cursor)
+            counted = self.userService.get_users_by_cursor(filters, [], 5, first.next_cursor, count=CountStrategy.Exact)
+            self.assertEqual(counted.total, exact.total)
+            self.assertTrue(counted.has_prev)
+
+            # a cursor of another ordering, or changed by the client, is refused
+            by_email = [{'field': AllowUserColumnOrderBy.Email, 'sort': AllowSortByDirection.ASC}]
+            with self.assertRaises(ValueError):
+                self.userService.get_users_by_cursor(filters, by_email, 5, first.next_cursor)
+            with self.assertRaises(ValueError):
+                self.userService.get_users_by_cursor(filters, [], 5, first.next_cursor[:-4])
+
+    def test_get_users_by_cursor_nullable_order(self):
+        with self.client:
+            self.userUtils.create_platforms_users()
+            filters = {
+                'names': [],
+                'emails': [],
+                'stores': [],
+                'countries': [],
+                'store_users': True,
+                'platform': True
+            }
+            # half the users have a country / store, NULL is ordered as '' on every database
+            users = User.query.filter_by(is_active=True).order_by(User.id).all()
+            for index, user in enumerate(users):
+                if index % 2:
+                    User.query.filter_by(id=user.id).update({'country': ('IL', 'US', 'FR')[index % 3], 'store_code': 'store-{}'.format(index % 4)})
+            db.session.commit()
+            users = User.query.filter_by(is_active=True).order_by(User.id).all()
+
+            by_country = [{'field': AllowUserColumnOrderBy.Country, 'sort': AllowSortByDirection.ASC}]
+            forward, backward = self.cursor_pages(filters, by_country, 4, True)
+            expected = sorted(users, key=lambda user: (user.country or '', user.id))
+            self.assertListEqual([uid for page in forward for uid in page], [user.uid for user in expected])
+            self.assertListEqual(backward, forward)
+
+            by_store = [{'field': AllowUserColumnOrderBy.Store, 'sort': AllowSortByDirection.DESC}]
+            forward, backward = self.cursor_pages(filters, by_store, 4, True)
+            expected = sorted(users, key=lambda user: user.id)
+            expected = sorted(expected, key=lambda user: user.store_code or '', reverse=True)
+            self.assertListEqual([uid for page in forward for uid in page], [user.uid for user in expected])
+            self.assertListEqual(backward, forward)
+
+    def test_get_user_list_cursor_paging(self):
+        with self.client:
+            for _ in range(3):
+                self.userUtils.create_platforms_users()
+            token = self.login_user(self.platform_owner_user)['idToken']
+            params = {'filter_platform': 1, 'per_page': 20, 'paging': 'cursor'}
+            response = self.request_get('/api/user/list', token, urlencode(params))
+            self.assertRequestPassed(response, 'getting user list by cursor request failed')
+            meta = response.json['data']['meta']
+            self.assertIsNone(meta['total_items'])
+            self.assertIsNone(meta['prev_cursor'])
+            self.assertTrue(meta['next'])
+            first = [user['uid'] for user in response.json['data']['items']]
+
+            response = self.request_get('/api/user/list', token, urlencode(dict(params, cursor=meta['next_cursor'], with_total=1)))
+            self.assertRequestPassed(response, 'getting user list next cursor request failed')
+            second = response.json['data']
+            self.assertFalse(set(first) & {user['uid'] for user in second['items']})
+            self.assertEqual(second['meta']['total_items'], len(first) + len(second['items']))
+            response = self.request_get('/api/user/list', token, urlencode(dict(params, cursor=second['meta']['prev_cursor'])))
+            self.assertRequestPassed(response, 'getting user list prev cursor request failed')
+            self.assertListEqual([user['uid'] for user in response.json['data']['items']], first)
+
+            response = self.request_get('/api/user/list', token, urlencode(dict(params, cursor=meta['next_cursor'], order_by='email|asc')))
+            self.assert400(response, 'getting user list passed with the cursor of another order')
+            response = self.request_get('/api/user/list', token, urlencode(dict(params, cursor=meta['next_cursor'] + 'x')))
+            self.assert400(response, 'getting user list passed with a changed cursor')
+            response = self.request_get('/api/user/list', token, urlencode(dict(params, filter_search='an', search_ranked=1)))
+            self.assert400(response, 'getting user list passed with a ranked search by cursor')
+
+    def test_get_user_list_search_ranked(self):
+        with self.client:
+            names = ['Zed Quill', 'Anna Zedson', 'Zed_ Kim', 'Zedo Zed_']
+            emails = {}
+            for name in names:
+                emails[name] = self.fake.email()
+                self.create_user(emails[name], name, [RolesTypes.Support.value], True)
+            filters = {
+                'names': [],
+                'emails': [],
+                'stores': [],
+                'countries': [],
+                'store_users': False,
+                'platform': True,
+                'search': 'zed',
+                'search_ranked': True
+            }
+            result = self.userService.get_users(filters, [], 20, 1, False)
+            # names starting with the term first
+            self.assertSetEqual({user.fullname for user in result.items[:3]}, {'Zed Quill', 'Zed_ Kim', 'Zedo Zed_'})
+            self.assertEqual(result.items[3].fullname, 'Anna Zedson')
+
+            # the LIKE wildcards of the term are matched literally, by the filter and by the rank
+            result = self.userService.get_users(dict(filters, search='zed_'), [], 20, 1, False)
+            self.assertListEqual([user.fullname for user in result.items], ['Zed_ Kim', 'Zedo Zed_'])
+            result = self.userService.get_users(dict(filters, search='%'), [], 20, 1, False)
+            self.assertEqual(result.total, 0)
+
+            token = self.login_user(self.platform_owner_user)['idToken']
+            query_string = urlencode({'filter_platform': 1, 'filter_search': 'zed_', 'per_page': 20, 'page': 1})
+            response = self.request_get('/api/user/list', token, query_string)
+            self.assertRequestPassed(response, 'getting user list with search request failed')
+            self.assertSetEqual({user['email'] for user in response.json['data']['items']}, {emails['Zed_ Kim'], emails['Zedo Zed_']})
+
+    def test_search_index_matches_word_prefixes(self):
+        with self.client:
+            email = self.fake.email()
+            self.create_user(email, 'Zed Quill', [RolesTypes.Support.value], True)
+            filters = {
+                'names': ['qui'],
+                'emails': [],
+                'stores': [],
+                'countries': [],
+                'store_users': False,
+                'platform': True
+            }
+            self.assertListEqual([user.email for user in self.userService.search_users(filters, [], 20, 1).items], [email])
+            self.assertListEqual([user.email for user in self.userService.get_users(filters, [], 20, 1).items], [email])
+
+            # the index match the start of words (as elasticsearch), the database any substring
+            filters['names'] = ['uill']
+            self.assertListEqual(self.userService.search_users(filters, [], 20, 1).items, [])
+            self.assertListEqual([user.email for user in self.userService.get_users(filters, [], 20, 1).items], [email])
+
+            filters['names'] = []
+            filters['search'] = 'quill zed'
+            self.assertListEqual([user.email for user in self.userService.search_users(filters, [], 20, 1).items], [email])
+            self.assertEqual(self.userService.get_users(filters, [], 20, 1).total, 0)
+
+    def test_list_users_cached_by_scope(self):
+        with self.client, fake_redis():
+            users = self.userUtils.create_platforms_users()
+            names = [users['accounts'][0]['name'], users['support'][0]['name']]
+            filters = {
+                'names': names,
+                'emails': [],
+                'stores': [],
+                'countries': [],
+                'store_users': False,
+                'platform': True
+            }
+            page = self.userService.list_users(filters, [], 20, 1)
+            self.assertEqual(page['total'], 2)
+            # the filters are alternatives, their order is not part of the key
+            with self.assertNumQueries(0, 'the cached user list page is not used'):
+                self.assertDictEqual(self.userService.list_users(dict(filters, names=names[::-1]), [], 20, 1), page)
+
+            # a write in a store keep the platform pages
+            self.userService.invalidate_user_lists('store-code')
+            with self.assertNumQueries(0, 'a store write retired the platform user list pages'):
+                self.assertDictEqual(self.userService.list_users(filters, [], 20, 1), page)
+
+            # a platform user write retire them
+            self.create_user(self.fake.email(), names[0], [RolesTypes.Support.value], True)
+            self.assertEqual(self.userService.list_users(filters, [], 20, 1)['total'], 3)
+
+    def test_firebase_metadata_stale_while_revalidate(self):
+        metadata = self.userService.firebase_metadata
+        uid = self.platform_owner_object.uid
+        display_name = auth.get_user(uid).display_name
+        cached = {'display_name': 'cached name', 'disabled': False}
+        with fake_redis():
+            # fresh, served without firebase
+            metadata.write({uid: dict(cached, fetched_at=time.time())})
+            with mock.patch.object(auth, 'get_user') as get_user, mock.patch.object(metadata, 'refresh_later') as refresh_later:
+                self.assertDictEqual(metadata.get(uid), cached)
+            get_user.assert_not_called()
+            refresh_later.assert_not_called()
+
+            # stale, still served and fetched again in the background
+            metadata.write({uid: dict(cached, fetched_at=time.time() - metadata.ttl - 1)})
+            with mock.patch.object(auth, 'get_user') as get_user, mock.patch.object(metadata, 'refresh_later') as refresh_later:
+                self.assertDictEqual(metadata.get(uid), cached)
+            get_user.assert_not_called()
+            refresh_later.assert_called_once_with(uid)
+            metadata.refresh(uid)
+            self.assertEqual(metadata.get_many([uid])[uid]['display_name'], display_name)
+
+            # expired, fetched before it is served
+            metadata.write({uid: dict(cached, fetched_at=time.time() - metadata.stale_ttl - 1)})
+            self.assertDictEqual(metadata.get_many([uid]), {})
+            self.assertEqual(metadata.get(uid)['display_name'], display_name)
+
+    def test_toggle_freeze_user_firebase_failed(self):
+        uid = self.platform_support_object.uid
+        self.assertTrue(self.userService.get_user(uid, True).is_active)
+        with mock.patch.object(auth, 'update_user', side_effect=FirebaseError('UNAVAILABLE', 'firebase is down')):
+            with self.assertRaises(FirebaseError):
+                self.userService.toggle_freeze_user(uid)
+        # the row is not left frozen while firebase still accept the user
+        self.assertTrue(self.userService.get_user(uid, True).is_active)
+        self.assertTrue(self.userService.user_exists(uid))
+        self.assertFalse(self.userService.revocation.is_revoked({'uid': uid, 'auth_time': int(time.time())}))
+
+        self.assertIsNotNone(self.userService.toggle_freeze_user(uid))
+        self.assertFalse(self.userService.get_user(uid, True).is_active)
+        self.assertTrue(auth.get_user(uid).disabled)
+
+    def test_user_cache_hits_and_invalidation(self):
+        uid = self.platform_support_object.uid
+        user_cache = self.userService.user_cache
+        with fake_redis():
+            hits, misses = user_cache.hits, user_cache.misses
+            with self.assertNumQueries(1, 'the user was not loaded on a miss'):
+                record = self.userService.get_user_record(uid)
+            self.assertEqual(user_cache.misses, misses + 1)
+            with self.assertNumQueries(0, 'the cached user was not used'):
+                self.assertEqual(self.userService.get_user_record(uid), record)
+            self.assertEqual(user_cache.hits, hits + 1)
+
+            # a write retire the cached user, the next read load the committed row
+            user_data = Struct({'fullname': 'updated name', 'address1': 'address 1', 'address2': 'address 2', 'country': 'US', 'currency': 'USD'})
+            self.assertIsNotNone(self.userService.update_user_info(uid, user_data))
+            self.assertIsNone(user_cache.get(uid))
+            with self.assertNumQueries(1, 'the written user was not loaded again'):
+                self.assertEqual(self.userService.get_user_record(uid)['fullname'], 'updated name')
+            self.assertEqual(user_cache.get(uid)['fullname'], 'updated name')
+
+    def test_cache_stats_restricted(self):
+        with self.client:
+            response = self.request_get('/api/ping/cache', 'invalid-token')
+            self.assert400(response, 'cache stats request passed without a valid token')
+            token = self.login_user(self.platform_account_user)['idToken']
+            response = self.request_get('/api/ping/cache', token)
+            self.assert401(response, 'cache stats request passed without an ops role')
+            token = self.login_user(self.platform_support_user)['idToken']
+            response = self.request_get('/api/ping/cache', token)
+            self.assertRequestPassed(response, 'cache stats request failed')
+            self.assertIn('user', response.json['data'])
+            # not json, the role is checked all the same
+            response = self.client.get('/api/ping/cache')
+            self.assert400(response, 'cache stats request passed without a token')
+            token = self.login_user(self.platform_account_user)['idToken']
+            response = self.client.get('/api/ping/cache', headers={'Authorization': 'Bearer %s' % token})
+            self.assert401(response, 'cache stats request passed without an ops role')
+
+    def test_near_cache_dropped_by_message(self):
+        uid = self.platform_support_object.uid
+        near = self.userService.user_cache.near
+        with fake_redis():
+            self.userService.get_user_record(uid)
+            self.assertIsNotNone(near.get(uid))
+            generation = near.generation()
+
+            # another worker wrote the user
+            handle_message(json.dumps({'cache': near.name, 'keys': [uid]}))
+            self.assertIsNone(near.get(uid))
+            # a payload read before the message is not kept
+            near.set(uid, b'stale payload', generation)
+            self.assertIsNone(near.get(uid))
+
+            self.userService.get_user_record(uid)
+            handle_message(json.dumps({'cache': 'record:other', 'keys': [uid]}))
+            self.assertIsNotNone(near.get(uid))
+
+    def test_missing_user_cached(self):
+        email = self.fake.email()
+        firebase_user = create_firebase_user(email, self.global_password)
+        with fake_redis():
+            self.assertFalse(self.userService.user_exists(firebase_user.uid))
+            with self.assertNumQueries(0, 'missing user was not cached'):
+                self.assertFalse(self.userService.user_exists(firebase_user.uid))
+            # the user row replace the cached miss
+            roles = self.roleService.get_roles([RolesTypes.Support.value])
+            self.userService.sync_firebase_user(firebase_user.uid, roles, email, self.fake.name(), True)
+            self.assertTrue(self.userService.user_exists(firebase_user.uid))
+
+    def test_get_user_object_not_modified(self):
+        with self.client, fake_redis():
+            uid = self.platform_support_object.uid
+            response = self.request_get('/api/user/{}'.format(uid), None)
+            self.assertRequestPassed(response, 'get user request failed')
+            etag = response.headers.get('ETag')
+            self.assertIsNotNone(etag)
+            response = self.request_get('/api/user/{}'.format(uid), None, extra_headers={'If-None-Match': etag})
+            self.assertStatus(response, 304)
+            self.assertEqual(response.data, b'')
+
+            # the firebase metadata change without a write here, the old tag is not answered with a 304
+            auth.update_user(uid, display_name='renamed in firebase')
+            self.userService.firebase_metadata.forget(uid)
+            response = self.request_get('/api/user/{}'.format(uid), None, extra_headers={'If-None-Match': etag})
+            self.assertRequestPassed(response, 'get user after firebase change request failed')
+            self.assertNotEqual(response.headers.get('ETag'), etag)
+            self.assertEqual(response.json['data']['user_meta']['display_name'], 'renamed in firebase')
+
+    def test_get_utils_not_modified(self):
+        with self.client, fake_redis():
+            for url in ('/api/utils/countries', '/api/utils/currencies'):
+                response = self.client.get(url)
+                self.assertRequestPassed(response, 'get {} request failed'.format(url))
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                self.assertIsNotNone(etag)
+                self.assertIsNotNone(last_modified)
+                self.assertIn('max-age', response.headers.get('Cache-Control'))
+                response = self.client.get(url, headers={'If-None-Match': etag})
+                self.assertStatus(response, 304)
+                response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+                self.assertStatus(response, 304)
+                response = self.client.get(url, headers={'If-None-Match': '"other-tag"'})
+                self.assert200(response, 'get {} with another tag request failed'.format(url))
+
 
 if __name__ == '__main__':
     unittest.main()
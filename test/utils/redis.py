@@ -0,0 +1,37 @@
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+import fakeredis
+
+from src.utils import near_cache
+
+# modules holding their own reference of config.api.redis_client
+REDIS_MODULES = (
+    'src.services.firebase_metadata',
+    'src.services.known_keys',
+    'src.services.store',
+    'src.services.token_cache',
+    'src.utils.caching',
+    'src.utils.generations',
+    'src.utils.memoize',
+    'src.utils.near_cache',
+    'src.utils.record_cache',
+)
+
+
+@contextmanager
+def fake_redis():
+    """
+    Run the block against an in memory redis (fakeredis), the near caches are enabled and emptied around it
+    the invalidation listener is not started, a test deliver the messages itself with near_cache.handle_message
+    """
+    client = fakeredis.FakeStrictRedis()
+    with ExitStack() as stack:
+        for module in REDIS_MODULES:
+            stack.enter_context(mock.patch('{}.redis_client'.format(module), client))
+        stack.enter_context(mock.patch.object(near_cache, 'listener_thread', mock.sentinel.listener_thread))
+        for near in list(near_cache.NEAR_CACHES.values()):
+            stack.enter_context(mock.patch.object(near, 'enabled', True))
+            near.clear()
+            stack.callback(near.clear)
+        yield client